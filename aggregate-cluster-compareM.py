@@ -8,6 +8,8 @@ import pandas as pd
 
 from collections import defaultdict, namedtuple
 
+from tableio import TableWriter
+
 anchorCompareM = namedtuple('anchorCompareM',
                            'comparison_name, anchor_name, ref_name, cluster, mean_aai, std_aai, genes_in_anchor, genes_in_ref, orthologous_genes, orthologous_fraction')
 
@@ -19,7 +21,8 @@ def main(args):
     compareInfo["cluster_members"] = compareInfo["cluster_members"].str.split(";")
     # load compareM files
     compareM_info= [tuple(x.strip().split(',')) for x in open(args.comparem_tsv_filecsv, "r")]
-    anchor_results = []
+    # anchor results are written (csv or parquet) as they're found
+    writer = TableWriter(args.output_csv, anchorCompareM._fields, output_format=args.output_format)
     for (cluster, inF) in compareM_info:
         anchor_acc = compareInfo.at[cluster, "cluster_anchor"]
 
@@ -53,13 +56,9 @@ def main(args):
             num_orthologous_genes = comparison_info["# orthologous genes"].values[0]
             orthologous_fraction = comparison_info["Orthologous fraction (OF)"].values[0]
             this_info = anchorCompareM(comparison_name, anchor_acc, compare_acc, cluster, mean_aai, std_aai, anchor_genes, ref_genes, num_orthologous_genes, orthologous_fraction)
-            anchor_results.append(this_info)
-
-    # convert path aai comparison info to pandas dataframe
-    anchor_aaiDF = pd.DataFrame.from_records(anchor_results, columns = anchorCompareM._fields)
+            writer.append(this_info)
 
-    # print to csv
-    anchor_aaiDF.to_csv(args.output_csv, index=False)
+    writer.close()
     print(f"done! path comparison info written to {args.output_csv}")
 
 
@@ -70,7 +69,8 @@ def cmdline(sys_args):
     p.add_argument("--comparison-info")
     p.add_argument("--signame-prefix", default="pigeon1.0-")
     p.add_argument("--signame-suffix", default=".proteins")
-    p.add_argument("--output-csv", required=True)
+    p.add_argument("--output-csv", required=True, help="output table: csv, csv.gz, or .parquet")
+    p.add_argument("--output-format", choices=["csv", "parquet"], help="output table format (default: from the output filename)")
     args = p.parse_args()
     return main(args)
 
@@ -9,14 +9,18 @@ import pandas as pd
 
 from collections import defaultdict, namedtuple
 
+from tableio import TableWriter
+
 anchorfastANI = namedtuple('anchorFastANI',
                            'comparison_name, anchor_name, ref_name, cluster, fastani_ident, num_bidirectional_fragment_mappings, total_query_fragments')
 
 #compare_ranklist = ["genus", "family", "order", "class", "order", "class", "phylum", "superkingdom"]
 
 def main(args):
-    anchor_results = []
-
+    # anchor results are written (csv or parquet) as they're found; comparisons
+    # fastani didn't report are NaN, so its columns are always floats
+    writer = TableWriter(args.output_csv, anchorfastANI._fields, output_format=args.output_format,
+                         dtypes={col: float for col in anchorfastANI._fields[4:]})
     compareInfo = pd.read_csv(args.comparison_info).set_index("cluster")
     compareInfo["cluster_members"] = compareInfo["cluster_members"].str.split(";")
     # loop through fastani comparison files
@@ -27,8 +31,8 @@ def main(args):
         fastani = pd.read_csv(inF, sep = "\t", header=None, names=['anchor','ref','fastani_ident','count_bidirectional_frag_mappings','total_query_frags'])
         if fastani.empty:
             continue
-        fastani["anchor"] = fastani["anchor"].str.rsplit("/", 1, expand=True)[1].str.rsplit("_genomic.fna.gz", 1, expand=True)[0]
-        fastani["ref"] = fastani["ref"].str.rsplit("/", 1, expand=True)[1].str.rsplit("_genomic.fna.gz", 1, expand=True)[0]
+        fastani["anchor"] = fastani["anchor"].str.rsplit("/", n=1, expand=True)[1].str.rsplit("_genomic.fna.gz", n=1, expand=True)[0]
+        fastani["ref"] = fastani["ref"].str.rsplit("/", n=1, expand=True)[1].str.rsplit("_genomic.fna.gz", n=1, expand=True)[0]
         fastani.set_index("ref",inplace=True)
 
         # now check comparisons for results:
@@ -45,13 +49,9 @@ def main(args):
                 query_frags = fastani.at[compare_acc, "total_query_frags"]
 
             this_info = anchorfastANI(comparison_name, anchor_acc, compare_acc, cluster, fastani_ident, bidirectional_mappings, query_frags)
-            anchor_results.append(this_info)
-
-    # convert path aai comparison info to pandas dataframe
-    anchor_aniDF = pd.DataFrame.from_records(anchor_results, columns = anchorfastANI._fields)
+            writer.append(this_info)
 
-    # print to csv
-    anchor_aniDF.to_csv(args.output_csv, index=False)
+    writer.close()
     print(f"done! path comparison info written to {args.output_csv}")
 
 
@@ -60,7 +60,8 @@ def cmdline(sys_args):
     p = argparse.ArgumentParser()
     p.add_argument("--fastani-filecsv")
     p.add_argument("--comparison-info")
-    p.add_argument("--output-csv", required=True)
+    p.add_argument("--output-csv", required=True, help="output table: csv, csv.gz, or .parquet")
+    p.add_argument("--output-format", choices=["csv", "parquet"], help="output table format (default: from the output filename)")
     args = p.parse_args()
     return main(args)
 
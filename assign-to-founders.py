@@ -0,0 +1,141 @@
+#! /usr/bin/env python
+"""
+Assign every member signature to its best-matching cluster founder.
+
+This replaces running `sourmash search --max-containment --best-only` once per
+member sig: the founders are loaded once into a HashStore plus an inverted
+hash index, and all members are streamed through it in a single process.
+Each member is compared only to founders it shares hashes with; the founder
+with the highest max containment wins (ties go to the earlier founder).
+
+The cluster info csv is written directly, one row per member:
+cluster (founder number), founder name and sigfile, member name and sigfile,
+max containment and number of common hashes. Members with no founder above
+--threshold get empty cluster/founder fields. Max containment is
+bias-corrected, as sourmash's is.
+
+This code is under CC0.
+"""
+import os
+import sys
+import csv
+import argparse
+from collections import Counter, defaultdict, namedtuple
+
+import numpy as np
+from sourmash.logging import notify
+
+from hashstore import HashIndex, HashStore, containment_denominators, sorted_hashes
+from sigdb import load_signatures, split_location
+
+ClusterInfo = namedtuple('ClusterInfo',
+                         'cluster, founder, founder_sigfile, member, member_sigfile, max_containment, common_hashes')
+
+
+def read_siglist_csv(filename):
+    "read 'name,sigfile' lines, as written by find-founders.py"
+    rows = []
+    with open(filename, 'rt') as fp:
+        for line in fp:
+            line = line.rstrip()
+            if line:
+                # names can contain commas; sigfiles shouldn't
+                name, sigfile = line.rsplit(',', 1)
+                rows.append((name, sigfile))
+    return rows
+
+
+def load_named_sigs(rows, moltype, ksize, sigdir=None):
+    """
+    Yield (sigfile, sig) for every (name, sigfile) row, opening each sigfile
+    only once. Sigs are yielded in sigfile first-seen order; a row listed
+    twice is yielded twice. A sigfile can be a single database sketch
+    ({database}#{md5sum}, see sigdb.py), which is read by random access.
+    """
+    names_by_file = defaultdict(Counter)
+    for name, sigfile in rows:
+        names_by_file[sigfile][name] += 1
+    for sigfile, names in names_by_file.items():
+        filename = sigfile
+        if not os.path.exists(split_location(filename)[0]) and sigdir:
+            filename = os.path.join(sigdir, filename)
+        for sig in load_signatures(filename, ksize=ksize, moltype=moltype):
+            for _ in range(names[str(sig)]):
+                yield sigfile, sig
+
+
+def best_founder(index, founder_sizes, hashes, scaled=None):
+    """
+    Find the founder with the highest max containment to this member.
+    Returns (founder_n, max_containment, common_hashes); founder_n is None
+    if the member shares no hashes with any founder.
+    """
+    common_counts = index.count_common(hashes)
+    if not common_counts:
+        return (None, 0.0, 0)
+    founders = np.array(sorted(common_counts), dtype=np.int64)
+    n_common = np.array([common_counts[founder_n] for founder_n in founders.tolist()])
+    # sourmash's max_containment: over the smaller sketch, bias-corrected, clamped to 1
+    min_sizes = np.minimum(len(hashes), founder_sizes[founders])
+    max_contain = np.minimum(n_common / containment_denominators(min_sizes, scaled), 1.0)
+    # argmax takes the first of any ties, i.e. the earlier founder
+    best = int(np.argmax(max_contain))
+    return (int(founders[best]), float(max_contain[best]), int(n_common[best]))
+
+
+def main(args):
+    # load founders once
+    notify(f'loading founders from {args.founders_csv}')
+    store = HashStore()
+    founder_rows = read_siglist_csv(args.founders_csv)
+    for sigfile, sig in load_named_sigs(founder_rows, args.moltype, args.ksize, sigdir=args.sigdir):
+        store.add_signature(sigfile, sig)
+    notify(f'...got {len(store)} founder signatures.')
+    notify(store.memory_report())
+
+    index = HashIndex()
+    for founder_n in range(len(store)):
+        index.add(founder_n, store.get_hashes(founder_n))
+    founder_sizes = store.sizes
+
+    # stream members through the index
+    member_rows = read_siglist_csv(args.members_csv)
+    num_members = len(member_rows)
+    notify(f'assigning {num_members} members to {len(store)} founders')
+    num_assigned = 0
+    with open(args.output_csv, 'wt', newline='') as fp:
+        w = csv.writer(fp)
+        w.writerow(ClusterInfo._fields)
+        for n, (member_from, member) in enumerate(load_named_sigs(member_rows, args.moltype, args.ksize, sigdir=args.sigdir)):
+            if n % 10000 == 0:
+                notify(f'...assigning member {n+1}/{num_members}')
+            founder_n, max_contain, n_common = best_founder(index, founder_sizes, sorted_hashes(member.minhash),
+                                                         store.scaled)
+            if founder_n is not None and max_contain >= args.threshold:
+                num_assigned += 1
+                info = ClusterInfo(founder_n, store.names[founder_n], store.sources[founder_n],
+                                   str(member), member_from, max_contain, n_common)
+            else:
+                info = ClusterInfo("", "", "", str(member), member_from, max_contain, n_common)
+            w.writerow(info)
+
+    notify(f'assigned {num_assigned} of {num_members} members to a founder; cluster info written to {args.output_csv}')
+
+
+def cmdline(sys_args):
+    "Command line entry point w/argparse action."
+    p = argparse.ArgumentParser()
+    p.add_argument("--founders-csv", required=True, help="founders 'name,sigfile' csv from find-founders.py")
+    p.add_argument("--members-csv", required=True, help="members 'name,sigfile' csv from find-founders.py")
+    p.add_argument("--sigdir", help="dir to look in for sigs")
+    p.add_argument('-k', '--ksize', type=int, default=31)
+    p.add_argument('--moltype', default='DNA')
+    p.add_argument('--threshold', type=float, default=0.01,
+                   help='minimum max containment for a member to join a cluster')
+    p.add_argument("--output-csv", required=True)
+    args = p.parse_args()
+    return main(args)
+
+if __name__ == '__main__':
+    returncode = cmdline(sys.argv[1:])
+    sys.exit(returncode)
@@ -0,0 +1,222 @@
+#! /usr/bin/env python
+"""
+Benchmark find-founders.py and cluster-sigs.py on synthetic signatures.
+
+Synthetic sourmash signatures with a known cluster structure are generated
+for every (number of sigs, founder density) combination: founder density
+is the fraction of sigs that start a new cluster. Each cluster has a random
+"founder" hash set; members keep a fraction (--member-similarity) of their
+founder's hashes and add some random ones of their own.
+
+Each clustering script is then run as a separate process over a grid of
+--threshold and --batch-size values. For every run we record wall time,
+peak memory (max RSS of that process, from wait4), the number of founders
+found, and the comparison counts the scripts write to
+{prefix}.comparisons.csv. Results are written as csv and/or json, one
+record per run, so timings can be compared across code changes.
+
+Example:
+  python benchmark-clustering.py --num-sigs 1000 5000 --threshold 0.05 0.2 \\
+         --batch-size 500 5000 --founder-density 0.05 0.3 --output-csv bench.csv
+
+This code is under CC0.
+"""
+import os
+import sys
+import time
+import json
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+import sourmash
+from sourmash import MinHash, SourmashSignature
+from sourmash.logging import notify
+from sourmash.minhash import _get_max_hash_for_scaled
+
+BenchResult = namedtuple('BenchResult',
+                         'script, num_sigs, founder_density, threshold, batch_size, processes, repeat, '
+                         'returncode, wall_seconds, peak_rss_mb, num_founders, pairs_considered, pairs_tested, '
+                         'pairs_skipped, pairs_pruned, hashes_checked')
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS = {"find-founders": "find-founders.py",
+           "cluster-sigs": "cluster-sigs.py"}
+
+
+def make_synthetic_sigs(num_sigs, founder_density, sig_size, member_similarity,
+                        ksize, moltype, scaled, seed):
+    """
+    Generate num_sigs signatures in about founder_density * num_sigs clusters.
+    Sig sizes are lognormal around sig_size hashes.
+    """
+    rng = np.random.default_rng(seed)
+    max_hash = _get_max_hash_for_scaled(scaled)
+    num_clusters = max(1, int(round(founder_density * num_sigs)))
+
+    def random_hashes(n):
+        return rng.integers(1, max_hash, size=n, dtype=np.uint64, endpoint=True)
+
+    def random_size():
+        return max(1, int(rng.lognormal(np.log(sig_size), 0.5)))
+
+    founders = [random_hashes(random_size()) for _ in range(num_clusters)]
+    sigs = []
+    for n in range(num_sigs):
+        if n < num_clusters:
+            # every cluster gets its founder in the set
+            hashes = founders[n]
+        else:
+            founder = founders[rng.integers(num_clusters)]
+            kept = founder[rng.random(len(founder)) < member_similarity]
+            extra = random_hashes(int(len(founder) * (1 - member_similarity)))
+            hashes = np.concatenate([kept, extra])
+        mh = MinHash(n=0, ksize=ksize, scaled=scaled, is_protein=(moltype == "protein"))
+        mh.add_many(np.unique(hashes).tolist())
+        sigs.append(SourmashSignature(mh, name=f"synthetic_{n}"))
+    # input order shouldn't follow the cluster structure
+    order = rng.permutation(num_sigs)
+    return [sigs[i] for i in order]
+
+
+def read_comparison_counts(filename):
+    "sum the threshold-test counts a clustering run wrote, if any"
+    counts = dict.fromkeys(['pairs_considered', 'pairs_tested', 'pairs_skipped', 'pairs_pruned', 'hashes_checked'])
+    if not os.path.exists(filename):
+        return counts
+    totals = pd.read_csv(filename).sum(numeric_only=True)
+    get = lambda field: int(totals.get(field, 0))
+    counts['pairs_tested'] = get('pairs')
+    counts['pairs_skipped'] = get('skipped')
+    counts['pairs_pruned'] = get('pruned_size') + get('pruned_range') + get('prefiltered')
+    counts['pairs_considered'] = counts['pairs_tested'] + counts['pairs_skipped'] + get('prefiltered')
+    counts['hashes_checked'] = get('hashes_checked')
+    return counts
+
+
+def count_lines(filename):
+    if not os.path.exists(filename):
+        return None
+    with open(filename, 'rt') as fp:
+        return sum(1 for line in fp if line.strip())
+
+
+def run_case(script, sigfile, workdir, args, threshold, batch_size, run_name):
+    """
+    Run one clustering script in its own process; return
+    (returncode, wall seconds, peak RSS in MB, output prefix).
+    """
+    prefix = os.path.join(workdir, run_name)
+    cmd = [sys.executable, os.path.join(SCRIPT_DIR, SCRIPTS[script]),
+           '--signature_sources', sigfile, '-k', str(args.ksize), '--moltype', args.moltype,
+           '--threshold', str(threshold), '--batch-size', str(batch_size),
+           '--seed', str(args.seed), '--prefix', prefix]
+    if script == "find-founders":
+        cmd += ['--processes', str(args.processes)]
+    with open(prefix + '.log', 'wt') as log:
+        start = time.perf_counter()
+        proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT)
+        # wait4 gives the resource usage of this one child, not all children so far
+        _, status, rusage = os.wait4(proc.pid, 0)
+        wall = time.perf_counter() - start
+    # max RSS of the child (and its worker processes' largest), kB on linux, bytes on macOS
+    peak_rss_mb = rusage.ru_maxrss / (1024**2 if sys.platform == 'darwin' else 1024)
+    returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    return returncode, wall, peak_rss_mb, prefix
+
+
+def main(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix="benchmark-clustering.")
+    os.makedirs(workdir, exist_ok=True)
+    notify(f'benchmarking {", ".join(args.scripts)} in {workdir}')
+
+    results = []
+    for num_sigs in args.num_sigs:
+        for density in args.founder_density:
+            sigs = make_synthetic_sigs(num_sigs, density, args.sig_size, args.member_similarity,
+                                       args.ksize, args.moltype, args.scaled, args.seed)
+            sigfile = os.path.join(workdir, f'synthetic.n{num_sigs}.d{density}.sig')
+            with open(sigfile, 'wt') as fp:
+                sourmash.save_signatures(sigs, fp)
+            notify(f'generated {num_sigs} synthetic signatures, founder density {density}')
+
+            for script in args.scripts:
+                for threshold in args.threshold:
+                    for batch_size in args.batch_size:
+                        for repeat in range(args.repeats):
+                            run_name = f'{script}.n{num_sigs}.d{density}.t{threshold}.b{batch_size}.r{repeat}'
+                            returncode, wall, peak_rss_mb, prefix = run_case(script, sigfile, workdir, args,
+                                                                             threshold, batch_size, run_name)
+                            if returncode != 0:
+                                notify(f'** {run_name} failed (exit code {returncode}); see {prefix}.log')
+                            if script == "find-founders":
+                                num_founders = count_lines(f'{prefix}.founders.siglist.txt')
+                            else:
+                                num_founders = count_lines(f'{prefix}.founders.siglist')
+                            counts = read_comparison_counts(f'{prefix}.comparisons.csv')
+                            result = BenchResult(script, num_sigs, density, threshold, batch_size,
+                                                 args.processes if script == "find-founders" else 1, repeat,
+                                                 returncode, round(wall, 3), round(peak_rss_mb, 1),
+                                                 num_founders, **counts)
+                            notify(f'{run_name}: {result.wall_seconds}s, {result.peak_rss_mb} MB peak, '
+                                   f'{num_founders} founders, {counts["pairs_tested"]} pairs tested')
+                            results.append(result)
+
+    resultsDF = pd.DataFrame.from_records(results, columns = BenchResult._fields)
+    if args.output_csv:
+        resultsDF.to_csv(args.output_csv, index=False)
+        notify(f'results written to {args.output_csv}')
+    if args.output_json:
+        info = {"python": platform.python_version(),
+                "platform": platform.platform(),
+                "sourmash": sourmash.VERSION,
+                "parameters": {key: val for key, val in vars(args).items() if key not in ('output_csv', 'output_json')},
+                # round trip through pandas' json, so numpy types and NaN serialize cleanly
+                "results": json.loads(resultsDF.to_json(orient="records"))}
+        with open(args.output_json, 'wt') as fp:
+            json.dump(info, fp, indent=2)
+        notify(f'results written to {args.output_json}')
+
+    if not args.keep_workdir and not args.workdir:
+        shutil.rmtree(workdir)
+    return int(any(result.returncode for result in results))
+
+
+def cmdline(sys_args):
+    "Command line entry point w/argparse action."
+    p = argparse.ArgumentParser()
+    p.add_argument("--scripts", nargs='+', choices=sorted(SCRIPTS), default=["find-founders"],
+                   help="clustering scripts to benchmark")
+    p.add_argument("--num-sigs", nargs='+', type=int, default=[500, 2000])
+    p.add_argument("--threshold", nargs='+', type=float, default=[0.05, 0.2])
+    p.add_argument("--batch-size", nargs='+', type=int, default=[500, 5000])
+    p.add_argument("--founder-density", nargs='+', type=float, default=[0.1, 0.5],
+                   help="fraction of sigs that start their own cluster")
+    p.add_argument("--member-similarity", type=float, default=0.6,
+                   help="fraction of founder hashes each cluster member keeps")
+    p.add_argument("--sig-size", type=int, default=300, help="typical number of hashes per signature")
+    p.add_argument('-k', '--ksize', type=int, default=10)
+    p.add_argument('--moltype', default='protein', choices=['protein', 'DNA'])
+    p.add_argument('--scaled', type=int, default=100)
+    p.add_argument('--seed', type=int, default=1)
+    p.add_argument('--processes', type=int, default=1, help="--processes for find-founders.py")
+    p.add_argument('--repeats', type=int, default=1, help="runs per grid point")
+    p.add_argument("--workdir", help="directory for synthetic sigs and run outputs (default: a temporary dir, removed afterwards)")
+    p.add_argument("--keep-workdir", action="store_true", help="keep the temporary workdir")
+    p.add_argument("--output-csv", help="write results to this csv")
+    p.add_argument("--output-json", help="write results, plus run environment, to this json")
+    args = p.parse_args()
+    if not any([args.output_csv, args.output_json]):
+        print("Please provide an output file via '--output-csv' or '--output-json'")
+        sys.exit(-1)
+    return main(args)
+
+if __name__ == '__main__':
+    returncode = cmdline(sys.argv[1:])
+    sys.exit(returncode)
@@ -13,98 +13,125 @@ from sourmash.sourmash_args import load_file_as_signatures
 
 from collections import defaultdict, namedtuple
 
-CompareResult = namedtuple('CompareResult',
-                           'comparison_name, anchor_name, ref_name, cluster_name, alphabet, ksize, scaled, jaccard, max_containment, anchor_containment, anchor_hashes, query_hashes, num_common')
+from hashstore import HashStore
+from tableio import TableWriter
+from clustercompare import (alpha_ksizes, cluster_jobs, compare_clusters, needed_accessions,
+                            read_comparison_csv, result_columns, results_frame)
+from sigdb import is_json_sigfile, load_selected_signatures, matching_param
 
 
-def load_sigs_from_list(siglistfiles, moltype, ksize, sigdir=None):
+def load_sigs_from_list(siglistfiles, stores, sigdir=None, names=None, stream=False):
     # input lists of signatures instead
     #sigs = []
-    sigs = {}
     for sl in siglistfiles:
         notify(f'loading from {sl}')
         sigfiles = sourmash.sourmash_args.load_file_list_of_signatures(sl)
-        new_sigs = load_sigs(sigfiles, moltype, ksize, source_type= "input sigfile list", sigdir=sigdir)
-        notify(f'...got {len(new_sigs.keys())} signatures from {sl} siglist file.')
-        #sigs+=new_sigs
-        sigs.update(new_sigs)
-    return sigs
-
-def load_sigs(sig_sources, moltype, ksize, source_type="input sigfiles", sigdir=None):
-    siglist=[]
-    sigD = {}
+        m = load_sigs(sigfiles, stores, source_type= "input sigfile list", sigdir=sigdir,
+                      names=names, stream=stream)
+        notify(f'...got {m} signatures from {sl} siglist file.')
+
+def load_sigs(sig_sources, stores, source_type="input sigfiles", sigdir=None, names=None, stream=False):
+    """
+    Load sigs into stores, {(ksize, moltype): (HashStore, {name: row})},
+    reading each file once for all the ksizes/moltypes. With names, keep
+    only those sigs; with stream too, JSON sig files are scanned and only
+    the named sigs are parsed. Returns the number of sigs loaded.
+    """
+    params = list(stores)
+    if len(params) == 1:
+        # let sourmash do the selecting
+        (ksize, moltype), = params
+    else:
+        ksize, moltype = None, None
+    total = 0
     for filename in sig_sources:
         if not os.path.exists(filename) and sigdir:
             filename = os.path.join(sigdir, filename)
         if source_type != "input sigfile list":
             notify(f'loading from {filename}')
-        m = 0
-        for sig in sourmash.sourmash_args.load_file_as_signatures(filename,
+        if stream and names is not None and is_json_sigfile(filename):
+            sigs = load_selected_signatures(filename, names, params=params)
+        else:
+            sigs = sourmash.sourmash_args.load_file_as_signatures(filename,
                                            select_moltype=moltype,
-                                           ksize=ksize):
+                                           ksize=ksize)
+        m = 0
+        for sig in sigs:
+            if names is not None and str(sig) not in names:
+                continue
+            param = matching_param(sig, params)
+            if param is None:
+                continue
             m += 1
-            #siglist.append((filename, sig))
-            sigD[str(sig)] =  sig
+            # pack hashes into one store per ksize/moltype; look sigs up by name
+            store, rowD = stores[param]
+            rowD[str(sig)] = store.add_signature(sig.filename, sig)
         if source_type != "input sigfile list":
             notify(f'...got {m} signatures from {source_type}.')
-    #return siglist
-    return sigD
-
-def compare_sigs(sigA, sigB, comparison_name, cluster_name, alpha, ksize, scaled):
-    sigA_numhashes = len(sigA.minhash.hashes)
-    sigB_numhashes = len(sigB.minhash.hashes)
-    intersect_numhashes = sigA.minhash.count_common(sigB.minhash)
-    jaccard = sigA.jaccard(sigB)
-    containA = sigA.contained_by(sigB)
-    max_contain = sigA.max_containment(sigB)
-    #max_contain = max(containA,containB)
-    return CompareResult(comparison_name, str(sigA).split(" ")[0], str(sigB).split(" ")[0], cluster_name, alpha, ksize, scaled, jaccard, max_contain, containA, sigA_numhashes, sigB_numhashes, intersect_numhashes)
+        total += m
+    return total
 
 def main(args):
-    ksize=args.ksize
     scaled=args.scaled
-    alphabet=args.alphabet
     sigext = args.sig_extension
-    if alphabet == "nucleotide":
-        moltype = "DNA"
-    else:
-        moltype = alphabet
+    pairs = alpha_ksizes(args.alpha_ksize, args.alphabet, args.ksize)
+    if len(pairs) > 1:
+        notify(f'comparing at {len(pairs)} alphabet/ksizes: {", ".join(f"{p.alphabet}-k{p.ksize}" for p in pairs)}')
 
-    sigD = {}
-    # load all sigs
+    compareInfo = read_comparison_csv(args.comparison_csv)
+
+    # only the anchors and members of the clusters being compared are needed
+    names = None
+    if args.stream:
+        names = set(needed_accessions(compareInfo))
+        notify(f'selecting {len(names)} signatures needed by {len(compareInfo)} cluster comparisons')
+
+    # load all sigs, for every alphabet/ksize in the same pass
+    stores = {(pair.ksize, pair.moltype): (HashStore(), {}) for pair in pairs}
     if args.sigfiles:
         #siglist = load_sigs(args.sigfiles, args.moltype, args.ksize, sigdir=args.sigdir)
-        sigD.update(load_sigs(args.sigfiles, moltype, args.ksize, sigdir=args.sigdir))
+        load_sigs(args.sigfiles, stores, sigdir=args.sigdir, names=names, stream=args.stream)
     if args.siglist:
         #siglist+= load_sigs_from_list(args.siglist, args.moltype, args.ksize, sigdir=args.sigdir)
-        sigD.update(load_sigs_from_list(args.siglist, moltype, args.ksize, sigdir=args.sigdir))
-
-    cluster_comparisons = []
-    compareInfo = pd.read_csv(args.comparison_csv).set_index("cluster")
-    compareInfo["cluster_members"] = compareInfo["cluster_members"].str.split(";")
-    # loop through comparisons
-    for n, cluster in enumerate(compareInfo.index):
-        anchor_acc = compareInfo.at[cluster, "cluster_anchor"]
-        if n !=0 and n % 50 == 0:
-            print(f"... assessing {n}th cluster comparison, cluster name: {cluster}, anchor: {anchor_acc}\n")
-
-        # select and load anchor sig
-        anchor_sig = sigD[anchor_acc]
-
-        # iterate through comparison sigs
-        compare_accs = compareInfo.at[cluster, "cluster_members"]
-        for compare_acc in compare_accs:
-            if compare_acc != anchor_acc:
-                # select and load comparison sig
-                compare_sig = sigD[compare_acc]
-                comparison = compare_sigs(anchor_sig, compare_sig, f"{anchor_acc}_x_{compare_acc}", cluster, alphabet, ksize, scaled)
-                cluster_comparisons.append(comparison)
-
-    # convert path comparison info to pandas dataframe
-    comparisonDF = pd.DataFrame.from_records(cluster_comparisons, columns = CompareResult._fields)
-
-    # print to csv
-    comparisonDF.to_csv(args.output_csv, index=False)
+        load_sigs_from_list(args.siglist, stores, sigdir=args.sigdir, names=names, stream=args.stream)
+    if names is not None:
+        for (ksize, moltype), (store, rowD) in stores.items():
+            missing = names - set(rowD)
+            if missing:
+                notify(f'** Error: no {moltype} k={ksize} signatures found for {len(missing)} cluster members, e.g. {", ".join(sorted(missing)[:5])}')
+                sys.exit(-1)
+
+    # results are written one alphabet/ksize at a time (--chunk-rows rows at a time)
+    alpha_ksize = bool(args.alpha_ksize)
+    with TableWriter(args.output_csv, result_columns(alpha_ksize), output_format=args.output_format,
+                     chunk_rows=args.chunk_rows) as writer:
+        for alphabet, moltype, ksize in pairs:
+            store, rowD = stores.pop((ksize, moltype))
+            if len(pairs) > 1:
+                print(f"comparing clusters at {alphabet} k={ksize}")
+
+            # compare each cluster's anchor to its other members, in cluster order;
+            # with --processes, batches of clusters run across a pool sharing the store
+            jobs = cluster_jobs(compareInfo, rowD)
+            if args.processes > 1:
+                print(f"comparing {len(jobs)} clusters with {args.processes} processes")
+            # results go to the writer about --chunk-rows rows at a time, as they come in
+            cluster_comparisons, num_rows = [], 0
+            for n, (job, results) in enumerate(compare_clusters(store, jobs, alphabet, ksize, scaled,
+                                                                 processes=args.processes, batch_size=args.batch_size)):
+                if n !=0 and n % 50 == 0:
+                    print(f"... assessing {n}th cluster comparison, cluster name: {job.cluster_name}, anchor: {job.anchor_acc}\n")
+                cluster_comparisons.append(results)
+                num_rows += len(job.compare_rows)
+                if num_rows >= args.chunk_rows:
+                    writer.write_frame(results_frame(cluster_comparisons, alpha_ksize=alpha_ksize))
+                    cluster_comparisons, num_rows = [], 0
+            if cluster_comparisons:
+                writer.write_frame(results_frame(cluster_comparisons, alpha_ksize=alpha_ksize))
+            # each alpha-ksize starts a new chunk (a new Parquet row group)
+            writer.flush()
+            del store, rowD
+
     print(f"done! taxon comparison info written to {args.output_csv}")
 
 def cmdline(sys_args):
@@ -118,8 +145,14 @@ def cmdline(sys_args):
     p.add_argument("--sig-extension", default=".sig")
     p.add_argument("--alphabet", default="protein")
     p.add_argument("--ksize", default=10, type=int)
+    p.add_argument("--alpha-ksize", nargs="*", help="compare at each of these alphabet-ksizes (e.g. protein-k10 DNA-k21) in one pass, instead of --alphabet/--ksize; adds an alpha-ksize column")
     p.add_argument("--scaled", default=100, type=int)
-    p.add_argument("--output-csv", required=True)
+    p.add_argument("--output-csv", required=True, help="output table: csv, csv.gz, or .parquet")
+    p.add_argument("--output-format", choices=["csv", "parquet"], help="output table format (default: from the output filename)")
+    p.add_argument("--chunk-rows", default=100000, type=int, help="write the output table in chunks of this many rows")
+    p.add_argument("--processes", default=1, type=int, help="number of processes to compare clusters with")
+    p.add_argument("--batch-size", default=1000, type=int, help="comparisons per batch of clusters sent to a process")
+    p.add_argument("--stream", action="store_true", help="read only the sigs the comparison csv needs, streaming through JSON sig files instead of loading them whole")
     args = p.parse_args()
     return main(args)
 
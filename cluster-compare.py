@@ -12,73 +12,100 @@ from sourmash.sourmash_args import load_file_as_signatures
 
 from collections import defaultdict, namedtuple
 
-CompareResult = namedtuple('CompareResult',
-                           'comparison_name, anchor_name, ref_name, cluster_name, alphabet, ksize, scaled, jaccard, max_containment, anchor_containment, anchor_hashes, query_hashes, num_common')
-
-def compare_sigs(sigA, sigB, comparison_name, cluster_name, alpha, ksize, scaled):
-    sigA_numhashes = len(sigA.minhash.hashes)
-    sigB_numhashes = len(sigB.minhash.hashes)
-    intersect_numhashes = sigA.minhash.count_common(sigB.minhash)
-    jaccard = sigA.jaccard(sigB)
-    containA = sigA.contained_by(sigB)
-    max_contain = sigA.max_containment(sigB)
-    #max_contain = max(containA,containB)
-    return CompareResult(comparison_name, str(sigA).split(" ")[0], str(sigB).split(" ")[0], cluster_name, alpha, ksize, scaled, jaccard, max_contain, containA, sigA_numhashes, sigB_numhashes, intersect_numhashes)
+from hashstore import HashStore
+from tableio import TableWriter
+from clustercompare import (alpha_ksizes, cluster_jobs, compare_clusters, needed_accessions,
+                            read_comparison_csv, result_columns, results_frame)
+from sigdb import SignatureCache, is_sigdb, open_sigdb
+
 
 def main(args):
-    ksize=args.ksize
     scaled=args.scaled
-    alphabet=args.alphabet
     sigext = args.sig_extension
     sigpf = args.sig_prefix
-    if alphabet == "nucleotide":
-        moltype = "DNA"
+    pairs = alpha_ksizes(args.alpha_ksize, args.alphabet, args.ksize)
+    if len(pairs) > 1:
+        print(f"comparing at {len(pairs)} alphabet/ksizes: {', '.join(f'{p.alphabet}-k{p.ksize}' for p in pairs)}")
+
+    # find all sigs: one per accession in a signature database, or one sig file each
+    sigdb, sigD = None, {}
+    if is_sigdb(args.siglist):
+        sigdb = open_sigdb(args.siglist)
     else:
-        moltype = alphabet
-
-    # find all sigs
-    siglist = [x.rstrip() for x in open(args.siglist)]
-    sigD={}
-    for sigF in siglist:
-        name = os.path.basename(sigF).rsplit(sigext)[0].split(sigpf)[1]
-        if not os.path.exists(sigF):
-            full_sigF = os.path.join(args.sigdir, sigF)
-            if not os.path.exists(full_sigF):
-                print(f"sig {name} cannot be found at {sigF} or within sigdir {args.sigdir}")
-                continue
-            else:
-                sigF=full_sigF
-        sigD[name] = sigF
-
-
-    cluster_comparisons = []
-    compareInfo = pd.read_csv(args.comparison_csv).set_index("cluster")
-    compareInfo["cluster_members"] = compareInfo["cluster_members"].str.split(";")
-    # loop through comparisons
-    for n, cluster in enumerate(compareInfo.index):
-        anchor_acc = compareInfo.at[cluster, "cluster_anchor"]
-        if n !=0 and n % 50 == 0:
-            print(f"... assessing {n}th cluster comparison, cluster name: {cluster}, anchor: {anchor_acc}\n")
-
-        # select and load anchor sig
-        selector = load_file_as_signatures(sigD[anchor_acc], ksize=ksize, select_moltype=moltype)
-        anchor_sig = next(selector)
-
-        # iterate through comparison sigs
-        compare_accs = compareInfo.at[cluster, "cluster_members"]
-        for compare_acc in compare_accs:
-            if compare_acc != anchor_acc:
-                # select and load comparison sig
-                selector = load_file_as_signatures(sigD[compare_acc], ksize=ksize, select_moltype=moltype)
-                compare_sig = next(selector)
-                comparison = compare_sigs(anchor_sig, compare_sig, f"{anchor_acc}_x_{compare_acc}", cluster, alphabet, ksize, scaled)
-                cluster_comparisons.append(comparison)
-
-    # convert path comparison info to pandas dataframe
-    comparisonDF = pd.DataFrame.from_records(cluster_comparisons, columns = CompareResult._fields)
-
-    # print to csv
-    comparisonDF.to_csv(args.output_csv, index=False)
+        siglist = [x.rstrip() for x in open(args.siglist)]
+        for sigF in siglist:
+            name = os.path.basename(sigF).rsplit(sigext)[0].split(sigpf)[1]
+            if not os.path.exists(sigF):
+                full_sigF = os.path.join(args.sigdir, sigF)
+                if not os.path.exists(full_sigF):
+                    print(f"sig {name} cannot be found at {sigF} or within sigdir {args.sigdir}")
+                    continue
+                else:
+                    sigF=full_sigF
+            sigD[name] = sigF
+
+    compareInfo = read_comparison_csv(args.comparison_csv)
+
+    # every accession the comparisons need, in the order they're first used;
+    # each is loaded once, up front, instead of once per cluster it's in
+    needed = needed_accessions(compareInfo)
+
+    def sig_location(acc, ksize, moltype):
+        if sigdb is not None:
+            # random access to just this sketch
+            return sigdb.location(acc, ksize, moltype)
+        return sigD[acc]
+
+    # keep every needed sig's hashes in one store per alphabet/ksize. Each sig's
+    # hashes go into its store as soon as it's loaded, and at most --cache-size
+    # full sigs stay loaded; a sig file holds every alphabet/ksize, so the
+    # prefetch reads each file once for all of them
+    stores = [(HashStore(), {}) for _ in pairs]
+    key_info = defaultdict(list)
+    for acc in needed:
+        for (alphabet, moltype, ksize), (store, rowD) in zip(pairs, stores):
+            key_info[(sig_location(acc, ksize, moltype), ksize, moltype)].append((acc, store, rowD))
+
+    def add_sig(key, sig):
+        for acc, store, rowD in key_info[key]:
+            rowD[acc] = store.add_signature(key[0], sig)
+
+    cache = SignatureCache(args.cache_size)
+    print(f"loading {len(needed)} signatures for {len(compareInfo)} clusters...")
+    cache.prefetch(key_info, threads=args.prefetch_threads, on_load=add_sig)
+    print(f"...loaded {cache.prefetched} signatures in {cache.load_seconds:.1f}s ({len(cache)} kept in the cache)")
+    print(cache.report())
+    del cache, key_info
+
+    # results are written one alphabet/ksize at a time (--chunk-rows rows at a time)
+    alpha_ksize = bool(args.alpha_ksize)
+    with TableWriter(args.output_csv, result_columns(alpha_ksize), output_format=args.output_format,
+                     chunk_rows=args.chunk_rows) as writer:
+        for (alphabet, moltype, ksize), (store, rowD) in zip(pairs, stores):
+            if len(pairs) > 1:
+                print(f"comparing clusters at {alphabet} k={ksize}")
+
+            # compare each cluster's anchor to its other members, in cluster order;
+            # with --processes, batches of clusters run across a pool sharing the store
+            jobs = cluster_jobs(compareInfo, rowD)
+            if args.processes > 1:
+                print(f"comparing {len(jobs)} clusters with {args.processes} processes")
+            # results go to the writer about --chunk-rows rows at a time, as they come in
+            cluster_comparisons, num_rows = [], 0
+            for n, (job, results) in enumerate(compare_clusters(store, jobs, alphabet, ksize, scaled,
+                                                                 processes=args.processes, batch_size=args.batch_size)):
+                if n !=0 and n % 50 == 0:
+                    print(f"... assessing {n}th cluster comparison, cluster name: {job.cluster_name}, anchor: {job.anchor_acc}\n")
+                cluster_comparisons.append(results)
+                num_rows += len(job.compare_rows)
+                if num_rows >= args.chunk_rows:
+                    writer.write_frame(results_frame(cluster_comparisons, alpha_ksize=alpha_ksize))
+                    cluster_comparisons, num_rows = [], 0
+            if cluster_comparisons:
+                writer.write_frame(results_frame(cluster_comparisons, alpha_ksize=alpha_ksize))
+            # each alpha-ksize starts a new chunk (a new Parquet row group)
+            writer.flush()
+
     print(f"done! taxon comparison info written to {args.output_csv}")
 
 def cmdline(sys_args):
@@ -86,14 +113,21 @@ def cmdline(sys_args):
     p = argparse.ArgumentParser()
     p.add_argument("--comparison-csv", default="gtdb-r95-reps.pathinfo.tsv")
     p.add_argument("--lineages-csv", default="gtdb-r95-reps.lineages.protein-filenames.reordered.csv")
-    p.add_argument("--siglist", default="gtdb95-evolpaths/gtdb95-evolpaths.signatures.txt")
+    p.add_argument("--siglist", default="gtdb95-evolpaths/gtdb95-evolpaths.signatures.txt", help="list of sig files, or a signature database (.zip)")
     p.add_argument("--sigdir", default="")
     p.add_argument("--sig-extension", default=".sig")
     p.add_argument("--sig-prefix", default="")
     p.add_argument("--alphabet", default="protein")
     p.add_argument("--ksize", default=10, type=int)
+    p.add_argument("--alpha-ksize", nargs="*", help="compare at each of these alphabet-ksizes (e.g. protein-k10 dayhoff-k16) in one pass, instead of --alphabet/--ksize; adds an alpha-ksize column")
     p.add_argument("--scaled", default=100, type=int)
-    p.add_argument("--output-csv", required=True)
+    p.add_argument("--cache-size", default=100000, type=int, help="maximum number of full signatures to keep loaded (their hashes are always kept)")
+    p.add_argument("--prefetch-threads", default=1, type=int, help="threads to load signatures with")
+    p.add_argument("--output-csv", required=True, help="output table: csv, csv.gz, or .parquet")
+    p.add_argument("--output-format", choices=["csv", "parquet"], help="output table format (default: from the output filename)")
+    p.add_argument("--chunk-rows", default=100000, type=int, help="write the output table in chunks of this many rows")
+    p.add_argument("--processes", default=1, type=int, help="number of processes to compare clusters with")
+    p.add_argument("--batch-size", default=1000, type=int, help="comparisons per batch of clusters sent to a process")
     args = p.parse_args()
     return main(args)
 
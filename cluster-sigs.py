@@ -22,58 +22,81 @@ import sourmash
 #from sourmash import load_file_as_signatures #, load_file_list_of_signatures
 from sourmash.logging import notify
 
-def load_sigs_from_list(siglistfiles, moltype, ksize):
+from hashstore import HashStore, ThresholdStats
+from sigdb import load_signatures, signature_sources, sketch_location
+
+def load_sigs_from_list(siglistfiles, moltype, ksize, store=None):
     # input lists of signatures instead
     sigs = []
     for sl in siglistfiles:
         notify(f'loading from {sl}')
-        sigfiles = sourmash.sourmash_args.load_file_list_of_signatures(sl)
-        new_sigs = load_sigs(sigfiles, moltype, ksize, source_type= "input sigfile list")
+        # a siglist, or a signature database (sigdb.py) in its place
+        sigfiles = signature_sources(sl)
+        new_sigs = load_sigs(sigfiles, moltype, ksize, source_type= "input sigfile list", store=store)
         notify(f'...got {len(new_sigs)} signatures from {sl} siglist file.')
         sigs+=new_sigs
     return sigs
 
-def load_sigs(sig_sources, moltype, ksize, source_type="input sigfiles"):
+def load_sigs(sig_sources, moltype, ksize, source_type="input sigfiles", store=None):
+    # with a HashStore, keep only each sig's hashes (lean loading) and return row ids
     siglist=[]
     for filename in sig_sources:
         if source_type != "input sigfile list":
             notify(f'loading from {filename}')
         m = 0
-        for sig in sourmash.sourmash_args.load_file_as_signatures(filename,
-                                           select_moltype=moltype,
-                                           ksize=ksize):
+        for sig in load_signatures(filename, ksize=ksize, moltype=moltype):
             m += 1
-            siglist.append((filename, sig))
+            # sigs from a database are recorded by their own location in it
+            source = sketch_location(filename, sig)
+            if store is not None:
+                siglist.append(store.add_signature(source, sig))
+            else:
+                siglist.append((source, sig))
         if source_type != "input sigfile list":
             notify(f'...got {m} signatures from {source_type}.')
     return siglist
 
 
-def max_containment(sigA, sigB):
-    c1 = sigA.contained_by(sigB)
-    c2 = sigB.contained_by(sigA)
-    return max(c1,c2)
+# threshold test counts for the current step, and one row per finished step
+threshold_stats = ThresholdStats()
+total_stats = ThresholdStats()
+compareInfo = namedtuple('ComparisonInfo', ('batch_n, pass_n, stage, ' + ', '.join(ThresholdStats.fields)))
+comparisons = []
+
+def record_step(batch_n, pass_n, stage):
+    "move the threshold test counts of a finished uniqify/cluster step into comparisons"
+    global threshold_stats
+    comparisons.append(compareInfo(batch_n, pass_n, stage, **threshold_stats.as_dict()))
+    total_stats.update(threshold_stats)
+    threshold_stats = ThresholdStats()
+
+def above_threshold(store, founder, siglist):
+    "max containment of each sig in siglist to the founder, tested against the threshold"
+    if not siglist:
+        return []
+    # sigs that can't reach the threshold are pruned before any hashes are compared
+    return store.passes_threshold(founder, siglist, args.threshold, threshold_stats)
 
 
 #def cluster_to_founders(founders, query_sigs, clusterInfo, cluster_summary, batch_n, pass_n):
-def cluster_to_founders(founders, siglist, batch_n, pass_n):
+def cluster_to_founders(store, founders, siglist, batch_n, pass_n):
     # assign sigs to clusters via max containment to founder genomes
     notify(f'Attempting to cluster sigs to {len(founders)} current founders (pass {pass_n+1})')
-    for (founder_from, founder) in founders:
+    for founder in founders:
         cluster = []
         leftover = []
-        for (sig_from, sig) in siglist:
-            maxcontain = max_containment(sig, founder)
+        # compare this founder against all remaining sigs in one call
+        for sig, is_member in zip(siglist, above_threshold(store, founder, siglist)):
             #if sig.similarity(founder) >= args.threshold:
-            if not maxcontain >= args.threshold:
+            if not is_member:
                 #clusterInfo[founder].append((sig_from, sig))
                 #cluster.append((sig_from, sig))
                 #cluster_summary.append((sig_from, sig, batch_n, pass_n, 'member'))
             #else:
-                leftover.append((sig_from, sig))
+                leftover.append(sig)
         #if cluster:
             else:
-                notify(f'clustered {str(sig)} signature(s) with founder sig {str(founder)[:30]}...')
+                notify(f'clustered {store.names[sig]} signature(s) with founder sig {store.names[founder][:30]}...')
             #notify(f'clustered {len(cluster)} signature(s) with founder sig {str(founder)[:30]}...')
             #clusterInfo[str(founder)].extend(cluster)
         #else:
@@ -87,7 +110,7 @@ def cluster_to_founders(founders, siglist, batch_n, pass_n):
 
 
 #def get_new_founders_via_uniqify(siglist, clusterInfo, batch_n, pass_n):
-def get_new_founders_via_uniqify(siglist, batch_n, pass_n, rarefaction):
+def get_new_founders_via_uniqify(store, siglist, batch_n, pass_n, rarefaction):
     '''
     use sourmash_uniqify code to build a new set of founders
     '''
@@ -97,22 +120,21 @@ def get_new_founders_via_uniqify(siglist, batch_n, pass_n, rarefaction):
     while len(siglist):
         notify(f'batch {batch_n}: starting pass {uniqify_pass_n+1}')
         # make the first one a founder; try to find matches; repeat.
-        (founder_from, founder) = siglist.pop()
-        new_founders.append((founder_from, founder))
+        founder = siglist.pop()
+        new_founders.append(founder)
         #cluster_summary.append((founder_from, founder, batch_n, uniqify_pass_n, 'founder'))
 
         cluster = []
         leftover = []
-        for (sig_from, sig) in siglist:
-            maxcontain = max_containment(sig, founder)
-            if not maxcontain >= args.threshold:
+        for sig, is_member in zip(siglist, above_threshold(store, founder, siglist)):
+            if not is_member:
             #if sig.similarity(founder) >= args.threshold:
                 #cluster.append((sig_from, sig))
                 #cluster_summary.append((sig_from, sig, batch_n, uniqify_pass_n, 'member'))
             #else:
-                leftover.append((sig_from, sig))
+                leftover.append(sig)
             else:
-                notify(f'clustering {str(sig)} with founder sig {str(founder)[:30]}...')
+                notify(f'clustering {store.names[sig]} with founder sig {store.names[founder][:30]}...')
 
         #if cluster:
             #notify(f'clustered {len(cluster)} signature(s) with founder sig {str(founder)[:30]}...')
@@ -144,14 +166,17 @@ def get_new_founders_via_uniqify(siglist, batch_n, pass_n, rarefaction):
 
 def main(args):
     batch_size = args.batch_size
-    #load new sigs
+    #load new sigs; only their hashes are kept, in one packed store.
+    # We work with store row ids from here on.
+    store = HashStore()
     siglist=[]
     if args.signature_sources:
-        siglist = load_sigs(args.signature_sources, args.moltype, args.ksize)
+        siglist = load_sigs(args.signature_sources, args.moltype, args.ksize, store=store)
     if args.siglist:
-        siglist+= load_sigs_from_list(args.siglist, args.moltype, args.ksize)
+        siglist+= load_sigs_from_list(args.siglist, args.moltype, args.ksize, store=store)
 
     notify(f'loaded {len(siglist)} new signatures total.')
+    notify(store.memory_report())
 
     notify(f'setting random number seed to {args.seed} and shuffling input sigs')
     random.seed(args.seed)
@@ -173,34 +198,45 @@ def main(args):
             if row["member_type"] == "founder":
                 founder_files.append(row["filename"])
         # load in cluster sigs
-        founders = load_sigs(founder_files, args.moltype, args.ksize, source_type="seed cluster founders")
+        founders = load_sigs(founder_files, args.moltype, args.ksize, source_type="seed cluster founders", store=store)
         #siglist, clusterInfo, cluster_summary = cluster_to_founders(founders, siglist, clusterInfo, cluster_summary, batch_n, pass_n)
-        siglist  = cluster_to_founders(founders, siglist, batch_n, pass_n) #clusterInfo, cluster_summary, batch_n, pass_n)
+        siglist  = cluster_to_founders(store, founders, siglist, batch_n, pass_n) #clusterInfo, cluster_summary, batch_n, pass_n)
+        record_step(batch_n, pass_n, "cluster")
         pass_n+=1
 
     while siglist:
        # if unassigned sigs, uniqify to get new founders
        #new_founders, clusterInfo, cluster_summary = get_new_founders_via_uniqify(siglist[:batch_size], clusterInfo, cluster_summary, batch_n, pass_n)
-       new_founders, rarefactionD  = get_new_founders_via_uniqify(siglist[:batch_size], batch_n, pass_n, rarefactionD) #, clusterInfo, cluster_summary, batch_n, pass_n)
+       new_founders, rarefactionD  = get_new_founders_via_uniqify(store, siglist[:batch_size], batch_n, pass_n, rarefactionD) #, clusterInfo, cluster_summary, batch_n, pass_n)
+       record_step(batch_n, pass_n, "uniqify")
        founders += new_founders
        batch_n+=1
        # cluster all sigs to full list of founders
        #siglist, clusterInfo, cluster_summary = cluster_to_founders(founders, siglist, clusterInfo, cluster_summary, batch_n, pass_n)
-       siglist  = cluster_to_founders(founders, siglist, batch_n, pass_n) #, clusterInfo, cluster_summary, batch_n, pass_n)
+       siglist  = cluster_to_founders(store, founders, siglist, batch_n, pass_n) #, clusterInfo, cluster_summary, batch_n, pass_n)
+       record_step(batch_n, pass_n, "cluster")
        pass_n +=1
 
 
 
+    notify(f'threshold tests: {total_stats.report()}')
+
     # this script is really about using a greedy alg to find a set of founders. We need to re-map all to founders after this
     # (to get best matches, not just first matches), so all we really need is the list of founder sigs
 
     # write all founders
     prefix = args.prefix
     with open(f'{prefix}.founders.siglist', 'wt') as fp:
-        for (founder_from, founder) in founders:
-            fp.write(founder_from + "\n")
+        for founder in founders:
+            fp.write(store.sources[founder] + "\n")
         #sourmash.save_signatures([founder], fp)
 
+    # threshold test counts per step, same columns as find-founders' comparisons file
+    with open(f'{prefix}.comparisons.csv', 'wt') as fp:
+        w = csv.writer(fp)
+        w.writerow(compareInfo._fields)
+        w.writerows(comparisons)
+
     # write output summary spreadsheet
     #headers = ['origin_path', 'name', 'filename', 'md5sum', 'cluster', 'member_type']
     #csv_name = f'{args.prefix}.summary.csv'
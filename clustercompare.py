@@ -0,0 +1,172 @@
+"""
+Anchor-vs-members comparisons for every cluster in a comparison csv,
+shared by cluster-compare.py and cluster-compare-singleton.py.
+
+All the sigs the clusters need are packed into one HashStore, and each
+cluster is a `ClusterJob` of store row ids. A cluster's anchor is compared
+to all its other members in one vectorized call, and its results are kept
+as columns (arrays) rather than as one `CompareResult` per pair.
+
+Several alphabet/ksize pairs can be compared in one run (`alpha_ksizes`);
+their results are stacked into one table with an `alpha-ksize` column,
+as the pipeline's aggregate rules used to build from per-ksize csvs.
+
+With processes > 1, the store's hash arrays are put in shared memory once;
+worker processes attach to them and take batches of clusters, so only row
+ids and names are sent per task. Results come back in cluster order.
+
+This code is under CC0.
+"""
+import multiprocessing
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from hashstore import HashStore
+
+CompareResult = namedtuple('CompareResult',
+                           'comparison_name, anchor_name, ref_name, cluster_name, alphabet, ksize, scaled, jaccard, max_containment, anchor_containment, anchor_hashes, query_hashes, num_common')
+
+ClusterJob = namedtuple('ClusterJob', 'cluster_name, anchor_acc, anchor, compare_accs, compare_rows')
+
+AlphaKsize = namedtuple('AlphaKsize', 'alphabet, moltype, ksize')
+
+
+def alphabet_moltype(alphabet):
+    if alphabet == "nucleotide":
+        return "DNA"
+    return alphabet
+
+
+def alpha_ksizes(alpha_ksize_strs, alphabet, ksize):
+    """
+    An AlphaKsize for each 'alphabet-kK' string (e.g. protein-k10, DNA-k21),
+    in order -- or, without any, just the one for alphabet and ksize.
+    """
+    if not alpha_ksize_strs:
+        return [AlphaKsize(alphabet, alphabet_moltype(alphabet), ksize)]
+    pairs = []
+    for alpha_ksize in alpha_ksize_strs:
+        alpha, _, k = alpha_ksize.rpartition("-")
+        if not alpha or not k.lstrip("k").isdigit():
+            raise ValueError(f"can't read alphabet and ksize from '{alpha_ksize}'; use e.g. 'protein-k10'")
+        pairs.append(AlphaKsize(alpha, alphabet_moltype(alpha), int(k.lstrip("k"))))
+    return list(dict.fromkeys(pairs))
+
+
+def read_comparison_csv(comparison_csv):
+    "cluster-indexed comparison info, with cluster_members split into lists"
+    compareInfo = pd.read_csv(comparison_csv).set_index("cluster")
+    compareInfo["cluster_members"] = compareInfo["cluster_members"].str.split(";")
+    return compareInfo
+
+
+def needed_accessions(compareInfo):
+    "every accession the comparisons need, in the order they're first used"
+    needed = []
+    for cluster in compareInfo.index:
+        needed.append(compareInfo.at[cluster, "cluster_anchor"])
+        needed += compareInfo.at[cluster, "cluster_members"]
+    return list(dict.fromkeys(needed))
+
+
+def cluster_jobs(compareInfo, rows):
+    "a ClusterJob per cluster, in csv order; rows maps accessions to store rows"
+    jobs = []
+    for cluster in compareInfo.index:
+        anchor_acc = compareInfo.at[cluster, "cluster_anchor"]
+        compare_accs = [acc for acc in compareInfo.at[cluster, "cluster_members"] if acc != anchor_acc]
+        jobs.append(ClusterJob(cluster, anchor_acc, rows[anchor_acc],
+                               compare_accs, [rows[acc] for acc in compare_accs]))
+    return jobs
+
+
+def compare_cluster(store, job, alpha, ksize, scaled):
+    "compare a cluster's anchor against all its other members at once; returns result columns"
+    comparison = store.compare(job.anchor, job.compare_rows)
+    num = len(job.compare_rows)
+    anchor_name = store.names[job.anchor].split(" ")[0]
+    return {"comparison_name": [f"{job.anchor_acc}_x_{acc}" for acc in job.compare_accs],
+            "anchor_name": [anchor_name] * num,
+            "ref_name": [store.names[row].split(" ")[0] for row in job.compare_rows],
+            "cluster_name": [job.cluster_name] * num,
+            "alphabet": [alpha] * num,
+            "ksize": np.full(num, ksize),
+            "scaled": np.full(num, scaled),
+            "jaccard": comparison.jaccard,
+            "max_containment": comparison.max_containment,
+            "anchor_containment": comparison.query_containment,
+            "anchor_hashes": np.full(num, len(store.get_hashes(job.anchor))),
+            "query_hashes": store.sizes[job.compare_rows],
+            "num_common": comparison.common}
+
+
+def batch_jobs(jobs, batch_size):
+    "consecutive batches of jobs, each with about batch_size comparisons"
+    batch, batch_comparisons = [], 0
+    for job in jobs:
+        batch.append(job)
+        batch_comparisons += len(job.compare_rows) + 1
+        if batch_comparisons >= batch_size:
+            yield batch
+            batch, batch_comparisons = [], 0
+    if batch:
+        yield batch
+
+
+# per-process store and comparison settings for --processes; set once by the pool initializer
+_worker_store = None
+_worker_settings = None
+
+def _init_compare_worker(handle, alpha, ksize, scaled):
+    global _worker_store, _worker_settings
+    _worker_store = HashStore.attach(handle)
+    _worker_settings = (alpha, ksize, scaled)
+
+def _compare_batch(batch):
+    return [compare_cluster(_worker_store, job, *_worker_settings) for job in batch]
+
+
+def compare_clusters(store, jobs, alpha, ksize, scaled, processes=1, batch_size=1000):
+    """
+    Yield (job, result columns) for every cluster job, in job order. With
+    processes > 1, batches of jobs are compared across a process pool that
+    shares the store's hashes.
+    """
+    if processes <= 1:
+        for job in jobs:
+            yield job, compare_cluster(store, job, alpha, ksize, scaled)
+        return
+
+    batches = list(batch_jobs(jobs, batch_size))
+    with store.share() as shared:
+        with multiprocessing.Pool(processes, initializer=_init_compare_worker,
+                                  initargs=(shared.handle, alpha, ksize, scaled)) as pool:
+            # imap returns batches in order, as they finish
+            for batch, batch_results in zip(batches, pool.imap(_compare_batch, batches)):
+                yield from zip(batch, batch_results)
+
+
+def result_columns(alpha_ksize=False):
+    "columns of the comparison table"
+    return list(CompareResult._fields) + (["alpha-ksize"] if alpha_ksize else [])
+
+
+def results_frame(cluster_results, alpha_ksize=False):
+    """
+    One dataframe of CompareResult columns from per-cluster result columns;
+    with alpha_ksize, plus an 'alpha-ksize' column (e.g. protein-10).
+    """
+    cluster_results = list(cluster_results)
+    columns = {}
+    for field in CompareResult._fields:
+        parts = [result[field] for result in cluster_results]
+        if field in ("comparison_name", "anchor_name", "ref_name", "cluster_name", "alphabet"):
+            columns[field] = [value for part in parts for value in part]
+        else:
+            columns[field] = np.concatenate(parts) if parts else []
+    comparisonDF = pd.DataFrame(columns, columns=CompareResult._fields)
+    if alpha_ksize:
+        comparisonDF["alpha-ksize"] = comparisonDF["alphabet"] + "-" + comparisonDF["ksize"].astype(str)
+    return comparisonDF
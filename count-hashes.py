@@ -1,32 +1,114 @@
 import os
 import sys
+import time
 import argparse
+import multiprocessing
 from collections import defaultdict, namedtuple
 
-import screed
 import sourmash
 import numpy as np
 import pandas as pd
 
+from fastautils import iter_fasta_lengths
+from hashstore import counts_at_max_hashes, max_hashes_for_scaled, sorted_hashes
+from sigdb import is_sigdb, load_signatures, open_sigdb, signature_sources, split_location
+from tableio import TableWriter
+
 SigInfo = namedtuple('SigInfo','name, ksize, scaled, num_hashes, genome_length')
 
 def find_genome_lengths_single(fastafile):
     seqlens = defaultdict(int)
 
-    with screed.open(fastafile) as records:
-        for n, record in enumerate(records):
-            if n % 10000 == 0:
-                print(f"... processing {n}th record, {record.name}\n")
-            record_len = len(record.sequence)
-            seqlens[record.name] = record_len
+    # lengths are counted straight from the raw bytes; no sequence strings are built
+    for n, (name, record_len) in enumerate(iter_fasta_lengths(fastafile)):
+        if n % 10000 == 0:
+            print(f"... processing {n}th record, {name}\n")
+        seqlens[name] = record_len
 
     return seqlens
 
 
+def count_tasks(siglist, chunk_size):
+    """
+    (sigfile, start, stop) pieces of work for a siglist. A signature database
+    is split into chunks of chunk_size sketches, so one database can still be
+    counted across a pool; other sigfiles are counted whole.
+    """
+    tasks = []
+    for sigF in signature_sources(siglist):
+        if is_sigdb(sigF) and not split_location(sigF)[1]:
+            num_sketches = len(open_sigdb(sigF))
+            tasks += [(sigF, start, start + chunk_size) for start in range(0, num_sketches, chunk_size)]
+        else:
+            tasks.append((sigF, None, None))
+    return tasks
+
+
+def count_sigfile(sigF, scaled_vals, all_max_hashes, start=None, stop=None):
+    """
+    Count hashes for every sig in one sigfile (or in sketches start:stop of a
+    signature database): at the sig's own scaled, then at each usable
+    additional scaled value. Returns (rows, num_sigs, skipped), where rows
+    are (name, ksize, scaled, num_hashes) tuples and skipped holds the
+    (desired scaled, sig scaled) pairs that couldn't be downsampled.
+    """
+    rows, num_sigs, skipped = [], 0, set()
+    if start is not None:
+        sigs = open_sigdb(sigF).signatures(start=start, stop=stop)
+    else:
+        sigs = load_signatures(sigF)
+    # load sigs from each sigfile
+    for sig in sigs:
+        # get signature information
+        num_sigs += 1
+        name = str(sig)
+        ksize = sig.minhash.ksize
+        # first do existing scaled val
+        scaled = sig.minhash.scaled
+        rows.append((name, ksize, scaled, len(sig.minhash.hashes)))
+        if not len(scaled_vals):
+            continue
+        # now count hashes at additional scaled vals, if desired.
+        # downsampling keeps the hashes <= each scaled's max_hash, so sort once and
+        # read all counts off in one pass, without building downsampled MinHashes
+        usable = scaled_vals >= scaled if scaled else np.zeros(len(scaled_vals), dtype=bool)
+        skipped.update((sc, scaled) for sc in scaled_vals[~usable].tolist())
+        counts = counts_at_max_hashes(sorted_hashes(sig.minhash), all_max_hashes[usable])
+        for sc, num_hashes in zip(scaled_vals[usable].tolist(), counts.tolist()):
+            rows.append((name, ksize, sc, num_hashes))
+    return rows, num_sigs, skipped
+
+
+# per-process settings for --processes; set once by the pool initializer
+_worker_args = None
+
+def _init_count_worker(scaled_vals, all_max_hashes):
+    global _worker_args
+    _worker_args = (scaled_vals, all_max_hashes)
+
+def _count_sigfile_worker(task):
+    sigF, start, stop = task
+    return count_sigfile(sigF, *_worker_args, start=start, stop=stop)
+
+def count_sigfiles(tasks, scaled_vals, all_max_hashes, processes=1, chunksize=16):
+    "yield the counts for each sigfile task in order, across a pool with processes > 1"
+    if processes > 1:
+        with multiprocessing.Pool(processes, initializer=_init_count_worker,
+                                  initargs=(scaled_vals, all_max_hashes)) as pool:
+            yield from pool.imap(_count_sigfile_worker, tasks, chunksize=chunksize)
+    else:
+        for sigF, start, stop in tasks:
+            yield count_sigfile(sigF, scaled_vals, all_max_hashes, start=start, stop=stop)
+
+
 def main(args):
     scaled_vals = []
     if args.scaled:
         scaled_vals = args.scaled
+    # max_hash cutoff for every requested scaled value, computed once
+    scaled_vals = np.array(scaled_vals, dtype=np.int64)
+    all_max_hashes = max_hashes_for_scaled(scaled_vals.tolist())
+    warned = set()
 
     # find fasta lengths for each genome or proteome
     if args.length_csv:
@@ -35,56 +117,62 @@ def main(args):
     elif args.fastafile:
         genome_lengths = find_genome_lengths_single(args.fastafile)
 
-    # load file list of sigs
-    sigfiles = sourmash.sourmash_args.load_file_list_of_signatures(args.siglist)
-    total_sigfiles = len(sigfiles)
-    sigInfoList = []
-    num_sigfiles=0
-    for sigF in sigfiles:
-        # load sigs from each sigfile
-        sigs = sourmash.sourmash_args.load_file_as_signatures(sigF)
-        for n, sig in enumerate(sigs):
-            # get signature information
-            name = str(sig)
-            genome_len = genome_lengths[name]
-            if n !=0 and n % 10000 == 0:
-                print(f"... processing {n}th sig, {name}\n")
-            ksize = sig.minhash.ksize
-            # first do existing scaled val
-            scaled = sig.minhash.scaled
-            num_hashes = len(sig.minhash.hashes)
-            # store signature info
-            sigInfoList.append(SigInfo(name=name, ksize=ksize, scaled=scaled, num_hashes=num_hashes, genome_length=genome_len))
-            # now downsample to additional scaled vals, if desired
-            for sc in scaled_vals:
-                if sc < scaled:
-                    print(f"Can't downsample: desired scaled {sc} is smaller than original scaled, {scaled}. Removing scaled {sc}...")
-                    scaled_vals.remove(sc)
-                    continue
-                # store signature info
-                num_hashes = len(sig.minhash.downsample(scaled=sc).hashes)
-                sigInfoList.append(SigInfo(name=name, ksize=ksize, scaled=sc, num_hashes=num_hashes, genome_length=genome_len))
-        num_sigfiles+=1
-        if num_sigfiles % 500 == 0:
-            print(f"...processed {num_sigfiles}/{total_sigfiles} sigfiles")
-
-    # convert signature info to pandas dataframe
-    sigInfoDF = pd.DataFrame.from_records(sigInfoList, columns = SigInfo._fields)
-
-    # print to csv
-    sigInfoDF.to_csv(args.output_csv, index=False)
+    # load file list of sigs (or chunks of a signature database)
+    tasks = count_tasks(args.siglist, args.sigdb_chunk_size)
+    total_sigfiles = len(tasks)
+
+    # sigfiles are counted in order (across a pool with --processes); rows are
+    # written out in chunks as they come back, so memory use doesn't grow with
+    # the number of sigs x scaled values
+    results = count_sigfiles(tasks, scaled_vals, all_max_hashes, args.processes, args.sigfile_chunksize)
+
+    start = last_report = time.perf_counter()
+    num_sigfiles, num_sigs = 0, 0
+    with TableWriter(args.output_csv, SigInfo._fields, output_format=args.output_format,
+                     chunk_rows=args.chunk_rows) as writer:
+        for rows, sigfile_sigs, skipped in results:
+            for sc, scaled in sorted(skipped - warned):
+                if scaled:
+                    print(f"Can't downsample: desired scaled {sc} is smaller than original scaled, {scaled}. Skipping scaled {sc} for these sigs...")
+                else:
+                    print(f"Can't downsample: num signatures can't be downsampled. Skipping scaled {sc} for them...")
+            warned.update(skipped)
+
+            for name, ksize, scaled, num_hashes in rows:
+                # store signature info; the writer flushes every --chunk-rows rows
+                writer.append(SigInfo(name=name, ksize=ksize, scaled=scaled, num_hashes=num_hashes,
+                                      genome_length=genome_lengths[name]))
+            num_sigs += sigfile_sigs
+            num_sigfiles += 1
+
+            now = time.perf_counter()
+            if now - last_report >= args.report_seconds or num_sigfiles == total_sigfiles:
+                last_report = now
+                elapsed = now - start
+                rate = num_sigfiles / elapsed if elapsed else 0.0
+                eta = (total_sigfiles - num_sigfiles) / rate if rate else 0.0
+                print(f"...processed {num_sigfiles}/{total_sigfiles} sigfiles in {elapsed:.0f}s "
+                      f"({rate:.1f} sigfiles/s, {num_sigs / elapsed if elapsed else 0.0:.1f} sigs/s; "
+                      f"~{eta:.0f}s to go)")
+
+    print(f"wrote {writer.num_rows} rows for {num_sigs} sigs to {args.output_csv}")
     print("yay!")
 
 
-
 def cmdline(sys_args):
     "Command line entry point w/argparse action."
     p = argparse.ArgumentParser()
-    p.add_argument("--siglist", help="provide list of signatures to assess", required=True)
-    p.add_argument("--output-csv", help="provide output filename for stats", required=True)
+    p.add_argument("--siglist", help="provide list of signatures to assess, or a signature database (.zip)", required=True)
+    p.add_argument("--output-csv", help="provide output filename for stats (csv, csv.gz, or .parquet)", required=True)
+    p.add_argument("--output-format", choices=["csv", "parquet"], help="output table format (default: from the output filename)")
     p.add_argument("--length-csv", help="provide a csv of 'signame, fastalen' here")
     p.add_argument("--fastafile", help="alternatively, if using just one fasta file, calculate length per record here by providing the fasta")
     p.add_argument("-s", "--scaled", action="append", type=int, help= "provide additional scaled values for downsampling")
+    p.add_argument("--processes", type=int, default=1, help="number of processes to count sigfiles with")
+    p.add_argument("--sigfile-chunksize", type=int, default=16, help="sigfiles handed to a worker process at a time")
+    p.add_argument("--sigdb-chunk-size", type=int, default=1000, help="sketches per piece of work when counting a signature database")
+    p.add_argument("--chunk-rows", type=int, default=100000, help="write output rows in chunks of this many")
+    p.add_argument("--report-seconds", type=float, default=30, help="seconds between progress reports")
     args = p.parse_args()
     return main(args)
 
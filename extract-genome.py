@@ -0,0 +1,39 @@
+#! /usr/bin/env python
+"""
+Write one genome's records from a genome store (see
+split-fasta-by-genome-dict.py --genome-store) to a fasta file or stdout,
+e.g. to pipe into prodigal.
+
+This code is under CC0.
+"""
+import sys
+import argparse
+
+from genomestore import GenomeStore
+
+
+def main(args):
+    with GenomeStore(args.genome_store) as store:
+        if args.accession not in store:
+            print(f"accession {args.accession} is not in genome store {args.genome_store}", file=sys.stderr)
+            return -1
+        if args.output and args.output != "-":
+            with open(args.output, "wb") as out:
+                store.write_fasta(args.accession, out)
+        else:
+            store.write_fasta(args.accession, sys.stdout.buffer)
+            sys.stdout.flush()
+
+
+def cmdline(sys_args):
+    "Command line entry point w/argparse action."
+    p = argparse.ArgumentParser()
+    p.add_argument("genome_store", help="consolidated genome fasta (its .gidx index must be next to it)")
+    p.add_argument("accession")
+    p.add_argument("-o", "--output", help="output fasta (default: stdout)")
+    args = p.parse_args()
+    return main(args)
+
+if __name__ == '__main__':
+    returncode = cmdline(sys.argv[1:])
+    sys.exit(returncode)
@@ -0,0 +1,249 @@
+"""
+Fast FASTA length scanning.
+
+Getting sequence lengths through screed builds a record, and the full
+sequence string, for every sequence only to take its `len()`. The scanner
+here reads the (optionally gzip or bz2 compressed) file in large binary
+blocks and counts residues between headers directly, without building any
+sequence strings.
+
+Names and lengths match screed's: the name is the whole header line
+(without '>', stripped), and each sequence line counts for its length with
+the surrounding whitespace stripped (whitespace inside a line is counted).
+FASTQ input is handed to screed.
+
+Length histograms are kept sparse -- (distinct lengths, counts) arrays --
+so partial histograms from many files or workers merge exactly, and can be
+binned (linearly or log-scaled) or summarized into quantiles afterwards.
+
+`OutputPool` writes one FASTA file per genome with a bounded number of
+open files; genomestore.py keeps them all in one indexed FASTA instead.
+
+This code is under CC0.
+"""
+import os
+import bz2
+import errno
+import gzip
+import multiprocessing
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import screed
+
+BLOCK_SIZE = 16 * 1024**2
+# ascii whitespace screed's line.strip() removes, besides line endings
+_LINE_WHITESPACE = (b' ', b'\t', b'\x0b', b'\x0c', b'\x1c', b'\x1d', b'\x1e', b'\x1f')
+# length summary quantiles, named like pandas' describe() output
+SUMMARY_QUANTILES = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+
+
+def open_binary(filename):
+    "open a plain, gzip or bz2 compressed file for binary reading"
+    with open(filename, 'rb') as fp:
+        magic = fp.read(3)
+    if magic[:2] == b'\x1f\x8b':
+        return gzip.open(filename, 'rb')
+    if magic == b'BZh':
+        return bz2.open(filename, 'rb')
+    return open(filename, 'rb')
+
+
+def _count_residues(block, start, end):
+    "length of the sequence lines in block[start:end], each stripped like screed does"
+    lines = block[start:end]
+    newlines = lines.count(b'\n')
+    crs = lines.count(b'\r')
+    if lines.isascii() and crs == lines.count(b'\r\n') and not any(ws in lines for ws in _LINE_WHITESPACE):
+        # the usual case: only the line endings to drop
+        return len(lines) - newlines - crs
+    return sum(len(line.decode('utf-8').strip()) for line in lines.split(b'\n'))
+
+
+def _screed_lengths(filename):
+    with screed.open(filename) as records:
+        for record in records:
+            yield record.name, len(record.sequence)
+
+
+def iter_fasta_lengths(filename, block_size=BLOCK_SIZE):
+    """
+    Yield (name, length) for every record in a FASTA file, in file order.
+    """
+    with open_binary(filename) as fp:
+        block = fp.read(block_size)
+        if block.lstrip()[:1] == b'@':
+            # FASTQ; not worth a fast path here
+            yield from _screed_lengths(filename)
+            return
+
+        name, length = None, 0
+        carry = b''
+        while block or carry:
+            at_eof = not block
+            block = carry + block
+            # only handle complete lines; keep the rest for the next block
+            if at_eof:
+                carry = b''
+            else:
+                cut = block.rfind(b'\n') + 1
+                block, carry = block[:cut], block[cut:]
+
+            pos = 0
+            while pos < len(block):
+                if block.startswith(b'>', pos):
+                    header_end = block.find(b'\n', pos)
+                    if header_end == -1:
+                        header_end = len(block)
+                    if name is not None:
+                        yield name, length
+                    name = block[pos+1:header_end].decode().strip()
+                    length = 0
+                    pos = header_end + 1
+                    continue
+                # sequence lines run up to the next header line (or block end)
+                next_header = block.find(b'\n>', pos)
+                seq_end = len(block) if next_header == -1 else next_header + 1
+                if name is None:
+                    if block[pos:seq_end].strip():
+                        raise IOError(f"Bad FASTA format: no '>' at beginning of {filename}")
+                else:
+                    length += _count_residues(block, pos, seq_end)
+                pos = seq_end
+
+            if at_eof:
+                break
+            block = fp.read(block_size)
+
+        if name is not None:
+            yield name, length
+
+
+def total_length(filename):
+    "summed length of all records in a FASTA file"
+    return sum(length for _, length in iter_fasta_lengths(filename))
+
+
+def total_lengths(filenames, processes=1, chunksize=8):
+    """
+    Yield the total length of each file, in order; with processes > 1,
+    files are scanned across a process pool.
+    """
+    if processes <= 1:
+        for filename in filenames:
+            yield total_length(filename)
+        return
+    with multiprocessing.Pool(processes) as pool:
+        yield from pool.imap(total_length, filenames, chunksize=chunksize)
+
+
+def length_histogram(lengths):
+    "sparse histogram of an iterable of lengths: (distinct lengths, counts)"
+    lengths = np.fromiter(lengths, dtype=np.int64)
+    return np.unique(lengths, return_counts=True)
+
+
+def merge_length_histograms(histograms):
+    "merge sparse (lengths, counts) histograms into one"
+    histograms = list(histograms)
+    if not histograms:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    lengths = np.concatenate([lengths for lengths, _ in histograms])
+    counts = np.concatenate([counts for _, counts in histograms])
+    merged, inverse = np.unique(lengths, return_inverse=True)
+    return merged, np.bincount(inverse, weights=counts, minlength=len(merged)).astype(np.int64)
+
+
+def bin_length_histogram(lengths, counts, num_bins, log_bins=False):
+    """
+    Bin a sparse histogram into num_bins bins spanning its range; returns
+    (bin edges, counts). Log bins are evenly spaced in log10(length + 1),
+    so zero lengths still fit. A histogram of one distinct length has no
+    range to split, so it's a single bin, [length, length].
+    """
+    if not len(lengths):
+        return np.zeros(num_bins + 1), np.zeros(num_bins, dtype=np.int64)
+    if lengths[0] == lengths[-1]:
+        return np.array([lengths[0], lengths[-1]]), np.array([counts.sum()], dtype=np.int64)
+    if log_bins:
+        edges = np.logspace(np.log10(lengths[0] + 1), np.log10(lengths[-1] + 1), num_bins + 1) - 1
+        # pin the ends, so rounding can't drop the shortest or longest length
+        # (or put an inner edge outside them)
+        edges = np.clip(edges, lengths[0], lengths[-1])
+        edges[0], edges[-1] = lengths[0], lengths[-1]
+    else:
+        edges = np.linspace(lengths[0], lengths[-1], num_bins + 1)
+    binned, edges = np.histogram(lengths, bins=edges, weights=counts)
+    return edges, binned.astype(np.int64)
+
+
+def histogram_quantiles(lengths, counts, quantiles):
+    """
+    Quantiles of the lengths a sparse histogram describes, with the same
+    linear interpolation as numpy/pandas on the expanded values.
+    """
+    cumulative = np.cumsum(counts)
+    positions = np.asarray(quantiles, dtype=float) * (cumulative[-1] - 1)
+    below, above = np.floor(positions), np.ceil(positions)
+    # the value at sorted position k is in the first bin with cumulative count > k
+    low = lengths[np.searchsorted(cumulative, below, side='right')]
+    high = lengths[np.searchsorted(cumulative, above, side='right')]
+    return low + (high - low) * (positions - below)
+
+
+def summarize_lengths(lengths, counts, quantiles=SUMMARY_QUANTILES):
+    "describe()-style count, mean, min, quantiles and max, from a sparse histogram"
+    total = int(counts.sum())
+    if not total:
+        return pd.Series({"count": 0}, name="value")
+    summary = {"count": total, "mean": (lengths * counts).sum() / total, "min": lengths[0]}
+    for q, value in zip(quantiles, histogram_quantiles(lengths, counts, quantiles)):
+        summary[f"{q:.0%}"] = value
+    summary["max"] = lengths[-1]
+    return pd.Series(summary, name="value")
+
+
+def make_outdir(output_dirname):
+    if not os.path.exists(output_dirname):
+        try:
+            os.makedirs(output_dirname)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+
+class OutputPool:
+    """
+    LRU pool of open per-genome output files. At most max_open files are
+    open at once; a genome whose file was closed gets it reopened in append
+    mode, so genomes whose contigs aren't contiguous in the input still work.
+    """
+    def __init__(self, max_open):
+        self.max_open = max(1, max_open)
+        self.handles = OrderedDict()
+        self.started = set()
+        self.reopened = 0
+
+    def get(self, filename):
+        out = self.handles.get(filename)
+        if out is not None:
+            self.handles.move_to_end(filename)
+            return out
+        if len(self.handles) >= self.max_open:
+            _, oldest = self.handles.popitem(last=False)
+            oldest.close()
+        if filename in self.started:
+            self.reopened += 1
+            out = open(filename, "a")
+        else:
+            # first time for this file this run: overwrite anything left over
+            self.started.add(filename)
+            out = open(filename, "w")
+        self.handles[filename] = out
+        return out
+
+    def close(self):
+        for out in self.handles.values():
+            out.close()
+        self.handles.clear()
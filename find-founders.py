@@ -22,26 +22,44 @@ import sys
 import argparse
 import random
 import csv
+import json
+import time
+import pstats
+import cProfile
+import hashlib
+import multiprocessing
 from collections import defaultdict, namedtuple
 import pandas as pd
 
 import sourmash
 from sourmash.logging import notify
 
+from hashstore import CoarsePrefilter, HashIndex, HashStore, ThresholdStats, passes_threshold, peak_rss_mb
+from sigdb import load_signatures, signature_sources, sketch_location
+
 rareInfo = namedtuple('RarefactionInfo','num_founders, num_members')
+compareInfo = namedtuple('ComparisonInfo', ('batch_n, pass_n, stage, ' + ', '.join(ThresholdStats.fields)))
+stepInfo = namedtuple('StepInfo', 'batch_n, pass_n, stage, wall_seconds, sigs_checked, sigs_remaining, '
+                      'founders_added, members_added, comparisons, pairs_pruned, comparisons_per_second, '
+                      'peak_rss_mb, peak_worker_rss_mb')
+
+# fewer audited 'estimate' prefilter rejections than this don't support a false-negative rate
+MIN_PREFILTER_AUDITS = 100
 
-def load_sigs_from_list(siglistfiles, moltype, ksize, sigdir=None):
+def load_sigs_from_list(siglistfiles, moltype, ksize, sigdir=None, store=None):
     # input lists of signatures instead
     sigs = []
     for sl in siglistfiles:
         notify(f'loading from {sl}')
-        sigfiles = sourmash.sourmash_args.load_file_list_of_signatures(sl)
-        new_sigs = load_sigs(sigfiles, moltype, ksize, source_type= "input sigfile list", sigdir=sigdir)
+        # a siglist, or a signature database (sigdb.py) in its place
+        sigfiles = signature_sources(sl)
+        new_sigs = load_sigs(sigfiles, moltype, ksize, source_type= "input sigfile list", sigdir=sigdir, store=store)
         notify(f'...got {len(new_sigs)} signatures from {sl} siglist file.')
         sigs+=new_sigs
     return sigs
 
-def load_sigs(sig_sources, moltype, ksize, source_type="input sigfiles", sigdir=None):
+def load_sigs(sig_sources, moltype, ksize, source_type="input sigfiles", sigdir=None, store=None):
+    # with a HashStore, keep only each sig's hashes (lean loading) and return row ids
     siglist=[]
     for filename in sig_sources:
         if not os.path.exists(filename) and sigdir:
@@ -49,134 +67,449 @@ def load_sigs(sig_sources, moltype, ksize, source_type="input sigfiles", sigdir=
         if source_type != "input sigfile list":
             notify(f'loading from {filename}')
         m = 0
-        for sig in sourmash.sourmash_args.load_file_as_signatures(filename,
-                                           select_moltype=moltype,
-                                           ksize=ksize):
+        for sig in load_signatures(filename, ksize=ksize, moltype=moltype):
             m += 1
-            siglist.append((filename, sig))
+            # sigs from a database are recorded by their own location in it
+            source = sketch_location(filename, sig)
+            if store is not None:
+                siglist.append(store.add_signature(source, sig))
+            else:
+                siglist.append((source, sig))
         if source_type != "input sigfile list":
             notify(f'...got {m} signatures from {source_type}.')
     return siglist
 
 
-def max_containment(sigA, sigB):
-    c1 = sigA.contained_by(sigB)
-    c2 = sigB.contained_by(sigA)
-    return max(c1,c2)
+class FounderIndex:
+    """
+    In-memory inverted index (hash -> founders containing that hash).
+
+    Founders are numbered in the order they are added, so checking candidate
+    founders in ascending order gives the same "first founder that matches"
+    answer as comparing a sig against every founder in turn -- but only the
+    founders that share at least one hash with the query are ever looked at,
+    and each of those is checked with the early-exit threshold kernel.
+
+    With a CoarsePrefilter, candidates are first tested on their coarse
+    (downsampled) hashes. In 'estimate' mode candidates also come from an
+    index of the coarse hashes only, which is much smaller to walk; founders
+    sharing no coarse hashes are never looked at.
+
+    The index only sees identity keys and hashes, so it can be rebuilt in
+    worker processes from plain hash arrays.
+    """
+    def __init__(self, threshold, prefilter=None, scaled=None):
+        self.threshold = threshold
+        self.prefilter = prefilter
+        # the sketches' scaled, for sourmash's containment bias correction
+        self.scaled = scaled
+        self.founders = []
+        self.keys = []
+        self.hashes = []
+        self.index = HashIndex()
+        self.stats = ThresholdStats()
+        # founders without hashes never show up in the postings; keep them
+        # around so identical (empty) duplicates are still recognized.
+        self.empty = []
+        self.coarse_sizes = []
+        if prefilter is not None and prefilter.mode == 'estimate':
+            self.coarse_index = HashIndex()
+        else:
+            self.coarse_index = None
+        # founders with no coarse hashes can't be found via the coarse index
+        self.coarse_empty = []
+
+    def __len__(self):
+        return len(self.founders)
+
+    def add(self, founder, key, hashes):
+        founder_n = len(self.founders)
+        self.founders.append(founder)
+        self.keys.append(key)
+        self.hashes.append(hashes)
+        if not len(hashes):
+            self.empty.append(founder_n)
+        self.index.add(founder_n, hashes)
+        if self.prefilter is not None:
+            coarse = self.prefilter.coarse_size(hashes)
+            self.coarse_sizes.append(coarse)
+            if self.coarse_index is not None:
+                if not coarse:
+                    self.coarse_empty.append(founder_n)
+                self.coarse_index.add(founder_n, hashes[:coarse])
+        return founder_n
+
+    def first_match(self, key, hashes):
+        """
+        Find the first founder a sig belongs to.
+
+        Returns (founder_n, is_duplicate). founder_n is None if no founder
+        reaches the threshold; is_duplicate is True if the sig is the
+        founder itself.
+        """
+        coarse = None
+        if self.prefilter is not None:
+            coarse = self.prefilter.coarse_size(hashes)
+
+        use_coarse_index = self.coarse_index is not None and coarse
+        if self.threshold <= 0:
+            # everything passes a zero threshold, shared hashes or not
+            candidates = range(len(self.founders))
+        elif use_coarse_index:
+            candidates = sorted(self.coarse_index.candidates(hashes[:coarse]).union(self.coarse_empty, self.empty))
+        else:
+            candidates = sorted(self.index.candidates(hashes).union(self.empty))
+        self.stats.skipped += len(self.founders) - len(candidates)
+
+        match = (None, False)
+        for founder_n in candidates:
+            if key == self.keys[founder_n]:
+                match = (founder_n, True)
+                break
+            if coarse is not None and not self.prefilter.may_pass(hashes, self.hashes[founder_n], self.stats,
+                                                                  coarse, self.coarse_sizes[founder_n]):
+                continue
+            # same answer as max(sig.contained_by(founder), founder.contained_by(sig)) >= threshold,
+            # bias correction and all
+            if passes_threshold(hashes, self.hashes[founder_n], self.threshold, self.stats,
+                                scaled=self.scaled):
+                match = (founder_n, False)
+                break
+
+        if use_coarse_index and self.threshold > 0:
+            self._count_coarse_drops(hashes, set(candidates), match[0])
+        return match
+
+    def _count_coarse_drops(self, hashes, coarse_candidates, founder_n):
+        """
+        Founders that share full-resolution hashes but no coarse hashes with
+        a sig are dropped by the coarse index without a test. Finding them
+        means walking the full index, which is only done when auditing: the
+        drops before the match are counted as prefilter rejections (not as
+        skipped), and each is audited like any other rejected pair.
+        """
+        prefilter = self.prefilter
+        if not prefilter.audit_fraction:
+            return
+        for other_n in self.index.candidates(hashes) - coarse_candidates:
+            self.stats.skipped -= 1
+            if founder_n is not None and other_n > founder_n:
+                # never reached, as at full resolution
+                continue
+            self.stats.prefiltered += 1
+            prefilter.audit(hashes, self.hashes[other_n], self.stats)
+
+
+def make_prefilter(args, scaled):
+    "the coarse prefilter asked for on the command line, if any, for sketches at scaled"
+    if not args.prefilter_scaled:
+        return None
+    return CoarsePrefilter(args.prefilter_scaled, args.threshold, mode=args.prefilter_mode,
+                           audit_fraction=args.prefilter_audit, seed=args.seed, scaled=scaled)
+
 
+# per-process founder index for --processes; built once by the pool initializer
+_worker_index = None
 
-def cluster_to_founders(founders, siglist, batch_n, pass_n, members):
-    # splitting this out here may not be useful when single threaded, BUT
-    # seems like it would be useful to split batches of remaining sigs, map to this batch of founders
-    # then return lists that can be added to founders, members!
+def _init_assign_worker(founder_keys, founder_hashes, founder_offsets, threshold, prefilter, scaled):
+    global _worker_index
+    _worker_index = FounderIndex(threshold, prefilter, scaled)
+    for n, key in enumerate(founder_keys):
+        _worker_index.add(key, key, founder_hashes[founder_offsets[n]:founder_offsets[n+1]])
 
-    # assign sigs to clusters via max containment to founder genomes
+def _assign_shard(shard):
+    shard_n, keys, hashes, offsets = shard
+    _worker_index.stats = ThresholdStats()
+    if _worker_index.prefilter is not None:
+        # every worker gets a copy of the same prefilter; audit each shard differently
+        _worker_index.prefilter.reseed(shard_n)
+    matches = [_worker_index.first_match(key, hashes[offsets[n]:offsets[n+1]]) for n, key in enumerate(keys)]
+    return matches, _worker_index.stats
+
+
+def assign_to_founders(store, founders, siglist, stats, processes=1):
+    """
+    Find (founder_n, is_duplicate) for every sig in siglist, in siglist order.
+    With processes > 1, siglist is split into contiguous shards that are
+    mapped to the founders across a process pool. Threshold test counts
+    are added to stats.
+    """
+    if processes <= 1 or len(siglist) < processes:
+        index = FounderIndex(args.threshold, make_prefilter(args, store.scaled), store.scaled)
+        for founder in founders:
+            index.add(founder, store.key(founder), store.get_hashes(founder))
+        matches = [index.first_match(store.key(sig), store.get_hashes(sig)) for sig in siglist]
+        stats.update(index.stats)
+        return matches
+
+    # founders' hashes go to each worker once, via the initializer
+    founder_hashes, founder_offsets = store.gather(founders)
+    founder_keys = [store.key(founder) for founder in founders]
+    # a few shards per process keeps the workers evenly loaded
+    num_shards = processes * 4
+    shard_size = -(-len(siglist) // num_shards)
+    shards = []
+    for start in range(0, len(siglist), shard_size):
+        shard = siglist[start:start+shard_size]
+        shards.append((len(shards), [store.key(sig) for sig in shard]) + store.gather(shard))
+    with multiprocessing.Pool(processes, initializer=_init_assign_worker,
+                              initargs=(founder_keys, founder_hashes, founder_offsets, args.threshold,
+                                        make_prefilter(args, store.scaled), store.scaled)) as pool:
+        # map returns shard results in input order
+        results = pool.map(_assign_shard, shards)
+    for shard_matches, shard_stats in results:
+        stats.update(shard_stats)
+    return [match for shard_matches, shard_stats in results for match in shard_matches]
+
+
+def cluster_to_founders(store, founders, siglist, batch_n, pass_n, members, comparisons):
+    # assign sigs to clusters via max containment to founder genomes.
+    # With --processes, the remaining sigs are split into shards and mapped
+    # to this batch of founders in parallel; results come back in siglist order.
     notify(f'Attempting to cluster sigs to {len(founders)} new founders (pass {pass_n+1})')
     num_sigs = len(siglist)
-    batch_size = len(founders)
-    for n, (founder_from, founder) in enumerate(founders):
-        leftover = []
-        cluster_n = 0
-        if n % 500 == 0:
-            notify(f'batch {batch_n}: checking founder {n+1}/{str(batch_size)}. {str(len(siglist))}/{str(num_sigs)} sigs remaining')
-        for (sig_from, sig) in siglist:
+    notify(f'batch {batch_n}: checking {str(num_sigs)} sigs using {args.processes} process(es)')
+    stats = ThresholdStats()
+    matches = assign_to_founders(store, founders, siglist, stats, args.processes)
+    notify(f'    {stats.report()}')
+    comparisons.append(compareInfo(batch_n, pass_n, "cluster", **stats.as_dict()))
+
+    leftover = []
+    assigned = defaultdict(list)
+    for sig, (founder_n, is_duplicate) in zip(siglist, matches):
+        if founder_n is None:
+            leftover.append(sig)
+        elif not is_duplicate:
             #if this signature is already in the founder list, ignore
-            if all([sig_from ==founder_from, founder==sig]):
-                continue
-            maxcontain = max_containment(sig, founder)
-            if not maxcontain >= args.threshold:
-                leftover.append((sig_from, sig))
-            else:
-                members.append((sig_from, sig))
-                cluster_n +=1
-        if cluster_n:
-            notify(f'    clustered {str(cluster_n)} signature(s) with founder sig {str(founder)[:30]}...')
-        siglist = leftover
-        if siglist:
-            remaining = len(leftover)
-        else:
-            break
+            assigned[founder_n].append(sig)
+
+    # members are recorded founder by founder, in siglist order
+    for founder_n in sorted(assigned):
+        cluster = assigned[founder_n]
+        members.extend(cluster)
+        founder_name = store.names[founders[founder_n]]
+        notify(f'    clustered {str(len(cluster))} signature(s) with founder sig {founder_name[:30]}...')
+    siglist = leftover
 
     notify(f'{len(siglist)} signature(s) could not be assigned to existing clusters')
     return siglist, members
 
 
-def get_new_founders_via_uniqify(siglist, batch_n, pass_n):
+def get_new_founders_via_uniqify(store, siglist, batch_n, pass_n, comparisons):
     '''
     use sourmash_uniqify code to build a new set of founders
     '''
     batch_size = len(siglist)
     notify(f'Finding new cluster founders from batch {batch_n} ({len(siglist)} sigs)')
-    uniqify_pass_n = 0
-    new_founders, new_members = [],[]
-    while siglist:
-        if uniqify_pass_n % 500 == 0:
-            notify(f'batch {batch_n}: starting pass {uniqify_pass_n+1}. {str(len(siglist))}/{str(batch_size)} sigs remaining')
-        # make the first one a founder; try to find matches; repeat.
-        (founder_from, founder) = siglist.pop()
-        new_founders.append((founder_from, founder))
-
-        leftover = []
-        cluster_n = 0
-        for (sig_from, sig) in siglist:
-            #if this signature is already in the founder list, ignore
-            if all([sig_from ==founder_from, founder==sig]):
-                continue
-            maxcontain = max_containment(sig, founder)
-            if not maxcontain >= args.threshold:
-                leftover.append((sig_from, sig))
-            else:
-                new_members.append((sig_from, sig))
-                cluster_n +=1
-        if cluster_n:
-            notify(f'    clustered {str(cluster_n)} signature(s) with founder sig {str(founder)[:30]}...')
+    # uniqify pops the last sig as a founder, clusters the rest to it and repeats.
+    # Walking the batch from the end and checking each sig against the founders
+    # found so far gives the same founders and members, but each sig is only
+    # compared to founders it shares hashes with.
+    index = FounderIndex(args.threshold, make_prefilter(args, store.scaled), store.scaled)
+    assigned = defaultdict(list)
+    for n in range(batch_size - 1, -1, -1):
+        if (batch_size - n) % 10000 == 0:
+            notify(f'batch {batch_n}: {str(batch_size - n)}/{str(batch_size)} sigs checked; {len(index)} founders so far')
+        sig = siglist[n]
+        key, hashes = store.key(sig), store.get_hashes(sig)
+        founder_n, is_duplicate = index.first_match(key, hashes)
+        if founder_n is None:
+            # make this one a founder
+            index.add(sig, key, hashes)
+        elif not is_duplicate:
+            assigned[founder_n].append((n, sig))
 
-        siglist = leftover
-        uniqify_pass_n += 1
+    new_founders, new_members = list(index.founders), []
+    for founder_n in sorted(assigned):
+        # keep members in batch order within each cluster
+        cluster = sorted(assigned[founder_n])
+        new_members.extend(sig for (n, sig) in cluster)
+        founder_name = store.names[index.founders[founder_n]]
+        notify(f'    clustered {str(len(cluster))} signature(s) with founder sig {founder_name[:30]}...')
+    notify(f'    {index.stats.report()}')
+    comparisons.append(compareInfo(batch_n, pass_n, "uniqify", **index.stats.as_dict()))
 
     return new_founders, new_members
 
 
+class Telemetry:
+    """
+    Performance records for a run: one JSON line per uniqify batch and per
+    assignment pass, flushed as they're written so a long run can be
+    followed while it goes. With profile=True, the steps (the hot loops)
+    also run under cProfile.
+    """
+    def __init__(self, filename, append=False, profile=False):
+        self.fp = open(filename, 'at' if append else 'wt')
+        self.profiler = cProfile.Profile() if profile else None
+
+    def start(self):
+        "call at the start of a step; returns the start time for record()"
+        if self.profiler:
+            self.profiler.enable()
+        return time.perf_counter()
+
+    def record(self, stage, batch_n, pass_n, start, stats, sigs_checked, sigs_remaining,
+               founders_added, members_added):
+        "write the record for a step; stats is its ComparisonInfo"
+        wall = time.perf_counter() - start
+        if self.profiler:
+            self.profiler.disable()
+        pruned = stats.skipped + stats.pruned_size + stats.pruned_range + stats.prefiltered
+        info = stepInfo(batch_n, pass_n, stage, round(wall, 4), sigs_checked, sigs_remaining,
+                        founders_added, members_added, stats.pairs, pruned,
+                        round(stats.pairs / wall, 1) if wall else None,
+                        round(peak_rss_mb(), 1), round(peak_rss_mb(children=True), 1))
+        self.fp.write(json.dumps(info._asdict()) + "\n")
+        self.fp.flush()
+        return info
+
+    def close(self, profile_file=None, num_functions=25):
+        "close the telemetry file; save and summarize the profile, if any"
+        self.fp.close()
+        if self.profiler and profile_file:
+            self.profiler.dump_stats(profile_file)
+            notify(f'profile of the uniqify/assignment steps written to {profile_file}; top functions by cumulative time:')
+            pstats.Stats(self.profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(num_functions)
+
+
+def input_fingerprint(store, args):
+    """
+    Fingerprint of everything a checkpoint depends on: the loaded sigs, in
+    load order, and the options that change the clustering.
+    """
+    fingerprint = hashlib.sha1()
+    for row in range(len(store)):
+        fingerprint.update(f"{store.sources[row]},{store.names[row]},{store.md5s[row]}\n".encode())
+    fingerprint.update(f"{args.ksize},{args.moltype},{args.seed},{args.threshold},{args.batch_size},"
+                       f"{args.prefilter_scaled},{args.prefilter_mode}".encode())
+    return fingerprint.hexdigest()
+
+
+def write_checkpoint(filename, fingerprint, founders, members, siglist, rarefaction_info, comparisons, batch_n, pass_n):
+    """
+    Save the state after a finished batch. The checkpoint is written to a
+    temporary file and moved into place, so a crash never leaves a partial one.
+    """
+    state = {"fingerprint": fingerprint,
+             "batch_n": batch_n,
+             "pass_n": pass_n,
+             "founders": founders,
+             "members": members,
+             "siglist": siglist,
+             "rarefaction": [list(info) for info in rarefaction_info],
+             "comparisons": [list(info) for info in comparisons],
+             "rng_state": random.getstate()}
+    tmpfile = filename + ".tmp"
+    with open(tmpfile, 'wt') as fp:
+        json.dump(state, fp)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmpfile, filename)
+
+
+def read_checkpoint(filename, fingerprint):
+    with open(filename, 'rt') as fp:
+        state = json.load(fp)
+    if state["fingerprint"] != fingerprint:
+        notify(f'checkpoint {filename} was made from different input sigs or options; cannot resume from it.')
+        sys.exit(-1)
+    version, internal_state, gauss_next = state["rng_state"]
+    random.setstate((version, tuple(internal_state), gauss_next))
+    return state
+
+
 def main(args):
     batch_size = args.batch_size
-    #load new sigs
+    #load new sigs; only their hashes are kept, in one packed store.
+    # We work with store row ids from here on.
+    store = HashStore()
     siglist=[]
     if args.signature_sources:
-        siglist = load_sigs(args.signature_sources, args.moltype, args.ksize, sigdir=args.sigdir)
+        siglist = load_sigs(args.signature_sources, args.moltype, args.ksize, sigdir=args.sigdir, store=store)
     if args.siglist:
-        siglist+= load_sigs_from_list(args.siglist, args.moltype, args.ksize, sigdir=args.sigdir)
+        siglist+= load_sigs_from_list(args.siglist, args.moltype, args.ksize, sigdir=args.sigdir, store=store)
 
     notify(f'loaded {len(siglist)} new signatures total.')
 
-    notify(f'setting random number seed to {args.seed} and shuffling input sigs')
-    random.seed(args.seed)
-    random.shuffle(siglist)
+    notify(store.memory_report())
+
+    if args.prefilter_scaled:
+        if store.scaled and args.prefilter_scaled <= store.scaled:
+            notify(f'--prefilter-scaled {args.prefilter_scaled} must be larger than the signatures\' scaled ({store.scaled})')
+            sys.exit(-1)
+        notify(f'prefiltering candidate pairs at scaled={args.prefilter_scaled} ({args.prefilter_mode} mode)')
 
-    founders, members = [],[]
-    rarefaction_info=[]
-    batch_n=0
-    pass_n=0
-    #if existing clusters, map to them first
+    existing_founders = []
     if args.existing_founders:
-        # read in existing txt file of founders
-        founders = list(set(load_sigs_from_list(args.existing_founders, args.moltype, args.ksize)))
-        notify(f'found existing input founders.')
-        siglist, members  = cluster_to_founders(founders, siglist, batch_n, pass_n, members)
-        rarefaction_info.append(rareInfo(num_founders=len(founders), num_members=len(members)))
-        pass_n+=1
+        # read in existing txt file of founders. Loaded before any resume
+        # so store row ids match the ones in the checkpoint.
+        seen = set()
+        for founder in load_sigs_from_list(args.existing_founders, args.moltype, args.ksize, store=store):
+            # ignore founders listed more than once
+            if store.key(founder) not in seen:
+                seen.add(store.key(founder))
+                existing_founders.append(founder)
+
+    checkpoint_file = f'{args.prefix}.checkpoint.json'
+    fingerprint = input_fingerprint(store, args)
+    resuming = args.resume and os.path.exists(checkpoint_file)
+    # a resumed run adds to the telemetry of the run it continues
+    telemetry = Telemetry(f'{args.prefix}.telemetry.jsonl', append=resuming, profile=args.profile)
+    def checkpoint():
+        if args.checkpoint or args.resume:
+            write_checkpoint(checkpoint_file, fingerprint, founders, members, siglist, rarefaction_info, comparisons, batch_n, pass_n)
+
+    if resuming:
+        state = read_checkpoint(checkpoint_file, fingerprint)
+        founders, members, siglist = state["founders"], state["members"], state["siglist"]
+        rarefaction_info = [rareInfo(*info) for info in state["rarefaction"]]
+        comparisons = [compareInfo(*info) for info in state.get("comparisons", [])]
+        batch_n, pass_n = state["batch_n"], state["pass_n"]
+        notify(f'resuming from {checkpoint_file}: {len(founders)} founders, {len(members)} members, {len(siglist)} sigs remaining (batch {batch_n})')
+    else:
+        if args.resume:
+            notify(f'no checkpoint found at {checkpoint_file}; starting from scratch')
+        notify(f'setting random number seed to {args.seed} and shuffling input sigs')
+        random.seed(args.seed)
+        random.shuffle(siglist)
+
+        founders, members = [],[]
+        rarefaction_info=[]
+        comparisons = []
+        batch_n=0
+        pass_n=0
+        #if existing clusters, map to them first
+        if existing_founders:
+            founders = existing_founders
+            notify(f'found existing input founders.')
+            start, num_sigs = telemetry.start(), len(siglist)
+            siglist, members  = cluster_to_founders(store, founders, siglist, batch_n, pass_n, members, comparisons)
+            telemetry.record("cluster", batch_n, pass_n, start, comparisons[-1], num_sigs, len(siglist),
+                             founders_added=0, members_added=len(members))
+            rarefaction_info.append(rareInfo(num_founders=len(founders), num_members=len(members)))
+            pass_n+=1
+            checkpoint()
 
     while siglist:
         # if unassigned sigs, uniqify to get new founders
-        new_founders, new_members = get_new_founders_via_uniqify(siglist[:batch_size], batch_n, pass_n)
+        start, batch = telemetry.start(), siglist[:batch_size]
+        new_founders, new_members = get_new_founders_via_uniqify(store, batch, batch_n, pass_n, comparisons)
         siglist = siglist[batch_size:]
+        telemetry.record("uniqify", batch_n, pass_n, start, comparisons[-1], len(batch), len(siglist),
+                         founders_added=len(new_founders), members_added=len(new_members))
         founders += new_founders
         members += new_members
         # cluster all sigs to list of new founders
         if siglist:
-            siglist, members = cluster_to_founders(new_founders, siglist, batch_n, pass_n, members)
+            start, num_sigs, num_members = telemetry.start(), len(siglist), len(members)
+            siglist, members = cluster_to_founders(store, new_founders, siglist, batch_n, pass_n, members, comparisons)
+            telemetry.record("cluster", batch_n, pass_n, start, comparisons[-1], num_sigs, len(siglist),
+                             founders_added=0, members_added=len(members) - num_members)
         rarefaction_info.append(rareInfo(num_founders=len(founders), num_members=len(members)))
         batch_n+=1
         pass_n +=1
+        checkpoint()
 
 
     # write all founders, members
@@ -185,18 +518,35 @@ def main(args):
     rarefactionDF = pd.DataFrame.from_records(rarefaction_info, columns = rareInfo._fields)
     rarefactionDF.to_csv(f'{prefix}.rarefaction.txt', index=False)
 
+    # threshold test counts per uniqify/cluster step, to see what pruning saved
+    comparisonDF = pd.DataFrame.from_records(comparisons, columns = compareInfo._fields)
+    comparisonDF.to_csv(f'{prefix}.comparisons.csv', index=False)
+    total = ThresholdStats()
+    for info in comparisons:
+        total.update(info)
+    notify(f'threshold tests, all batches: {total.report()}')
+    if args.prefilter_mode == 'estimate' and total.audited < min(total.prefiltered, MIN_PREFILTER_AUDITS):
+        notify(f'WARNING: only {total.audited} of {total.prefiltered} coarse prefilter rejections were audited, '
+               f'too few for a reliable false-negative rate; raise --prefilter-audit (up to 1.0)')
+    telemetry.close(profile_file=f'{prefix}.profile.pstats')
+    notify(f'per-step telemetry written to {prefix}.telemetry.jsonl')
+
     with open(f'{prefix}.founders.siglist.txt', 'wt') as fp:
-        for (founder_from, founder) in founders:
-            fp.write(founder_from + "\n")
+        for founder in founders:
+            fp.write(store.sources[founder] + "\n")
     with open(f'{prefix}.founders.siglist.csv', 'wt') as fp:
-        for (founder_from, founder) in founders:
-            fp.write(f"{str(founder)},{founder_from}\n")
+        for founder in founders:
+            fp.write(f"{store.names[founder]},{store.sources[founder]}\n")
     with open(f'{prefix}.members.siglist.txt', 'wt') as fp:
-        for (member_from, member) in members:
-            fp.write(member_from + "\n")
+        for member in members:
+            fp.write(store.sources[member] + "\n")
     with open(f'{prefix}.members.siglist.csv', 'wt') as fp:
-        for (member_from, member) in members:
-            fp.write(f"{str(member)},{member_from}\n")
+        for member in members:
+            fp.write(f"{store.names[member]},{store.sources[member]}\n")
+
+    # all outputs are written; the checkpoint is no longer needed
+    if os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
 
 
 if __name__ == '__main__':
@@ -211,8 +561,25 @@ if __name__ == '__main__':
     p.add_argument('--threshold', type=float, default=0.05) # 0.2
     p.add_argument('--existing-founders', action="append", help="siglist of existing founders")
     p.add_argument('--batch-size', type=int, default=5000)
+    p.add_argument('--processes', type=int, default=1,
+                   help='number of processes to use when clustering remaining sigs to each batch of founders')
     p.add_argument('--prefix', default='cluster',
                    help='output filename prefix (can include directories)')
+    p.add_argument('--prefilter-scaled', type=int, default=0,
+                   help='test candidate pairs on sketches downsampled to this scaled first, e.g. 1000-10000 (default: off)')
+    p.add_argument('--prefilter-mode', choices=CoarsePrefilter.modes, default='exact',
+                   help="'exact' never drops a pair that passes at full resolution; "
+                        "'estimate' rejects on coarse max containment and reports a measured false-negative rate")
+    p.add_argument('--prefilter-audit', type=float, default=0.01,
+                   help="fraction of 'estimate' prefilter rejections to re-check at full resolution; "
+                        "0 skips counting the pairs the coarse index drops, and measures no false-negative rate")
+    p.add_argument('--profile', action='store_true',
+                   help='run the uniqify/assignment steps under cProfile; writes {prefix}.profile.pstats '
+                        '(with --processes, time spent in worker processes is not profiled)')
+    p.add_argument('--checkpoint', action='store_true',
+                   help='save state to {prefix}.checkpoint.json after every batch')
+    p.add_argument('--resume', action='store_true',
+                   help='resume from {prefix}.checkpoint.json, if present (implies --checkpoint)')
     args = p.parse_args()
     if not any([args.signature_sources, args.siglist]):
         print("Please provide signatures via '--signature-sources' or '--siglist'")
@@ -0,0 +1,160 @@
+"""
+Many genomes in one consolidated FASTA file.
+
+`GenomeStoreWriter` / `GenomeStore` keep many genomes in one FASTA file
+plus a faidx-style index of byte offsets per accession, instead of one
+small FASTA file per genome. A genome's records are read back with a seek
+into a memory map, without scanning the file.
+
+Only the standard library is used, so tools that just read genomes back
+out (e.g. extract-genome.py, piping into prodigal) run in any python
+environment.
+
+This code is under CC0.
+"""
+import os
+import mmap
+from collections import OrderedDict
+
+
+GENOME_INDEX_SUFFIX = ".gidx"
+GENOME_INDEX_HEADER = "accession\toffset\tnum_bytes\tnum_records\tlength\n"
+
+
+class GenomeStoreWriter:
+    """
+    Write records for many genomes into one FASTA file, plus an index
+    (`{fasta}.gidx`) of where each genome's records are.
+
+    Records are appended in the order they're added; consecutive records of
+    the same accession form one span. A genome whose records aren't
+    contiguous gets several spans, read back in order. Each index line is:
+    accession, byte offset, number of bytes, number of records, and the
+    residue count of the span.
+
+    The index is only written by `close`, once every genome is in; a run
+    that stops partway calls `abort` instead (as leaving a `with` block on
+    an exception does), so an incomplete store never has an index.
+    """
+    def __init__(self, fasta_path, index_path=None):
+        self.fasta_path = fasta_path
+        self.index_path = index_path or fasta_path + GENOME_INDEX_SUFFIX
+        self.fp = open(fasta_path, 'wb')
+        # an index left by an earlier store would describe the wrong file
+        if os.path.exists(self.index_path):
+            os.remove(self.index_path)
+        self.offset = 0
+        # [accession, offset, num_bytes, num_records, length]
+        self.spans = []
+
+    def add(self, accession, name, sequence):
+        record = f">{name}\n{sequence}\n".encode()
+        self.fp.write(record)
+        if self.spans and self.spans[-1][0] == accession:
+            span = self.spans[-1]
+        else:
+            span = [accession, self.offset, 0, 0, 0]
+            self.spans.append(span)
+        span[2] += len(record)
+        span[3] += 1
+        span[4] += len(sequence)
+        self.offset += len(record)
+
+    def close(self):
+        "finish the store: close the fasta, then write its index"
+        self.fp.close()
+        tmpfile = self.index_path + ".tmp"
+        with open(tmpfile, 'wt') as out:
+            out.write(GENOME_INDEX_HEADER)
+            for span in self.spans:
+                out.write("\t".join(map(str, span)) + "\n")
+        os.replace(tmpfile, self.index_path)
+
+    def abort(self):
+        "stop writing an incomplete store: close the fasta, with no index"
+        self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class GenomeStore:
+    """
+    Read genomes back from a store written by GenomeStoreWriter. Only the
+    index is read up front; genome records are sliced out of a memory map.
+    """
+    def __init__(self, fasta_path, index_path=None):
+        self.fasta_path = fasta_path
+        self.index_path = index_path or fasta_path + GENOME_INDEX_SUFFIX
+        # accession -> [(offset, num_bytes)], accessions in first-seen order
+        self.spans = OrderedDict()
+        self._lengths = {}
+        self._num_records = {}
+        with open(self.index_path, 'rt') as fp:
+            header = fp.readline()
+            if header != GENOME_INDEX_HEADER:
+                raise ValueError(f"{self.index_path} is not a genome store index")
+            for line in fp:
+                accession, offset, num_bytes, num_records, length = line.rstrip("\n").split("\t")
+                self.spans.setdefault(accession, []).append((int(offset), int(num_bytes)))
+                self._num_records[accession] = self._num_records.get(accession, 0) + int(num_records)
+                self._lengths[accession] = self._lengths.get(accession, 0) + int(length)
+        self._fp = open(fasta_path, 'rb')
+        if os.fstat(self._fp.fileno()).st_size:
+            self._map = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            # empty stores can't be mapped
+            self._map = b''
+
+    def __len__(self):
+        return len(self.spans)
+
+    def __contains__(self, accession):
+        return accession in self.spans
+
+    def accessions(self):
+        "accessions, in the order they first appear in the store"
+        return list(self.spans)
+
+    def length(self, accession):
+        "total residues in a genome's records, from the index"
+        return self._lengths[accession]
+
+    def lengths(self):
+        return OrderedDict((accession, self._lengths[accession]) for accession in self.spans)
+
+    def num_records(self, accession):
+        return self._num_records[accession]
+
+    def get_bytes(self, accession):
+        "a genome's records, as the FASTA bytes they were written as"
+        return b"".join(self._map[offset:offset+num_bytes] for offset, num_bytes in self.spans[accession])
+
+    def iter_records(self, accession):
+        "yield (name, sequence) for each of a genome's records"
+        # the writer puts every record on exactly two lines
+        lines = self.get_bytes(accession).decode().split("\n")
+        for header, sequence in zip(lines[0::2], lines[1::2]):
+            yield header[1:], sequence
+
+    def write_fasta(self, accession, fp):
+        "write a genome's records to a binary file handle"
+        for offset, num_bytes in self.spans[accession]:
+            fp.write(self._map[offset:offset+num_bytes])
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
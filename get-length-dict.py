@@ -2,37 +2,37 @@ import os
 import sys
 import argparse
 
-import screed
 import pandas as pd
 
+from fastautils import iter_fasta_lengths, total_lengths
+from genomestore import GenomeStore
+
 
 def find_genome_lengths_by_record(fastafile, outfile):
     #seqlens = defaultdict(int)
 
     with open(outfile, "w") as outF:
-        with screed.open(fastafile) as records:
-            for n, record in enumerate(records):
-                if n % 10000 == 0:
-                    print(f"... processing {n}th record, {record.name}\n")
-                record_len = len(record.sequence)
-                outF.write(f"{record.name},{record_len}\n")
-                #seqlens[record.name] = record_len
+        # lengths are counted straight from the raw bytes; no sequence strings are built
+        for n, (name, record_len) in enumerate(iter_fasta_lengths(fastafile)):
+            if n % 10000 == 0:
+                print(f"... processing {n}th record, {name}\n")
+            outF.write(f"{name},{record_len}\n")
+            #seqlens[name] = record_len
 
     #return seqlens
 
-def find_lengths_by_file(acc2files, outfile):
+def find_lengths_by_file(acc2files, outfile, processes=1):
 
     with open(outfile, "w") as outF:
         #seqlens = defaultdict(int)
         num_files = 0
-        for accession, filename in acc2files.items():
+        # files are scanned in order, across a process pool if processes > 1
+        accessions = list(acc2files.keys())
+        lengths = total_lengths(list(acc2files.values()), processes=processes)
+        for accession, record_len in zip(accessions, lengths):
             num_files+=1
             if num_files % 10000 == 0:
                 print(f"... processing {num_files}th file, {accession}\n")
-            record_len=0
-            with screed.open(filename) as records:
-                for record in records:
-                    record_len += len(record.sequence)
             outF.write(f"{accession},{record_len}\n")
             #seqlens[accession] = record_len
 
@@ -41,12 +41,19 @@ def find_lengths_by_file(acc2files, outfile):
 
 
 
+def find_lengths_from_genome_store(store_fasta, outfile):
+    # genome lengths are kept in the store's index; nothing needs scanning
+    with GenomeStore(store_fasta) as store, open(outfile, "w") as outF:
+        for accession, genome_len in store.lengths().items():
+            outF.write(f"{accession},{genome_len}\n")
+
+
 def main(args):
     # find fasta lengths for each genome or proteome
     if args.acc2fastafilescsv:
         acc2file = pd.read_csv(args.acc2fastafilescsv, header=0)
         accD = pd.Series(acc2file.filename.values,index=acc2file.accession).to_dict()
-        find_lengths_by_file(accD, args.lengths_csv)
+        find_lengths_by_file(accD, args.lengths_csv, processes=args.processes)
     elif args.fastalist:
         #sigh, some bespoke stuff for the protein filelist
         fasta_files = [x.rstrip() for x in open(args.fastalist, 'r')]
@@ -54,11 +61,13 @@ def main(args):
         for ff in fasta_files:
             acc = os.path.basename(ff).rsplit(".proteins.fasta")[0].split("pigeon1.0-")[1]
             accD[acc] = ff
-        find_lengths_by_file(accD, args.lengths_csv)
+        find_lengths_by_file(accD, args.lengths_csv, processes=args.processes)
+    elif args.genome_store:
+        find_lengths_from_genome_store(args.genome_store, args.lengths_csv)
     elif args.fastafile:
         find_genome_lengths_by_record(args.fastafile, args.lengths_csv)
     else:
-        print("please provide fasta file information via --fastafile or --acc2fastafilecsv")
+        print("please provide fasta file information via --fastafile, --genome-store or --acc2fastafilecsv")
 
     print("done!")
 
@@ -70,7 +79,9 @@ def cmdline(sys_args):
     p.add_argument("--acc2fastafilescsv", help="provide csv of accession,filename to get length for each file")
     p.add_argument("--fastalist", help="alternatively, if just have fastalist, input here and use bespoke filtering to get accession")
     p.add_argument("--fastafile", help="alternatively, if using just one fasta file, calculate length per record here by providing the fasta")
+    p.add_argument("--genome-store", help="alternatively, get the length of each genome in a genome store (split-fasta-by-genome-dict.py --genome-store)")
     p.add_argument("--lengths-csv", help="output lengths csv", required=True)
+    p.add_argument("--processes", type=int, default=1, help="number of processes to scan per-genome fasta files with")
     args = p.parse_args()
     return main(args)
 
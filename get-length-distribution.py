@@ -1,29 +1,81 @@
 import os
 import sys
 import argparse
-import pprint
-from collections import defaultdict
+import multiprocessing
 
-import screed
 import numpy as np
 import pandas as pd
 
+from fastautils import (bin_length_histogram, iter_fasta_lengths, length_histogram,
+                        merge_length_histograms, summarize_lengths, total_lengths)
+
+
+def record_length_histogram(fastafile):
+    "sparse (lengths, counts) histogram of the record lengths in one fasta file"
+    return length_histogram(length for _, length in iter_fasta_lengths(fastafile))
+
+
+def read_fastalist(fastalist):
+    with open(fastalist, 'rt') as fp:
+        return [x.strip() for x in fp if x.strip()]
+
+
+def find_length_histogram(fastafiles, per_file=False, processes=1, chunksize=8):
+    """
+    Histogram the lengths of every record in fastafiles -- or, with per_file,
+    the total length of each file, for one genome per file. Each file (or
+    chunk of files) is histogrammed separately, across a process pool if
+    processes > 1, and the partial histograms are merged.
+    """
+    if per_file:
+        return length_histogram(total_lengths(fastafiles, processes=processes, chunksize=chunksize))
+    if processes <= 1:
+        return merge_length_histograms(record_length_histogram(f) for f in fastafiles)
+    with multiprocessing.Pool(processes) as pool:
+        # histograms merge the same in any order
+        partials = pool.imap_unordered(record_length_histogram, fastafiles, chunksize=chunksize)
+        return merge_length_histograms(partials)
+
+
 def main(args):
-    # get basename for these sequences
-    records = screed.open(args.fastafile)
-    seqlens = defaultdict(int)
-    for record in records:
-        record_len = len(record.sequence)
-        seqlens[record_len]+=1
-    lenDF = pd.Series(seqlens).to_frame().reset_index()
-    lenDF.to_csv(args.output_csv, header=["length", "count"], index=False)
+    fastafiles = []
+    if args.fastafile:
+        fastafiles.append(args.fastafile)
+    if args.fastalist:
+        fastafiles += read_fastalist(args.fastalist)
+    if not fastafiles:
+        print("** Error: provide a fastafile and/or --fastalist")
+        sys.exit(-1)
+
+    print(f"Histogramming lengths for {len(fastafiles)} fasta files...")
+    lengths, counts = find_length_histogram(fastafiles, per_file=args.per_file,
+                                            processes=args.processes)
+    print(f"...found {counts.sum()} lengths ({len(lengths)} distinct)")
+
+    if args.bins:
+        edges, binned = bin_length_histogram(lengths, counts, args.bins, log_bins=args.log_bins)
+        lenDF = pd.DataFrame({"bin_start": edges[:-1], "bin_end": edges[1:], "count": binned})
+    else:
+        lenDF = pd.DataFrame({"length": lengths, "count": counts})
+    lenDF.to_csv(args.output_csv, index=False)
+
+    if args.quantiles_csv:
+        summary = summarize_lengths(lengths, counts)
+        summary.to_frame().to_csv(args.quantiles_csv, index_label="statistic")
+        print(summary.to_string())
 
 
 def cmdline(sys_args):
     "Command line entry point w/argparse action."
     p = argparse.ArgumentParser()
-    p.add_argument("fastafile")
+    p.add_argument("fastafile", nargs="?")
     p.add_argument("output_csv")
+    p.add_argument("--fastalist", help="file of fasta filenames, one per line, to histogram together")
+    p.add_argument("--per-file", action="store_true", help="count each file's total length (one genome per file) instead of each record's length")
+    p.add_argument("--processes", type=int, default=1, help="number of processes to scan fasta files with")
+    p.add_argument("--bins", type=int, default=0, help="write counts in this many bins instead of per distinct length")
+    p.add_argument("--log-bins", action="store_true", help="space --bins evenly in log length")
+    p.add_argument("--quantiles-csv", help="also write count, mean, min, quantiles and max of the lengths here")
     args = p.parse_args()
     return main(args)
 
@@ -0,0 +1,702 @@
+"""
+Compact, array-backed storage for the hashes of many sourmash signatures.
+
+Every signature's sorted hashes are packed into one uint64 array, CSR-style:
+the hashes of signature i are `hashes[offsets[i]:offsets[i+1]]`. Names,
+source paths and md5sums are kept in side tables, so the scripts can pass
+around integer row ids instead of `(filename, SourmashSignature)` tuples.
+
+`compare_one_to_many` compares one query against a whole block of stored
+signatures in a single vectorized call, replacing per-pair `contained_by`
+/ `jaccard` method calls. Given the sketches' scaled, containments get
+sourmash's bias correction -- shared hashes over size * (1 - (1 - 1/scaled)
+** (size * scaled)), clamped to [0, 1] -- so small sketches come out exactly
+as sourmash's `contained_by` / `max_containment` do. `HashIndex` is an inverted (hash -> ids) index
+for finding the few sketches that share any hashes with a query.
+
+Clustering only needs to know whether max containment reaches a threshold.
+Max containment >= t needs at least ceil(t * min(|A|, |B|)) shared hashes
+(fewer for tiny sketches, with the bias correction), so `passes_threshold` and `HashStore.passes_threshold` skip pairs that can't
+get there (empty sketches, too few hashes inside the other sketch's hash
+range) and stop merging as soon as the answer is known. `ThresholdStats`
+counts how much work that saved.
+
+`CoarsePrefilter` is an optional cheaper tier in front of that test: it
+looks only at the hashes a sketch would keep at a much larger scaled.
+
+`HashStore.share` copies a store's packed arrays into shared memory once, so
+worker processes can `HashStore.attach` to them and compare rows without
+the hashes being pickled or copied per process.
+
+Loading signatures straight into a store (`add_signature` as they are read)
+keeps only name, source path, ksize/moltype/scaled and the hashes; the
+abundance vectors and the rest of the signature are dropped as it goes.
+`signature_nbytes` counts what each full signature held, so the store can
+report what that saved.
+
+This code is under CC0.
+"""
+import sys
+import math
+import resource
+import functools
+from collections import Counter, defaultdict, namedtuple
+from multiprocessing import shared_memory
+
+import numpy as np
+from sourmash.minhash import _get_max_hash_for_scaled
+
+BlockComparison = namedtuple('BlockComparison',
+                             'common, query_containment, target_containment, max_containment, jaccard')
+
+# hashes of the smaller sketch looked up per step of the early-exit merge
+MERGE_CHUNK_SIZE = 64
+
+
+def sorted_hashes(minhash):
+    "return the hashes of a sourmash MinHash as a sorted uint64 array"
+    hashes = np.fromiter(minhash.hashes, dtype=np.uint64, count=len(minhash))
+    hashes.sort()
+    return hashes
+
+
+def max_hashes_for_scaled(scaled_vals):
+    "max_hash cutoff for each scaled value, as a uint64 array"
+    return np.array([_get_max_hash_for_scaled(sc) for sc in scaled_vals], dtype=np.uint64)
+
+
+def counts_at_max_hashes(hashes, max_hashes):
+    """
+    Number of hashes a sketch keeps at each max_hash cutoff, from its sorted
+    hashes: downsampling keeps hashes <= max_hash, so this is one vectorized
+    searchsorted instead of one downsampled MinHash per cutoff.
+    """
+    return np.searchsorted(hashes, max_hashes, side='right')
+
+
+def peak_rss_mb(children=False):
+    """
+    peak resident set size of this process, in MB; with children=True, of
+    the largest finished child process (e.g. pool workers)
+    """
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    peak = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in bytes on macOS, kilobytes on linux
+    if sys.platform == 'darwin':
+        return peak / 1024**2
+    return peak / 1024
+
+
+def signature_nbytes(sig):
+    """
+    Bytes a loaded (single-sketch) SourmashSignature holds: its hash and
+    abundance vectors and its name/filename/license strings, which live on
+    the Rust side, plus the python wrapper. Rust struct overhead isn't
+    counted, so this is a slight undercount.
+    """
+    mh = sig.minhash
+    nbytes = 8 * len(mh) * (2 if mh.track_abundance else 1)
+    for text in (sig.name, sig.filename, getattr(sig, 'license', None)):
+        if text:
+            nbytes += len(text.encode())
+    return nbytes + sys.getsizeof(sig) + sys.getsizeof(sig.__dict__)
+
+
+def _count_common(query, targets, target_offsets):
+    "number of hashes each target in the block shares with the query"
+    query_size = len(query)
+    if not (query_size and len(targets)):
+        return np.zeros(len(target_offsets) - 1, dtype=np.int64)
+    # look up every target hash in the (sorted) query
+    pos = np.searchsorted(query, targets)
+    pos[pos == query_size] = 0
+    found = query[pos] == targets
+    found_cumsum = np.zeros(len(targets) + 1, dtype=np.int64)
+    np.cumsum(found, out=found_cumsum[1:])
+    return found_cumsum[target_offsets[1:]] - found_cumsum[target_offsets[:-1]]
+
+
+@functools.lru_cache(maxsize=None)
+def _denominator_table(scaled):
+    """
+    sourmash's containment denominators, size * bias factor, for the sketch
+    sizes where the bias factor isn't exactly 1.0 as a float (a few dozen
+    at most); computed with python floats, exactly as sourmash does.
+    """
+    table = [0.0]
+    while True:
+        size = len(table)
+        bias_factor = 1.0 - (1.0 - 1.0 / scaled) ** float(size * scaled)
+        if bias_factor == 1.0:
+            return np.array(table)
+        table.append(size * bias_factor)
+
+
+def containment_denominators(sizes, scaled=None):
+    """
+    What sourmash divides shared hashes by for the containment of sketches
+    of these sizes: the size times its bias factor, which is only below 1.0
+    for tiny sketches. Without scaled, just the sizes (no correction).
+    """
+    sizes = np.asarray(sizes, dtype=np.int64)
+    denominators = sizes.astype(np.float64)
+    if scaled:
+        table = _denominator_table(scaled)
+        small = sizes < len(table)
+        denominators[small] = table[sizes[small]]
+    return denominators
+
+
+def _containment(common, denominators):
+    "shared hashes over denominators; empty sketches have containment 0, and sourmash clamps to [0, 1]"
+    with np.errstate(divide='ignore', invalid='ignore'):
+        containment = np.where(denominators > 0, common / denominators, 0.0)
+    return np.clip(containment, 0.0, 1.0)
+
+
+def compare_one_to_many(query, targets, target_offsets, scaled=None):
+    """
+    Compare one sorted hash array against a block of sorted hash arrays.
+
+    `targets` holds the concatenated target hashes; target j is
+    `targets[target_offsets[j]:target_offsets[j+1]]`. Returns a
+    BlockComparison of per-target arrays: common hash count, containment
+    of the query in each target, containment of each target in the query,
+    max containment and Jaccard similarity. With scaled, containments are
+    bias-corrected as sourmash's are; the larger of the two is then the one
+    over the smaller sketch, i.e. sourmash's max_containment.
+    """
+    target_offsets = np.asarray(target_offsets, dtype=np.int64)
+    query_size = len(query)
+    target_sizes = np.diff(target_offsets)
+
+    common = _count_common(query, targets, target_offsets)
+
+    # same arithmetic as sourmash: empty sketches have containment 0
+    query_containment = _containment(common, containment_denominators(np.full(len(common), query_size), scaled))
+    target_containment = _containment(common, containment_denominators(target_sizes, scaled))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        union = query_size + target_sizes - common
+        jaccard = np.where(union > 0, common / union, 0.0)
+    max_containment = np.maximum(query_containment, target_containment)
+
+    return BlockComparison(common, query_containment, target_containment,
+                           max_containment, jaccard)
+
+
+def min_common_hashes(threshold, size_a, size_b, scaled=None):
+    """
+    Smallest number of shared hashes that gives max containment >= threshold
+    for sketches of these sizes: ceil(threshold * denominator) for the
+    smaller sketch's containment denominator (see containment_denominators),
+    nudged so it agrees exactly with the float test `common / denominator >= t`.
+    Returns None if the threshold can't be reached at all.
+    """
+    if threshold <= 0:
+        return 0
+    min_size = min(size_a, size_b)
+    if not min_size or threshold > 1:
+        # empty sketches have containment 0; containment is clamped to 1
+        return None
+    denominator = float(containment_denominators([min_size], scaled)[0])
+    needed = math.ceil(threshold * denominator)
+    while needed > 0 and (needed - 1) / denominator >= threshold:
+        needed -= 1
+    while needed / denominator < threshold:
+        needed += 1
+    if needed > min_size:
+        return None
+    return needed
+
+
+def _min_common_hashes_block(threshold, query_size, target_sizes, scaled=None):
+    """
+    min_common_hashes for a block of targets; returns (needed, possible)
+    arrays, where needed is only meaningful where possible is True.
+    """
+    min_sizes = np.minimum(query_size, target_sizes)
+    if threshold <= 0:
+        return np.zeros(len(min_sizes), dtype=np.int64), np.ones(len(min_sizes), dtype=bool)
+    denominators = containment_denominators(min_sizes, scaled)
+    needed = np.ceil(threshold * denominators).astype(np.int64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        needed -= (needed > 0) & ((needed - 1) / denominators >= threshold)
+        needed += needed / denominators < threshold
+    possible = (min_sizes > 0) & (needed <= min_sizes) & (threshold <= 1)
+    return needed, possible
+
+
+class ThresholdStats:
+    """
+    Counts of threshold tests and of the work the bounds saved.
+
+    pairs: pairs handed to the threshold kernels
+    skipped: pairs never tested because they share no hashes (hash index)
+    pruned_size: pairs that can't pass because a sketch is empty
+    pruned_range: pairs with too few hashes inside the other sketch's range
+    accepted_early / rejected_early: merges stopped before the end
+    merged: merges that ran to the end
+    hashes_checked: hashes actually looked up
+    prefiltered: pairs rejected by a CoarsePrefilter (or dropped by a
+      coarse hash index, when that's counted)
+    audited / audit_false_negatives: prefilter rejections re-checked at
+      full resolution, and how many of those actually pass
+    """
+    fields = ('pairs', 'skipped', 'pruned_size', 'pruned_range',
+              'accepted_early', 'rejected_early', 'merged', 'hashes_checked',
+              'prefiltered', 'audited', 'audit_false_negatives')
+
+    def __init__(self):
+        for field in self.fields:
+            setattr(self, field, 0)
+
+    def update(self, other):
+        "add the counts of another ThresholdStats (or any record with the same fields)"
+        for field in self.fields:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in self.fields}
+
+    def report(self):
+        "one-line summary of tests done and pruned"
+        considered = self.pairs + self.skipped + self.prefiltered
+        pruned = self.skipped + self.pruned_size + self.pruned_range + self.prefiltered
+        early = self.accepted_early + self.rejected_early
+        pct = lambda n: 100 * n / considered if considered else 0.0
+        skipped = f'{self.skipped} skipped by the hash index, ' if self.skipped else ''
+        return (f'{considered} pairs: {skipped}'
+                f'{self.pruned_size + self.pruned_range} pruned by size/range bounds '
+                f'({pct(pruned):.1f}% never merged); {early} merges stopped early, '
+                f'{self.merged} ran to the end; {self.hashes_checked} hashes checked'
+                + self.prefilter_report())
+
+    def prefilter_report(self):
+        if not (self.prefiltered or self.audited):
+            return ''
+        report = f'; {self.prefiltered} rejected by the coarse prefilter'
+        if self.audited:
+            fn_rate = self.audit_false_negatives / self.audited
+            report += (f' ({self.audit_false_negatives} of {self.audited} audited rejections '
+                       f'pass at full resolution: false-negative rate {fn_rate:.4f})')
+        return report
+
+
+def passes_threshold(a, b, threshold, stats=None, chunk_size=MERGE_CHUNK_SIZE, scaled=None):
+    """
+    Is max containment of two sorted hash arrays >= threshold?
+
+    Same answer as computing both containments (bias-corrected, given the
+    sketches' scaled, as sourmash's are), but pairs that can't reach
+    the needed number of shared hashes are rejected without a merge, and the
+    merge walks the smaller sketch in chunks, stopping once enough hashes
+    have been found or too few are left to find.
+    """
+    if stats is None:
+        stats = ThresholdStats()
+    stats.pairs += 1
+    needed = min_common_hashes(threshold, len(a), len(b), scaled)
+    if needed is None:
+        stats.pruned_size += 1
+        return False
+    if needed == 0:
+        stats.accepted_early += 1
+        return True
+
+    small, large = (a, b) if len(a) <= len(b) else (b, a)
+    # only the small sketch's hashes within the large one's range can be shared
+    lo = int(np.searchsorted(small, large[0], side='left'))
+    hi = int(np.searchsorted(small, large[-1], side='right'))
+    if hi - lo < needed:
+        stats.pruned_range += 1
+        return False
+
+    common = 0
+    for start in range(lo, hi, chunk_size):
+        chunk = small[start:min(start + chunk_size, hi)]
+        # every chunk hash is <= large[-1], so positions are in bounds
+        pos = np.searchsorted(large, chunk)
+        common += int(np.count_nonzero(large[pos] == chunk))
+        stats.hashes_checked += len(chunk)
+        remaining = hi - start - len(chunk)
+        if common >= needed:
+            if remaining:
+                stats.accepted_early += 1
+            else:
+                stats.merged += 1
+            return True
+        if common + remaining < needed:
+            if remaining:
+                stats.rejected_early += 1
+            else:
+                stats.merged += 1
+            return False
+
+
+def _range_bound(query, target_first, target_last):
+    "number of query hashes within each target's [first, last] hash range"
+    return (np.searchsorted(query, target_last, side='right') -
+            np.searchsorted(query, target_first, side='left'))
+
+
+def _threshold_block(query, target_sizes, target_first, target_last, threshold, stats, get_block,
+                     scaled=None):
+    """
+    Vectorized threshold test of one sorted hash array against a block of
+    targets, given their sizes and first/last hashes. Targets ruled out by
+    the size and range bounds are dropped before `get_block(keep)` fetches
+    the (hashes, offsets) of the rest, which are counted in one pass.
+    """
+    num_targets = len(target_sizes)
+    stats.pairs += num_targets
+    needed, possible = _min_common_hashes_block(threshold, len(query), target_sizes, scaled)
+    if threshold <= 0:
+        stats.accepted_early += num_targets
+        return np.ones(num_targets, dtype=bool)
+    stats.pruned_size += int(np.count_nonzero(~possible))
+
+    # shared hashes can't exceed the query hashes inside the target's range
+    in_range = _range_bound(query, target_first, target_last)
+    keep = possible & (in_range >= needed)
+    stats.pruned_range += int(np.count_nonzero(possible & ~keep))
+
+    passes = np.zeros(num_targets, dtype=bool)
+    if keep.any():
+        kept_hashes, kept_offsets = get_block(keep)
+        stats.merged += int(np.count_nonzero(keep))
+        stats.hashes_checked += len(kept_hashes)
+        passes[keep] = _count_common(query, kept_hashes, kept_offsets) >= needed[keep]
+    return passes
+
+
+class CoarsePrefilter:
+    """
+    Cheap first-pass threshold test on heavily downsampled sketches.
+
+    Downsampling a FracMinHash sketch to a larger scaled keeps only the
+    hashes <= a smaller max_hash, i.e. a prefix of the sorted hash array, so
+    the coarse sketch is just `hashes[:coarse_size(hashes)]` -- no copies.
+
+    mode 'exact': reject a pair only if even sharing every hash above the
+      coarse cutoff couldn't reach the threshold:
+      coarse_common + min(fine-only hashes of a, of b) < needed.
+      Never drops a pair that passes at full resolution.
+    mode 'estimate': reject a pair if its coarse max containment (bias-corrected
+      at the coarse scaled) is below the threshold. Faster, but lossy; each rejected pair is re-checked at
+      full resolution with probability `audit_fraction`, to measure the
+      false-negative rate.
+    """
+    modes = ('exact', 'estimate')
+
+    def __init__(self, coarse_scaled, threshold, mode='exact', audit_fraction=0.01, seed=1, scaled=None):
+        if mode not in self.modes:
+            raise ValueError(f"unknown prefilter mode '{mode}'; choose one of {', '.join(self.modes)}")
+        self.coarse_scaled = coarse_scaled
+        self.max_hash = np.uint64(_get_max_hash_for_scaled(coarse_scaled))
+        self.threshold = threshold
+        # the full-resolution sketches' scaled, for their containment bias correction
+        self.scaled = scaled
+        self.mode = mode
+        self.audit_fraction = audit_fraction
+        self.seed = seed
+        # own generator, so auditing never changes the clustering's random state
+        self.rng = np.random.default_rng(seed)
+
+    def reseed(self, stream):
+        "draw audits from a separate stream, e.g. one per worker shard, so copies don't audit alike"
+        self.rng = np.random.default_rng([self.seed, stream])
+
+    def coarse_size(self, hashes):
+        "number of hashes kept at the coarse scaled"
+        return int(np.searchsorted(hashes, self.max_hash, side='right'))
+
+    def audit(self, a, b, stats):
+        "maybe re-check a rejected pair at full resolution"
+        if self.audit_fraction and self.rng.random() < self.audit_fraction:
+            stats.audited += 1
+            if passes_threshold(a, b, self.threshold, scaled=self.scaled):
+                stats.audit_false_negatives += 1
+
+    def may_pass(self, a, b, stats, coarse_a=None, coarse_b=None):
+        """
+        False if the pair is rejected at the coarse resolution. Pairs the
+        prefilter can't judge (empty coarse sketches in 'estimate' mode)
+        pass through to the full test.
+        """
+        if self.threshold <= 0:
+            return True
+        if coarse_a is None:
+            coarse_a = self.coarse_size(a)
+        if coarse_b is None:
+            coarse_b = self.coarse_size(b)
+        if self.mode == 'estimate' and not (coarse_a and coarse_b):
+            return True
+        small, large = (a[:coarse_a], b[:coarse_b]) if coarse_a <= coarse_b else (b[:coarse_b], a[:coarse_a])
+        coarse_common = 0
+        if len(small):
+            pos = np.searchsorted(large, small)
+            pos[pos == len(large)] = 0
+            coarse_common = int(np.count_nonzero(large[pos] == small))
+        stats.hashes_checked += len(small)
+
+        if self.mode == 'exact':
+            needed = min_common_hashes(self.threshold, len(a), len(b), self.scaled)
+            bound = coarse_common + min(len(a) - coarse_a, len(b) - coarse_b)
+            reject = needed is None or bound < needed
+        else:
+            denominator = containment_denominators([min(coarse_a, coarse_b)], self.coarse_scaled)[0]
+            reject = min(coarse_common / denominator, 1.0) < self.threshold
+        if reject:
+            stats.prefiltered += 1
+            if self.mode == 'estimate':
+                self.audit(a, b, stats)
+        return not reject
+
+
+class HashIndex:
+    """
+    Inverted index from hash value to the ids of the sketches containing it.
+    Ids are whatever the caller adds: store rows, founder numbers, ...
+    """
+    def __init__(self):
+        self.postings = defaultdict(list)
+
+    def add(self, item_id, hashes):
+        for hashval in hashes.tolist():
+            self.postings[hashval].append(item_id)
+
+    def candidates(self, hashes):
+        "set of item_ids sharing at least one hash with the query"
+        found = set()
+        for hashval in hashes.tolist():
+            posting = self.postings.get(hashval)
+            if posting:
+                found.update(posting)
+        return found
+
+    def count_common(self, hashes):
+        "Counter of item_id -> number of hashes shared with the query"
+        common = Counter()
+        for hashval in hashes.tolist():
+            posting = self.postings.get(hashval)
+            if posting:
+                common.update(posting)
+        return common
+
+
+SharedStoreHandle = namedtuple('SharedStoreHandle',
+                               'hashes_block, num_hashes, offsets_block, num_offsets, names, ksize, moltype, scaled')
+
+
+class SharedHashStore:
+    """
+    A HashStore's packed hashes and offsets, copied into shared memory.
+    `handle` is small and picklable: pass it to worker processes (e.g. as a
+    pool initarg) and attach there with `HashStore.attach`. The memory is
+    freed by `close`, or on leaving a `with` block.
+    """
+    def __init__(self, store):
+        hashes, offsets = store.hashes, store.offsets
+        # shared memory blocks can't be empty
+        self.blocks = [shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+                       for arr in (hashes, offsets)]
+        for block, arr in zip(self.blocks, (hashes, offsets)):
+            np.ndarray(arr.shape, dtype=arr.dtype, buffer=block.buf)[:] = arr
+        self.handle = SharedStoreHandle(self.blocks[0].name, len(hashes), self.blocks[1].name, len(offsets),
+                                        list(store.names), store.ksize, store.moltype, store.scaled)
+
+    def close(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class HashStore:
+    """
+    Hashes of many signatures of one ksize/moltype/scaled, stored CSR-style.
+
+    Signatures are appended with `add` / `add_signature` and get consecutive
+    integer row ids. Pending rows are packed into the main arrays the first
+    time the hashes are needed.
+    """
+    def __init__(self):
+        self.names = []
+        self.sources = []
+        self.md5s = []
+        self.ksize = None
+        self.moltype = None
+        self.scaled = None
+        self._hashes = np.zeros(0, dtype=np.uint64)
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._pending = []
+        # per-row sizes, computed once per packing
+        self._sizes = None
+        # bytes the full signatures given to add_signature held, and what of
+        # them the store keeps (hashes, name, md5sum)
+        self.full_bytes = 0
+        self.lean_bytes = 0
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def from_siglist(cls, siglist):
+        "build a store from a list of (filename, SourmashSignature) tuples"
+        store = cls()
+        for (sig_from, sig) in siglist:
+            store.add_signature(sig_from, sig)
+        return store
+
+    def _check_compatible(self, ksize, moltype, scaled):
+        if not scaled:
+            raise ValueError("HashStore only supports scaled signatures")
+        if self.ksize is None:
+            self.ksize, self.moltype, self.scaled = ksize, moltype, scaled
+        elif (ksize, moltype, scaled) != (self.ksize, self.moltype, self.scaled):
+            raise ValueError(f"incompatible signature: ksize={ksize}, moltype={moltype}, scaled={scaled}; "
+                             f"store holds ksize={self.ksize}, moltype={self.moltype}, scaled={self.scaled}")
+
+    def add(self, name, source, hashes, ksize, moltype, scaled, md5=None):
+        "add one signature's hashes (any iterable of hash values); returns its row id"
+        self._check_compatible(ksize, moltype, scaled)
+        hashes = np.sort(np.asarray(hashes, dtype=np.uint64))
+        self._pending.append(hashes)
+        self.names.append(name)
+        self.sources.append(source)
+        self.md5s.append(md5)
+        return len(self.names) - 1
+
+    def add_signature(self, source, sig):
+        """
+        Add the hashes of a SourmashSignature. Nothing else of the signature
+        is kept, so callers can drop it right away.
+        """
+        mh = sig.minhash
+        row = self.add(str(sig), source, sorted_hashes(mh), mh.ksize,
+                       mh.moltype, mh.scaled, md5=sig.md5sum())
+        self.full_bytes += signature_nbytes(sig)
+        self.lean_bytes += (8 * len(self._pending[-1]) + sys.getsizeof(self.names[row])
+                            + sys.getsizeof(self.md5s[row]))
+        return row
+
+    def share(self):
+        "copy the packed hashes into shared memory; returns a SharedHashStore"
+        return SharedHashStore(self)
+
+    @classmethod
+    def attach(cls, handle):
+        """
+        A read-only store over the shared memory of a SharedHashStore handle,
+        with names but no sources or md5sums. The owner frees the memory.
+        """
+        store = cls()
+        store.names = handle.names
+        store.sources = [None] * len(handle.names)
+        store.md5s = [None] * len(handle.names)
+        store.ksize, store.moltype, store.scaled = handle.ksize, handle.moltype, handle.scaled
+        store._shared_blocks = []
+        arrays = []
+        for name, size, dtype in ((handle.hashes_block, handle.num_hashes, np.uint64),
+                                  (handle.offsets_block, handle.num_offsets, np.int64)):
+            # pool workers share their parent's resource tracker, so attaching
+            # doesn't leave the block to be cleaned up twice
+            block = shared_memory.SharedMemory(name=name)
+            store._shared_blocks.append(block)
+            array = np.ndarray((size,), dtype=dtype, buffer=block.buf)
+            array.flags.writeable = False
+            arrays.append(array)
+        store._hashes, store._offsets = arrays
+        return store
+
+    def memory_report(self):
+        "one-line summary of the memory held, and saved, by lean loading"
+        hash_mb = (8 * (len(self._hashes) + sum(len(x) for x in self._pending))) / 1024**2
+        full_mb, lean_mb = self.full_bytes / 1024**2, self.lean_bytes / 1024**2
+        return (f'lean loading kept {hash_mb:.1f} MB of hashes for {len(self)} signatures; '
+                f'the full signatures held {full_mb:.1f} MB, of which {lean_mb:.1f} MB was kept: '
+                f'{full_mb - lean_mb:.1f} MB saved (peak RSS {peak_rss_mb():.1f} MB)')
+
+    def _pack(self):
+        if not self._pending:
+            return
+        sizes = np.fromiter((len(x) for x in self._pending), dtype=np.int64,
+                            count=len(self._pending))
+        new_offsets = self._offsets[-1] + np.cumsum(sizes)
+        self._hashes = np.concatenate([self._hashes] + self._pending)
+        self._offsets = np.concatenate([self._offsets, new_offsets])
+        self._pending = []
+        self._sizes = None
+
+    @property
+    def hashes(self):
+        self._pack()
+        return self._hashes
+
+    @property
+    def offsets(self):
+        self._pack()
+        return self._offsets
+
+    @property
+    def sizes(self):
+        "number of hashes in each row; cached, as it's needed per comparison"
+        offsets = self.offsets
+        if self._sizes is None:
+            self._sizes = np.diff(offsets)
+        return self._sizes
+
+    def get_hashes(self, row):
+        offsets = self.offsets
+        return self._hashes[offsets[row]:offsets[row+1]]
+
+    def key(self, row):
+        "identity of a stored signature: (source, name, md5sum)"
+        return (self.sources[row], self.names[row], self.md5s[row])
+
+    def gather(self, rows):
+        """
+        Return (hashes, offsets) for a block of rows, in the order given,
+        with offsets starting at 0.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        offsets = self.offsets
+        starts = offsets[rows]
+        lengths = offsets[rows + 1] - starts
+        block_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=block_offsets[1:])
+        # position of every block element in the packed array
+        positions = np.arange(block_offsets[-1], dtype=np.int64)
+        positions += np.repeat(starts - block_offsets[:-1], lengths)
+        return self._hashes[positions], block_offsets
+
+    def passes_threshold(self, query_row, target_rows, threshold, stats=None):
+        """
+        Threshold test of one stored signature against a block of stored
+        signatures; only the rows that survive the size and range bounds
+        are gathered.
+        """
+        if stats is None:
+            stats = ThresholdStats()
+        rows = np.asarray(target_rows, dtype=np.int64)
+        offsets, hashes = self.offsets, self._hashes
+        starts, ends = offsets[rows], offsets[rows + 1]
+        sizes = ends - starts
+        nonempty = sizes > 0
+        first = np.zeros(len(rows), dtype=np.uint64)
+        last = np.zeros(len(rows), dtype=np.uint64)
+        first[nonempty] = hashes[starts[nonempty]]
+        last[nonempty] = hashes[ends[nonempty] - 1]
+        return _threshold_block(self.get_hashes(query_row), sizes, first, last,
+                                threshold, stats, lambda keep: self.gather(rows[keep]), self.scaled)
+
+    def compare(self, query_row, target_rows):
+        "compare one stored signature against a block of stored signatures"
+        targets, target_offsets = self.gather(target_rows)
+        return compare_one_to_many(self.get_hashes(query_row), targets, target_offsets, self.scaled)
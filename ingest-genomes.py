@@ -0,0 +1,189 @@
+#! /usr/bin/env python
+"""
+Read a multi-genome fasta once and produce everything the pipeline needs
+from it: per-genome fasta files (or a genome store), the accession/filename
+csv, genome names and lengths, per-record lengths, the record length
+distribution and summary quantiles, and per-genome DNA sketches.
+
+This replaces separate passes of split-fasta-by-genome-dict.py,
+get-length-dict.py --fastafile, get-length-distribution.py and
+`sourmash sketch dna` over the same (usually gzipped) input; the outputs
+match theirs. Contigs belong to the genome named before the first '|' in
+their name.
+
+This code is under CC0.
+"""
+import os
+import sys
+import argparse
+from collections import OrderedDict
+
+import screed
+import sourmash
+from sourmash import MinHash, SourmashSignature
+
+from fastautils import OutputPool, length_histogram, make_outdir, summarize_lengths
+from genomestore import GenomeStoreWriter
+
+
+class GenomeSketcher:
+    """
+    One DNA FracMinHash per ksize for each genome, built up contig by contig
+    (like `sourmash sketch dna --name {genome}` on the genome's split fasta).
+    """
+    def __init__(self, ksizes, scaled, track_abundance=False):
+        self.templates = [MinHash(n=0, ksize=ksize, scaled=scaled, track_abundance=track_abundance)
+                          for ksize in ksizes]
+        self.minhashes = OrderedDict()
+
+    def add(self, accession, sequence):
+        minhashes = self.minhashes.get(accession)
+        if minhashes is None:
+            minhashes = [mh.copy_and_clear() for mh in self.templates]
+            self.minhashes[accession] = minhashes
+        for mh in minhashes:
+            # skip k-mers with non-ACGT characters, as sourmash sketch does
+            mh.add_sequence(sequence, force=True)
+
+    def signatures(self, filename=""):
+        for accession, minhashes in self.minhashes.items():
+            for mh in minhashes:
+                yield SourmashSignature(mh, name=accession, filename=filename)
+
+
+def main(args):
+    if args.genome_store and args.output_dir:
+        print("** Error: please provide only one of --output-dir and --genome-store")
+        sys.exit(-1)
+    splitting = bool(args.genome_store or args.output_dir)
+    if splitting and not args.output_csv:
+        print("** Error: --output-csv is required when writing genomes")
+        sys.exit(-1)
+    prefix = f"{args.prefix}-" if args.prefix else ""
+
+    sketcher = None
+    if args.sig_output:
+        ksizes = args.ksize or [21, 31, 51]
+        sketcher = GenomeSketcher(ksizes, args.scaled, track_abundance=args.abund)
+        print(f"Sketching genomes at k={','.join(map(str, ksizes))}, scaled={args.scaled}")
+
+    store, pool = None, None
+    if args.genome_store:
+        make_outdir(os.path.dirname(args.genome_store) or ".")
+        store = GenomeStoreWriter(args.genome_store)
+    elif args.output_dir:
+        make_outdir(args.output_dir)
+        pool = OutputPool(args.max_open_files)
+    record_lengths_fp = open(args.record_lengths, "w") if args.record_lengths else None
+
+    # the single pass: every output is fed from the same parsed record
+    print(f"Ingesting {args.fasta}...")
+    genome_files, genome_lengths = OrderedDict(), {}
+    all_record_lengths = []
+    num_contigs, complete = 0, False
+    try:
+        for record in screed.open(args.fasta):
+            if num_contigs > 0 and num_contigs % 100000 == 0:
+                print(f"working on {str(num_contigs)}th contig\n")
+            num_contigs += 1
+            name = record.name.split("|")[0]
+            sequence = record.sequence
+            record_len = len(sequence)
+            if name not in genome_lengths:
+                if store is not None:
+                    genome_files[name] = args.genome_store
+                elif pool is not None:
+                    genome_files[name] = os.path.join(args.output_dir, f"{prefix}{name}.fa")
+                genome_lengths[name] = 0
+            genome_lengths[name] += record_len
+            all_record_lengths.append(record_len)
+
+            if store is not None:
+                store.add(name, record.name, sequence)
+            elif pool is not None:
+                pool.get(genome_files[name]).write(f">{record.name}\n{sequence}\n")
+            if record_lengths_fp is not None:
+                record_lengths_fp.write(f"{record.name},{record_len}\n")
+            if sketcher is not None:
+                sketcher.add(name, sequence)
+        complete = True
+    finally:
+        if store is not None:
+            # only a store that got every contig gets an index
+            if complete:
+                store.close()
+            else:
+                store.abort()
+        if pool is not None:
+            pool.close()
+        if record_lengths_fp is not None:
+            record_lengths_fp.close()
+    print(f"...read {num_contigs} contigs for {len(genome_lengths)} genomes")
+
+    if args.output_csv:
+        with open(args.output_csv, "w") as outcsv:
+            outcsv.write("accession,filename\n")
+            for name, outfile in genome_files.items():
+                outcsv.write(f"{name},{outfile}\n")
+    if args.output_names:
+        with open(args.output_names, "w") as names:
+            for name in genome_lengths:
+                names.write(f"{name}\n")
+    if args.output_lengths:
+        with open(args.output_lengths, "w") as lengths:
+            for name, genome_len in genome_lengths.items():
+                lengths.write(f"{name},{genome_len}\n")
+
+    if args.length_distribution or args.quantiles_csv:
+        lengths, counts = length_histogram(all_record_lengths)
+        if args.length_distribution:
+            with open(args.length_distribution, "w") as out:
+                out.write("length,count\n")
+                for length, count in zip(lengths.tolist(), counts.tolist()):
+                    out.write(f"{length},{count}\n")
+        if args.quantiles_csv:
+            summary = summarize_lengths(lengths, counts)
+            summary.to_frame().to_csv(args.quantiles_csv, index_label="statistic")
+            print(summary.to_string())
+
+    if sketcher is not None:
+        num_sigs = 0
+        with sourmash.sourmash_args.SaveSignaturesToLocation(args.sig_output) as save_sigs:
+            for sig in sketcher.signatures(filename=args.fasta):
+                save_sigs.add(sig)
+                num_sigs += 1
+        print(f"saved {num_sigs} signatures for {len(sketcher.minhashes)} genomes to {args.sig_output}")
+
+    if store is not None:
+        print(f"genomes written to {args.genome_store} (index: {store.index_path})")
+    elif pool is not None:
+        print(f"genomes written to {len(genome_files)} fasta files in {args.output_dir} "
+              f"({pool.reopened} files reopened after being closed to stay under {pool.max_open} open files)")
+
+
+def cmdline(sys_args):
+    "Command line entry point w/argparse action."
+    p = argparse.ArgumentParser()
+    p.add_argument("fasta")
+    p.add_argument("--output-dir", help="write one fasta file per genome here")
+    p.add_argument("--genome-store",
+                   help="alternatively, write all genomes to this one fasta, plus a byte-offset index (.gidx)")
+    p.add_argument("--output-csv", help="accession,filename csv for the written genomes")
+    p.add_argument("--output-names", help="genome names, one per line")
+    p.add_argument("--output-lengths", help="genome lengths csv ('name,length'; no header)")
+    p.add_argument("--prefix")
+    p.add_argument("--max-open-files", type=int, default=256,
+                   help="maximum number of genome output files to keep open at once")
+    p.add_argument("--record-lengths", help="per-record lengths csv, as get-length-dict.py --fastafile writes")
+    p.add_argument("--length-distribution", help="record length counts csv, as get-length-distribution.py writes")
+    p.add_argument("--quantiles-csv", help="count, mean, min, quantiles and max of the record lengths")
+    p.add_argument("--sig-output", help="save per-genome DNA sketches here (.sig, .sig.gz, .zip or directory)")
+    p.add_argument("-k", "--ksize", action="append", type=int, help="DNA ksize to sketch (repeatable; default 21, 31, 51)")
+    p.add_argument("--scaled", type=int, default=1000, help="scaled value for DNA sketches")
+    p.add_argument("--abund", action="store_true", help="track k-mer abundances in DNA sketches")
+    args = p.parse_args()
+    return main(args)
+
+if __name__ == '__main__':
+    returncode = cmdline(sys.argv[1:])
+    sys.exit(returncode)
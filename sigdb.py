@@ -0,0 +1,407 @@
+"""
+Packed signature databases.
+
+A signature database is a sourmash zip collection (as written by
+sketch-proteomes.py or `sourmash sig cat ... -o db.zip`). Its manifest
+lists every sketch's name, ksize, moltype, scaled and location inside the
+zip, so only the manifest is read up front. Selecting a ksize/moltype then
+reads just the matching sketches, in zip order, and a single sketch can be
+read by accession without touching the rest -- instead of opening and
+parsing one JSON .sig file per genome.
+
+`SignatureCache` keeps loaded signatures in a bounded LRU cache, so a
+sketch needed again (say, by several clusters) is only parsed once. Its
+prefetch can also hand each signature straight to a callback as it loads
+(e.g. to pack its hashes), without caching the full signatures at all.
+
+`load_selected_signatures` streams through one big JSON .sig file and
+parses only the signatures with wanted names, so memory and time scale
+with what's selected rather than with the size of the file.
+
+`load_signatures` and `signature_sources` let the scripts take a database
+anywhere they take a signature file or a siglist. A single sketch in a
+database is addressed as `{database}#{md5sum}` (see `sketch_location`), so
+output siglists of founders or members still point at individual sketches.
+
+This code is under CC0.
+"""
+import os
+import re
+import json
+import time
+import threading
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import sourmash
+from sourmash.signature import load_signatures_from_json
+
+from fastautils import BLOCK_SIZE, open_binary
+
+SIGDB_EXTENSIONS = ('.zip',)
+# the bytes that matter for finding object boundaries in JSON
+_JSON_STRUCTURE = re.compile(rb'[{}"\\]')
+_NAME_KEY = re.compile(rb'"name"\s*:\s*')
+
+
+def split_location(location):
+    "(database path, md5sum or '') for a database or single-sketch location"
+    path, _, md5 = str(location).partition('#')
+    return path, md5
+
+
+def is_sigdb(filename):
+    return split_location(filename)[0].endswith(SIGDB_EXTENSIONS)
+
+
+def sketch_location(source, sig):
+    "where to find sig again: its own location in a database, or the sig file it came from"
+    if is_sigdb(source) and not split_location(source)[1]:
+        return f"{source}#{sig.md5sum()}"
+    return source
+
+
+def accession(name):
+    "sig names start with the accession; the rest is description"
+    return name.split(" ")[0]
+
+
+class SigDB:
+    """
+    A manifest-indexed signature zip. Rows are manifest rows (dicts with
+    name, ksize, moltype, scaled, internal_location, ...), in zip order.
+    Threads share the one zip handle; reads from it take a lock, parsing
+    the sketches read doesn't.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._read_lock = threading.Lock()
+        self.index = sourmash.load_file_as_index(path)
+        if self.index.manifest is None:
+            raise ValueError(f"{path} has no manifest; rebuild it with `sourmash sig cat ... -o {path}`")
+        self.rows = list(self.index.manifest.rows)
+        # (accession, ksize, moltype) -> rows; accession -> rows; md5sum -> row
+        self.by_key = defaultdict(list)
+        self.by_accession = defaultdict(list)
+        self.by_md5 = {}
+        for row in self.rows:
+            acc = accession(row['name'])
+            self.by_key[(acc, row['ksize'], row['moltype'].lower())].append(row)
+            self.by_accession[acc].append(row)
+            self.by_md5[row['md5']] = row
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, acc):
+        return acc in self.by_accession
+
+    def accessions(self):
+        return list(self.by_accession)
+
+    def select_rows(self, ksize=None, moltype=None, scaled=None, md5=None):
+        """
+        Manifest rows for a ksize/moltype (any case), in zip order. With
+        scaled, only scaled sketches that can be downsampled to it (they
+        aren't downsampled here); with md5, only that sketch.
+        """
+        rows = []
+        if md5:
+            candidates = [self.by_md5[md5]] if md5 in self.by_md5 else []
+        else:
+            candidates = self.rows
+        for row in candidates:
+            if ksize is not None and row['ksize'] != ksize:
+                continue
+            if moltype is not None and row['moltype'].lower() != moltype.lower():
+                continue
+            if scaled is not None and not (row['scaled'] and row['scaled'] <= scaled):
+                continue
+            rows.append(row)
+        return rows
+
+    def load_row(self, row):
+        "read one sketch straight from its location in the zip"
+        with self._read_lock:
+            data = self.index.storage.load(row['internal_location'])
+        for sig in load_signatures_from_json(data):
+            if sig.md5sum() == row['md5']:
+                return sig
+        raise ValueError(f"{row['internal_location']} in {self.path} doesn't hold sketch {row['md5']}")
+
+    def signatures(self, ksize=None, moltype=None, scaled=None, md5=None, start=None, stop=None):
+        "yield the sketches for a ksize/moltype; start/stop slice the selected rows"
+        for row in self.select_rows(ksize, moltype, scaled, md5)[start:stop]:
+            yield self.load_row(row)
+
+    def _row(self, acc, ksize, moltype):
+        rows = self.by_key.get((acc, ksize, moltype.lower()))
+        if not rows:
+            raise KeyError(f"no {moltype} k={ksize} sketch for {acc} in {self.path}")
+        return rows[0]
+
+    def get(self, acc, ksize, moltype):
+        "the sketch for one accession at ksize/moltype"
+        return self.load_row(self._row(acc, ksize, moltype))
+
+    def location(self, acc, ksize, moltype):
+        "the single-sketch location ({database}#{md5sum}) of an accession's sketch"
+        return f"{self.path}#{self._row(acc, ksize, moltype)['md5']}"
+
+
+def iter_json_objects(fp, block_size=BLOCK_SIZE):
+    """
+    Yield the raw bytes of each top-level object in a JSON array (or of a
+    lone object), reading a binary file handle in blocks. Only braces,
+    quotes and escapes are looked at, so long arrays of hashes are skipped
+    over at regex speed and nothing is parsed.
+    """
+    buf, pos, start = b'', 0, None
+    depth, in_string = 0, False
+    while True:
+        block = fp.read(block_size)
+        if not block:
+            break
+        buf += block
+        while True:
+            match = _JSON_STRUCTURE.search(buf, pos)
+            if match is None:
+                pos = len(buf)
+                break
+            i = match.start()
+            char = buf[i:i+1]
+            if in_string:
+                if char == b'\\':
+                    if i + 1 >= len(buf):
+                        # the escaped byte is in the next block
+                        pos = i
+                        break
+                    pos = i + 2
+                    continue
+                if char == b'"':
+                    in_string = False
+            elif char == b'"':
+                in_string = True
+            elif char == b'{':
+                if depth == 0:
+                    start = i
+                depth += 1
+            elif char == b'}':
+                depth -= 1
+                if depth == 0:
+                    yield buf[start:i+1]
+                    start = None
+            pos = i + 1
+        # keep only the object in progress (if any)
+        keep = pos if start is None else start
+        buf, pos = buf[keep:], pos - keep
+        if start is not None:
+            start = 0
+
+
+def _signature_json_name(obj):
+    """
+    The top-level name of one signature's JSON, decoding just that string;
+    None if there's no name before the sketches (the sig goes by filename
+    or md5sum then).
+    """
+    header_end = obj.find(b'"signatures"')
+    if header_end == -1:
+        header_end = len(obj)
+    match = _NAME_KEY.search(obj, 0, header_end)
+    if match is None:
+        return None
+    name, _ = json.JSONDecoder().raw_decode(obj[match.end():header_end].decode('utf-8'))
+    return name
+
+
+def is_json_sigfile(filename):
+    "is filename a (possibly compressed) JSON signature file, rather than a database, directory or other collection?"
+    if is_sigdb(filename) or not os.path.isfile(filename):
+        return False
+    with open_binary(filename) as fp:
+        return fp.read(64).lstrip()[:1] in (b'[', b'{')
+
+
+def matching_param(sig, params):
+    "the (ksize, moltype) in params that sig is a sketch of (moltype in any case), or None"
+    mh = sig.minhash
+    for ksize, moltype in params:
+        if mh.ksize == ksize and mh.moltype.lower() == moltype.lower():
+            return ksize, moltype
+    return None
+
+
+def load_selected_signatures(filename, names, params=None):
+    """
+    Yield the signatures in a JSON .sig file whose str() is in names, and
+    that match one of params, (ksize, moltype) pairs (default: any). The
+    file is streamed; only signatures with matching names are parsed.
+    """
+    with open_binary(filename) as fp:
+        for obj in iter_json_objects(fp):
+            name = _signature_json_name(obj)
+            if name and name not in names:
+                continue
+            # sourmash only takes a buffer as signature JSON if it's an array. Select
+            # ksize/moltype here: the loader's own ksize is the raw (x3) protein ksize
+            for sig in load_signatures_from_json(b'[' + obj + b']'):
+                if params is not None and matching_param(sig, params) is None:
+                    continue
+                if str(sig) in names:
+                    yield sig
+
+
+class SignatureCache:
+    """
+    Bounded LRU cache of loaded signatures, keyed by (location, ksize,
+    moltype). A location is a sig file, database or single database sketch;
+    the first signature there at ksize/moltype is the one cached.
+
+    `prefetch` loads a known set of keys up front, optionally across a
+    thread pool, instead of one at a time as they're asked for. Keys that
+    share a location are loaded from a single read of it. With on_load,
+    each (key, sig) also goes to the callback as soon as it's loaded, so a
+    caller can use the sigs without waiting for (or keeping) all of them.
+    """
+    def __init__(self, max_size=100000):
+        self.max_size = max(1, max_size)
+        self.sigs = OrderedDict()
+        self.hits, self.misses, self.prefetched, self.evictions = 0, 0, 0, 0
+        self.load_seconds = 0.0
+
+    def __len__(self):
+        return len(self.sigs)
+
+    def __contains__(self, key):
+        return key in self.sigs
+
+    def _load(self, key):
+        location, ksize, moltype = key
+        for sig in load_signatures(location, ksize=ksize, moltype=moltype):
+            return sig
+        raise ValueError(f"no {moltype} k={ksize} signature found in {location}")
+
+    def _load_location(self, keys):
+        "load keys that all share one location, reading it once; returns their sigs"
+        if len(keys) == 1:
+            return [self._load(keys[0])]
+        location = keys[0][0]
+        params = [(ksize, moltype) for _, ksize, moltype in keys]
+        found = {}
+        for sig in load_signatures(location):
+            param = matching_param(sig, params)
+            if param is not None and param not in found:
+                found[param] = sig
+        for _, ksize, moltype in keys:
+            if (ksize, moltype) not in found:
+                raise ValueError(f"no {moltype} k={ksize} signature found in {location}")
+        return [found[(ksize, moltype)] for _, ksize, moltype in keys]
+
+    def _insert(self, key, sig):
+        self.sigs[key] = sig
+        self.sigs.move_to_end(key)
+        while len(self.sigs) > self.max_size:
+            self.sigs.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, location, ksize, moltype):
+        key = (location, ksize, moltype)
+        sig = self.sigs.get(key)
+        if sig is not None:
+            self.hits += 1
+            self.sigs.move_to_end(key)
+            return sig
+        self.misses += 1
+        start = time.perf_counter()
+        sig = self._load(key)
+        self.load_seconds += time.perf_counter() - start
+        self._insert(key, sig)
+        return sig
+
+    def prefetch(self, keys, threads=1, on_load=None):
+        """
+        Load the keys that aren't cached yet -- the first max_size of them, so
+        the prefetch doesn't evict itself. Returns how many were loaded.
+
+        With on_load, every key is looked up as get() would: cached keys
+        are hits, the rest are misses, loaded into the (bounded) cache. Then
+        on_load(key, sig) is called for each as soon as its location is read.
+        """
+        keys = list(dict.fromkeys(keys))
+        missing = [key for key in keys if key not in self.sigs]
+        if on_load is None:
+            missing = missing[:self.max_size]
+        else:
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+        by_location = OrderedDict()
+        for key in missing:
+            by_location.setdefault(key[0], []).append(key)
+        groups = list(by_location.values())
+
+        def handle(group, sigs):
+            for key, sig in zip(group, sigs):
+                self._insert(key, sig)
+                if on_load is not None:
+                    on_load(key, sig)
+
+        start = time.perf_counter()
+        if on_load is not None:
+            for key in keys:
+                if key in self.sigs:
+                    self.sigs.move_to_end(key)
+                    on_load(key, self.sigs[key])
+        if threads > 1 and groups:
+            # sourmash's C bindings are looked up on first use, which isn't thread
+            # safe: load one location here first, so the threads find them ready
+            handle(groups[0], self._load_location(groups[0]))
+            groups = groups[1:]
+            with ThreadPoolExecutor(threads) as executor:
+                # handled in order as they come in, rather than all at the end
+                for group, sigs in zip(groups, executor.map(self._load_location, groups)):
+                    handle(group, sigs)
+        else:
+            for group in groups:
+                handle(group, self._load_location(group))
+        self.load_seconds += time.perf_counter() - start
+        self.prefetched += len(missing)
+        return len(missing)
+
+    def report(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        return (f"signature cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1%} hit rate), "
+                f"{self.prefetched} prefetched, {self.evictions} evictions; "
+                f"{self.load_seconds:.1f}s loading signatures")
+
+
+# databases opened by this process; reading a large manifest isn't free. Keyed
+# by pid too, so forked workers don't share (and seek) their parent's zip handle.
+# The lock keeps threads from opening the same database twice at once
+_open_sigdbs = {}
+_open_sigdbs_lock = threading.Lock()
+
+def open_sigdb(path):
+    key = (os.getpid(), path)
+    with _open_sigdbs_lock:
+        db = _open_sigdbs.get(key)
+        if db is None:
+            db = SigDB(path)
+            _open_sigdbs[key] = db
+    return db
+
+
+def load_signatures(filename, ksize=None, moltype=None):
+    "signatures from a database (or one sketch in it) or any file sourmash can load, selected by ksize/moltype"
+    if is_sigdb(filename):
+        path, md5 = split_location(filename)
+        return open_sigdb(path).signatures(ksize=ksize, moltype=moltype, md5=md5)
+    return sourmash.sourmash_args.load_file_as_signatures(filename, select_moltype=moltype, ksize=ksize)
+
+
+def signature_sources(siglist):
+    "the signature files a siglist names -- or, for a database, the database itself"
+    if is_sigdb(siglist):
+        return [siglist]
+    return sourmash.sourmash_args.load_file_list_of_signatures(siglist)
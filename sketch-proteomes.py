@@ -0,0 +1,202 @@
+#! /usr/bin/env python
+"""
+Sketch a shard of proteomes into one signature collection.
+
+Running `sourmash sketch protein` once per genome pays for a python and
+sourmash startup per genome, and leaves one small .sig file per genome
+for everything downstream to open. This loads sourmash once, sketches
+each proteome at every alphabet and ksize in a single read of its fasta,
+spreads the proteomes over a process pool, and saves the whole shard to
+one zip collection (which carries a sourmash manifest).
+
+Param strings are the same as `sourmash sketch protein -p ...` (parsed
+here, with the same defaults), and each genome's signatures are the same
+as `sourmash sketch protein -p ... --name {genome} {proteins fasta}` gives.
+Sketches are built with sourmash's public MinHash/SourmashSignature API.
+
+This code is under CC0.
+"""
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+from collections import namedtuple
+
+import screed
+import sourmash
+import pandas as pd
+from sourmash import MinHash, SourmashSignature
+
+SketchParams = namedtuple('SketchParams', 'moltype, ksize, scaled, num, seed, track_abundance')
+
+# `sourmash sketch protein` defaults, for whatever a param string leaves out
+DEFAULT_KSIZES = {"protein": 10, "dayhoff": 16, "hp": 42}
+DEFAULT_SCALED = 200
+DEFAULT_SEED = 42
+
+DEFAULT_PARAMS = ["protein,k=7,k=8,k=9,k=10,k=11,k=12,scaled=100,abund",
+                  "dayhoff,k=15,k=16,k=17,k=18,k=19,scaled=100,abund",
+                  "hp,k=33,k=35,k=37,k=39,k=42,scaled=100,abund"]
+
+
+def shard_genomes(genomes, shard, num_shards):
+    "round-robin assignment of (genome, filename) pairs to shards, in list order"
+    return [genome for n, genome in enumerate(genomes) if n % num_shards == shard]
+
+
+def read_proteomes(args):
+    "(genome, proteins fasta) pairs, from a csv with genome,proteins columns or a fastalist"
+    if args.proteins_csv:
+        protDF = pd.read_csv(args.proteins_csv, dtype={"genome": str})
+        return list(zip(protDF["genome"], protDF["proteins"]))
+    prefix = f"{args.prefix}-" if args.prefix else ""
+    proteomes = []
+    with open(args.fastalist, 'rt') as fp:
+        for line in fp:
+            filename = line.strip()
+            if not filename:
+                continue
+            genome = os.path.basename(filename).rsplit(".proteins.fasta")[0]
+            if prefix and genome.startswith(prefix):
+                genome = genome[len(prefix):]
+            proteomes.append((genome, filename))
+    return proteomes
+
+
+def parse_param_string(param_str):
+    """
+    A SketchParams per ksize of a `sourmash sketch protein -p` param string,
+    e.g. 'dayhoff,k=16,k=17,scaled=100,abund', in order.
+    """
+    moltype, ksizes, scaled, num, seed, track_abundance = "protein", [], None, None, DEFAULT_SEED, False
+    for item in param_str.split(","):
+        key, _, value = item.partition("=")
+        if item in DEFAULT_KSIZES:
+            moltype = item
+        elif item in ("abund", "noabund"):
+            track_abundance = item == "abund"
+        elif key in ("k", "scaled", "num", "seed") and value.isdigit():
+            if key == "k":
+                ksizes.append(int(value))
+            elif key == "seed":
+                seed = int(value)
+            elif (key == "scaled" and num) or (key == "num" and scaled):
+                raise ValueError(f"cannot set both num and scaled in '{param_str}'")
+            elif key == "scaled":
+                scaled = int(value)
+            else:
+                num = int(value)
+        else:
+            raise ValueError(f"unknown component '{item}' in param string '{param_str}'")
+    if scaled is None and num is None:
+        scaled = DEFAULT_SCALED
+    return [SketchParams(moltype, ksize, scaled or 0, num or 0, seed, track_abundance)
+            for ksize in ksizes or [DEFAULT_KSIZES[moltype]]]
+
+
+def make_minhash(params):
+    "an empty MinHash for one SketchParams; protein ksizes are in amino acids"
+    return MinHash(params.num, params.ksize, is_protein=params.moltype == "protein",
+                   dayhoff=params.moltype == "dayhoff", hp=params.moltype == "hp",
+                   track_abundance=params.track_abundance, seed=params.seed, scaled=params.scaled)
+
+
+# per-process sketch parameters; set once by the pool initializer
+_sketch_params = None
+
+def _init_sketch_worker(param_strs):
+    global _sketch_params
+    _sketch_params = [params for param_str in param_strs for params in parse_param_string(param_str)]
+
+
+def sketch_proteome(genome, filename):
+    """
+    Sketch one proteome at every param string; returns (genome, number of
+    sequences, seconds, signatures).
+    """
+    start = time.perf_counter()
+    minhashes = [make_minhash(params) for params in _sketch_params]
+    num_seqs = 0
+    with screed.open(filename) as records:
+        for record in records:
+            num_seqs += 1
+            for mh in minhashes:
+                mh.add_protein(record.sequence)
+    if not num_seqs:
+        # sourmash sketch doesn't write anything for empty input either
+        return genome, 0, time.perf_counter() - start, None
+    sigs = [SourmashSignature(mh, name=genome, filename=filename) for mh in minhashes]
+    return genome, num_seqs, time.perf_counter() - start, sigs
+
+
+def _sketch_proteome_worker(job):
+    return sketch_proteome(*job)
+
+
+def sketch_proteomes(proteomes, param_strs, processes=1, chunksize=1):
+    "yield the sketches for each proteome in order, across a pool with processes > 1"
+    if processes > 1:
+        with multiprocessing.Pool(processes, initializer=_init_sketch_worker, initargs=(param_strs,)) as pool:
+            yield from pool.imap(_sketch_proteome_worker, proteomes, chunksize=chunksize)
+    else:
+        _init_sketch_worker(param_strs)
+        for job in proteomes:
+            yield sketch_proteome(*job)
+
+
+def main(args):
+    if not (args.proteins_csv or args.fastalist):
+        print("** Error: please provide proteomes via --proteins-csv or --fastalist")
+        sys.exit(-1)
+    param_strs = args.param_string or DEFAULT_PARAMS
+    # bad param strings fail here, not in every worker
+    for param_str in param_strs:
+        parse_param_string(param_str)
+    proteomes = shard_genomes(read_proteomes(args), args.shard, args.num_shards)
+    print(f"Sketching {len(proteomes)} proteomes (shard {args.shard} of {args.num_shards}) "
+          f"with {args.processes} processes, at: {' '.join(param_strs)}")
+
+    results = sketch_proteomes(proteomes, param_strs, args.processes, args.chunksize)
+
+    start = time.perf_counter()
+    num_genomes, num_sigs, sketch_seconds, empty = 0, 0, 0.0, []
+    with sourmash.sourmash_args.SaveSignaturesToLocation(args.output) as save_sigs:
+        for genome, num_seqs, seconds, sigs in results:
+            num_genomes += 1
+            sketch_seconds += seconds
+            if sigs is None:
+                empty.append(genome)
+                continue
+            for sig in sigs:
+                save_sigs.add(sig)
+                num_sigs += 1
+            if num_genomes % 10000 == 0:
+                print(f"...sketched {num_genomes}/{len(proteomes)} proteomes")
+    elapsed = time.perf_counter() - start
+
+    if empty:
+        print(f"no sequences found for {len(empty)} proteomes; no sigs for: {', '.join(empty[:10])}")
+    rate = num_genomes / elapsed if elapsed else 0.0
+    print(f"saved {num_sigs} signatures for {num_genomes - len(empty)} proteomes to {args.output} "
+          f"in {elapsed:.1f}s ({rate:.1f} proteomes/s; {sketch_seconds:.1f}s of sketching)")
+
+
+def cmdline(sys_args):
+    "Command line entry point w/argparse action."
+    p = argparse.ArgumentParser()
+    p.add_argument("--proteins-csv", help="csv with genome and proteins (fasta filename) columns, e.g. translate-genomes.py --timing-csv")
+    p.add_argument("--fastalist", help="alternatively, proteins fasta filenames, one per line; genome names come from '{prefix}-{genome}.proteins.fasta'")
+    p.add_argument("--prefix", help="prefix to strip from fastalist filenames")
+    p.add_argument("-p", "--param-string", action="append", help="sourmash sketch protein param string (repeatable)")
+    p.add_argument("-o", "--output", required=True, help="signature collection to save to; use a .zip to get a manifest")
+    p.add_argument("--shard", type=int, default=0, help="which shard of the proteomes to sketch")
+    p.add_argument("--num-shards", type=int, default=1, help="number of shards the proteomes are split into")
+    p.add_argument("--processes", type=int, default=1, help="number of processes to sketch with")
+    p.add_argument("--chunksize", type=int, default=8, help="proteomes handed to a worker process at a time")
+    args = p.parse_args()
+    return main(args)
+
+if __name__ == '__main__':
+    returncode = cmdline(sys.argv[1:])
+    sys.exit(returncode)
@@ -2,31 +2,62 @@
 import os
 import sys
 import argparse
-from collections import defaultdict
+from collections import OrderedDict
 import screed
 
-def make_outdir(output_dirname):
-    if not os.path.exists(output_dirname):
-        try:
-            os.makedirs(output_dirname)
-        except OSError as e:
-            if e.errno != errno.EEXIST:
-                raise
+from fastautils import OutputPool, make_outdir
+from genomestore import GenomeStoreWriter
+
 
 def main(args):
-    print(f"Splitting {args.fasta} by genome. Writing files to {args.output_dir} \n")
-    groupD = defaultdict(list)
+    if args.genome_store:
+        print(f"Splitting {args.fasta} by genome. Writing genomes to store {args.genome_store} \n")
+    else:
+        print(f"Splitting {args.fasta} by genome. Writing files to {args.output_dir} \n")
     if not args.prefix:
         prefix = ""
     else:
         prefix = args.prefix + "-"
-    make_outdir(args.output_dir)
-    # loop through; split fasta into groups
-    for n, record in enumerate(screed.open(args.fasta)):
-        if n > 0 and n % 100000 == 0:
-            print(f"working on {str(n)}th contig\n")
-        name = record.name.split("|")[0]
-        groupD[name].append(record)
+    # stream through; write each contig to its genome's file as it arrives.
+    # Only per-genome filenames and lengths are kept, in first-seen order.
+    # With --genome-store, all genomes go to one indexed fasta instead.
+    genome_files, genome_lengths = OrderedDict(), {}
+    if args.genome_store:
+        make_outdir(os.path.dirname(args.genome_store) or ".")
+        store = GenomeStoreWriter(args.genome_store)
+    else:
+        make_outdir(args.output_dir)
+        pool = OutputPool(args.max_open_files)
+    num_contigs, complete = 0, False
+    try:
+        for record in screed.open(args.fasta):
+            if num_contigs > 0 and num_contigs % 100000 == 0:
+                print(f"working on {str(num_contigs)}th contig\n")
+            num_contigs += 1
+            name = record.name.split("|")[0]
+            outfile = genome_files.get(name)
+            if outfile is None:
+                if args.genome_store:
+                    outfile = args.genome_store
+                else:
+                    outfile = os.path.join(args.output_dir, f"{prefix}{name}.fa")
+                genome_files[name] = outfile
+                genome_lengths[name] = 0
+            genome_lengths[name] += len(record.sequence)
+            if args.genome_store:
+                store.add(name, record.name, record.sequence)
+            else:
+                pool.get(outfile).write(f">{record.name}\n{record.sequence}\n")
+        complete = True
+    finally:
+        if args.genome_store:
+            # only a store that got every contig gets an index
+            if complete:
+                store.close()
+            else:
+                store.abort()
+        else:
+            pool.close()
 
     if args.output_names:
         names = open(args.output_names, "w")
@@ -35,21 +66,20 @@ def main(args):
     with open(args.output_csv, "w") as outcsv:
         outcsv.write("accession,filename\n")
         filenum=0
-        for name, records in groupD.items():
+        for name, outfile in genome_files.items():
             filenum+=1
-            outfile = os.path.join(args.output_dir, f"{prefix}{name}.fa")
             outcsv.write(f"{name},{outfile}\n")
             if args.output_names:
                 names.write(f"{name}\n")
-            with open(outfile, "w") as out:
-                name_length=0
-                for record in records:
-                    name_length+=len(record.sequence)
-                    out.write(f">{record.name}\n{record.sequence}\n")
-                if args.output_lengths:
-                    lengths.write(f"{name},{name_length}\n")
+            if args.output_lengths:
+                lengths.write(f"{name},{genome_lengths[name]}\n")
 
-    print(f"{str(n)} contigs written to {str(filenum)} group fasta files\n")
+    if args.genome_store:
+        print(f"{str(num_contigs)} contigs for {str(filenum)} genomes written to {args.genome_store} "
+              f"(index: {store.index_path})\n")
+    else:
+        print(f"{str(num_contigs)} contigs written to {str(filenum)} group fasta files "
+              f"({pool.reopened} files reopened after being closed to stay under {pool.max_open} open files)\n")
 
     if args.output_names:
         names.close()
@@ -66,6 +96,10 @@ def cmdline(sys_args):
     p.add_argument("--output-names")
     p.add_argument("--output-lengths")
     p.add_argument("--prefix")
+    p.add_argument("--max-open-files", type=int, default=256,
+                   help="maximum number of genome output files to keep open at once")
+    p.add_argument("--genome-store",
+                   help="write all genomes to this one fasta, plus a byte-offset index (.gidx), instead of one file per genome")
     args = p.parse_args()
     return main(args)
 
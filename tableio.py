@@ -0,0 +1,233 @@
+"""
+Chunked writing and selective reading of result tables.
+
+The result scripts (count-hashes.py, cluster-compare*.py, aggregate-cluster-*.py)
+write their tables through `TableWriter` as results come in, as rows or as
+small dataframes. It buffers them and writes every chunk_rows rows, so a
+table never has to be held whole. Tables are written as csv (compressed as
+pandas would for a .gz, .bz2, .xz or .zip filename) or as Parquet, a typed,
+compressed columnar format; the format follows the filename (.parquet/.pq)
+unless it's given.
+
+Each Parquet flush is a row group, with per-column min/max statistics.
+`read_table` reads back just the columns asked for, and with filters, just
+the row groups that can hold the wanted values: a cluster-compare table is
+written one alpha-ksize at a time, so reading one alpha-ksize skips the
+others without decompressing them. csv tables are read a chunk at a time
+and filtered as they go.
+
+Parquet needs pyarrow, which is only imported when a Parquet table is
+written or read.
+
+This code is under CC0.
+"""
+import io
+import os
+import bz2
+import gzip
+import lzma
+import time
+import zipfile
+
+import pandas as pd
+
+TABLE_FORMATS = ("csv", "parquet")
+PARQUET_EXTENSIONS = (".parquet", ".pq")
+
+
+def table_format(filename, output_format=None):
+    "output_format if given, else parquet for .parquet/.pq filenames, else csv"
+    if output_format:
+        if output_format not in TABLE_FORMATS:
+            raise ValueError(f"unknown table format '{output_format}'; use one of {', '.join(TABLE_FORMATS)}")
+        return output_format
+    if filename.endswith(PARQUET_EXTENSIONS):
+        return "parquet"
+    return "csv"
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet tables need pyarrow; install it (conda install -c conda-forge pyarrow) or write csv")
+    return pyarrow
+
+
+def open_output(filename):
+    """
+    open an output csv for streaming writes, compressed by its extension
+    as pandas' to_csv would: .gz, .bz2, .xz, or .zip (one member, named
+    like the file without .zip)
+    """
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'wt', newline='')
+    if filename.endswith('.bz2'):
+        return bz2.open(filename, 'wt', newline='')
+    if filename.endswith('.xz'):
+        return lzma.open(filename, 'wt', newline='')
+    if filename.endswith('.zip'):
+        return _ZipMember(filename)
+    if filename.endswith(('.zst', '.tar')):
+        raise ValueError(f"can't stream a csv into {filename}; use .gz, .bz2, .xz, .zip or no compression")
+    return open(filename, 'wt', newline='')
+
+
+class _ZipMember(io.TextIOWrapper):
+    "a text stream into the only member of a new zip file, closing both together"
+    def __init__(self, filename):
+        self._zip = zipfile.ZipFile(filename, 'w')
+        member = zipfile.ZipInfo(os.path.basename(filename)[:-len('.zip')], time.localtime()[:6])
+        member.compress_type = zipfile.ZIP_DEFLATED
+        super().__init__(self._zip.open(member, 'w'), newline='')
+
+    def close(self):
+        super().close()
+        self._zip.close()
+
+
+class TableWriter:
+    """
+    Write a table with these columns to filename, chunk_rows rows at a time:
+    as csv chunks (header first), or as Parquet row groups, with column
+    types taken from the first chunk -- or from dtypes, {column: dtype}, for
+    columns whose type a chunk can't tell (say, ints that are sometimes NaN).
+    Rows are buffered by `append` and `extend`, and dataframes by
+    `write_frame`, in the order they come. `flush` writes out what's
+    buffered now, e.g. to start a new row group at a partition boundary.
+    Use as a context manager, or `close` it.
+    """
+    def __init__(self, filename, columns, output_format=None, chunk_rows=100000, compression="zstd", dtypes=None):
+        self.filename = filename
+        self.columns = list(columns)
+        self.format = table_format(filename, output_format)
+        self.chunk_rows = max(1, chunk_rows)
+        self.dtypes = dtypes
+        self.num_rows = 0
+        self.rows = []
+        # dataframes (and earlier rows) waiting to be written, and their total length
+        self.frames = []
+        self.buffered = 0
+        self.chunks_written = 0
+        self._fp, self._parquet, self._schema = None, None, None
+        if self.format == "parquet":
+            self._pa = _import_pyarrow()
+            self.compression = compression
+        else:
+            self._fp = open_output(filename)
+
+    def append(self, row):
+        self.rows.append(row)
+        if self.buffered + len(self.rows) >= self.chunk_rows:
+            self._buffer_rows()
+            self._write_full_chunks()
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def write_frame(self, df):
+        "add a dataframe's rows (in the table's column order), after anything buffered"
+        self._buffer_rows()
+        if len(df):
+            self.frames.append(df[self.columns])
+            self.buffered += len(df)
+            self._write_full_chunks()
+
+    def _buffer_rows(self):
+        if self.rows:
+            self.frames.append(pd.DataFrame.from_records(self.rows, columns=self.columns))
+            self.buffered += len(self.rows)
+            self.rows = []
+
+    def _write_full_chunks(self):
+        "write every full chunk buffered; keep the rest"
+        if self.buffered < self.chunk_rows:
+            return
+        df = pd.concat(self.frames, ignore_index=True) if len(self.frames) > 1 else self.frames[0]
+        full = len(df) - len(df) % self.chunk_rows
+        for start in range(0, full, self.chunk_rows):
+            self._write_chunk(df.iloc[start:start + self.chunk_rows])
+        rest = df.iloc[full:]
+        self.frames = [rest] if len(rest) else []
+        self.buffered = len(rest)
+
+    def flush(self):
+        "write out everything buffered"
+        self._buffer_rows()
+        if self.frames:
+            df = pd.concat(self.frames, ignore_index=True) if len(self.frames) > 1 else self.frames[0]
+            for start in range(0, len(df), self.chunk_rows):
+                self._write_chunk(df.iloc[start:start + self.chunk_rows])
+            self.frames, self.buffered = [], 0
+
+    def _write_chunk(self, df):
+        if self.dtypes:
+            df = df.astype(self.dtypes)
+        if self.format == "csv":
+            df.to_csv(self._fp, index=False, header=(self.chunks_written == 0))
+        else:
+            pa = self._pa
+            if self._parquet is None:
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                self._schema = table.schema
+                self._parquet = pa.parquet.ParquetWriter(self.filename, self._schema,
+                                                         compression=self.compression)
+            else:
+                table = pa.Table.from_pandas(df, schema=self._schema, preserve_index=False)
+            self._parquet.write_table(table, row_group_size=len(df))
+        self.num_rows += len(df)
+        self.chunks_written += 1
+
+    def close(self):
+        self.flush()
+        if self.format == "csv":
+            if self.chunks_written == 0:
+                # an empty table still gets its header
+                pd.DataFrame(columns=self.columns).to_csv(self._fp, index=False)
+            self._fp.close()
+        else:
+            if self._parquet is None:
+                pa = self._pa
+                empty = pd.DataFrame(columns=self.columns)
+                if self.dtypes:
+                    empty = empty.astype(self.dtypes)
+                empty = pa.Table.from_pandas(empty, preserve_index=False)
+                pa.parquet.write_table(empty, self.filename, compression=self.compression)
+            else:
+                self._parquet.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_table(filename, columns=None, filters=None, chunksize=100000):
+    """
+    Read a table written by TableWriter (or any csv). With columns, only
+    those columns; with filters, a dict of {column: allowed values} (e.g.
+    {"alpha-ksize": ["protein-10"]}), only the rows that match them all.
+    """
+    filters = filters or {}
+    filter_cols = [col for col in filters if columns is None or col not in columns]
+    read_cols = None if columns is None else list(columns) + filter_cols
+
+    if table_format(filename) == "parquet":
+        pa = _import_pyarrow()
+        # row groups whose statistics rule out the filters aren't read
+        parquet_filters = [(col, "in", list(values)) for col, values in filters.items()] or None
+        table = pa.parquet.read_table(filename, columns=read_cols, filters=parquet_filters)
+        df = table.to_pandas()
+    else:
+        chunks = []
+        for chunk in pd.read_csv(filename, usecols=read_cols, chunksize=chunksize):
+            for col, values in filters.items():
+                chunk = chunk[chunk[col].isin(values)]
+            chunks.append(chunk)
+        df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=read_cols)
+    if columns is not None:
+        df = df[list(columns)]
+    return df
@@ -0,0 +1,204 @@
+"""
+Shared test helpers: the repo's modules on sys.path, hyphenated scripts
+loaded as modules or run as the pipeline runs them, and synthetic sourmash
+signatures to run them on.
+
+This code is under CC0.
+"""
+import os
+import sys
+import random
+import subprocess
+import importlib.util
+from collections import OrderedDict, namedtuple
+
+import pytest
+import pandas as pd
+import sourmash
+from sourmash.minhash import _get_max_hash_for_scaled
+from sourmash.sourmash_args import SaveSignaturesToLocation
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the modules are flat files next to the scripts
+sys.path.insert(0, REPO)
+
+# cluster-compare's output columns, as the original script wrote them
+COMPARE_COLUMNS = ['comparison_name', 'anchor_name', 'ref_name', 'cluster_name', 'alphabet', 'ksize', 'scaled',
+                   'jaccard', 'max_containment', 'anchor_containment', 'anchor_hashes', 'query_hashes', 'num_common']
+
+
+def load_script(filename):
+    "import a hyphenated script (e.g. find-founders.py) as a module, without running its main"
+    name = os.path.splitext(filename)[0].replace('-', '_')
+    spec = importlib.util.spec_from_file_location(name, os.path.join(REPO, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_script(filename, *args, cwd=None):
+    "run a script in a fresh python, as the snakefiles do; fails the test if it fails"
+    cmd = [sys.executable, os.path.join(REPO, filename)] + [str(arg) for arg in args]
+    result = subprocess.run(cmd, cwd=cwd, capture_output=True, text=True)
+    assert result.returncode == 0, f"{' '.join(cmd)} failed:\n{result.stdout}\n{result.stderr}"
+    return result
+
+
+def random_minhashes(num, rng, scaled=2, ksize=31, min_size=1, max_size=8, pool_size=40):
+    """
+    num DNA MinHashes drawing their hashes from one shared pool, so they
+    overlap by all sorts of amounts. With small sizes, containments get
+    sourmash's bias correction for tiny sketches.
+    """
+    max_hash = _get_max_hash_for_scaled(scaled)
+    pool = [rng.randrange(1, max_hash) for _ in range(pool_size)]
+    minhashes = []
+    for _ in range(num):
+        mh = sourmash.MinHash(n=0, ksize=ksize, scaled=scaled)
+        mh.add_many(rng.sample(pool, rng.randint(min_size, min(max_size, pool_size))))
+        minhashes.append(mh)
+    return minhashes
+
+
+def write_sigs(sigdir, minhashes, prefix='G'):
+    """
+    Save each MinHash as its own .sig file, named '{prefix}NNNN synthetic';
+    returns the (filename, SourmashSignature) pairs in order.
+    """
+    os.makedirs(sigdir, exist_ok=True)
+    sigs = []
+    for n, mh in enumerate(minhashes):
+        sig = sourmash.SourmashSignature(mh, name=f"{prefix}{n:04d} synthetic")
+        filename = os.path.join(sigdir, f"{prefix}{n:04d}.sig")
+        with SaveSignaturesToLocation(filename) as save_sigs:
+            save_sigs.add(sig)
+        sigs.append((filename, sig))
+    return sigs
+
+
+def write_sigdb(filename, sigs):
+    "save (filename, SourmashSignature) pairs' sigs to one zip collection, with a manifest"
+    with SaveSignaturesToLocation(str(filename)) as save_sigs:
+        for _, sig in sigs:
+            save_sigs.add(sig)
+    return str(filename)
+
+
+def write_siglist(filename, sigs):
+    with open(filename, 'wt') as fp:
+        for sig_from, _ in sigs:
+            fp.write(sig_from + "\n")
+    return filename
+
+
+def write_contigs(filename, rng, num_genomes=7, num_contigs=60):
+    """
+    Contigs of several genomes, interleaved, named '{genome}|contig{n} ...'
+    as split-fasta-by-genome-dict.py expects; returns the genomes' records
+    in file order.
+    """
+    genomes = OrderedDict()
+    with open(filename, 'wt') as fp:
+        for n in range(num_contigs):
+            genome = f"GCA_{rng.randrange(num_genomes):06d}.1"
+            name = f"{genome}|contig{n} some description"
+            sequence = "".join(rng.choice("ACGT") for _ in range(rng.randint(1, 200)))
+            fp.write(f">{name}\n{sequence}\n")
+            genomes.setdefault(genome, []).append((name, sequence))
+    return genomes
+
+
+ClusterData = namedtuple('ClusterData', 'sigdir, siglist, comparison_csv, sigfile, sigdb, sigs')
+
+
+def write_cluster_data(tmp_path, rng, num_genomes=40, num_clusters=8, ksizes=(21, 31), description=" synthetic genome"):
+    """
+    Genomes g0..gN, each sketched at every ksize into its own sig file
+    (sigs/p-gN.sig), plus all of them in one JSON sig file and in one
+    signature database, and a comparison csv of clusters (an anchor and
+    some members, which can be in several clusters). sigs maps
+    (accession, ksize) to the SourmashSignature. Sigs are named accession
+    plus description.
+    """
+    sigdir = tmp_path / "sigs"
+    os.makedirs(sigdir)
+    sigs, siglist = {}, []
+    pools = {}
+    for ksize in ksizes:
+        # tiny sketches, and some larger ones, at every ksize
+        pools[ksize] = (random_minhashes(num_genomes // 2, rng, ksize=ksize, max_size=8) +
+                        random_minhashes(num_genomes - num_genomes // 2, rng, ksize=ksize, min_size=20,
+                                         max_size=120, pool_size=200))
+    for n in range(num_genomes):
+        acc = f"g{n}"
+        filename = str(sigdir / f"p-{acc}.sig")
+        with SaveSignaturesToLocation(filename) as save_sigs:
+            for ksize in ksizes:
+                sigs[(acc, ksize)] = sourmash.SourmashSignature(pools[ksize][n], name=f"{acc}{description}")
+                save_sigs.add(sigs[(acc, ksize)])
+        siglist.append(filename)
+    write_siglist(tmp_path / "siglist.txt", [(filename, None) for filename in siglist])
+
+    all_sigs = [(None, sig) for sig in sigs.values()]
+    sigfile = str(tmp_path / "all.sig")
+    with SaveSignaturesToLocation(sigfile) as save_sigs:
+        for _, sig in all_sigs:
+            save_sigs.add(sig)
+    sigdb = write_sigdb(tmp_path / "sigdb.zip", all_sigs)
+
+    with open(tmp_path / "comparisons.csv", 'wt') as fp:
+        fp.write("cluster,cluster_anchor,cluster_members\n")
+        # genomes past 3/4 of the way are in no cluster
+        for n in range(num_clusters):
+            members = rng.sample(range(num_genomes * 3 // 4), rng.randint(2, 10))
+            fp.write(f"c{n},g{members[0]},{';'.join(f'g{m}' for m in members)}\n")
+    return ClusterData(str(sigdir), str(tmp_path / "siglist.txt"), str(tmp_path / "comparisons.csv"),
+                       sigfile, sigdb, sigs)
+
+
+def original_comparisons(data, alphabet, ksize, scaled):
+    """
+    cluster-compare's table as it was, pair by pair with sourmash: each
+    cluster's anchor against every other member, in cluster order.
+    """
+    comparisons = pd.read_csv(data.comparison_csv)
+    rows = []
+    for cluster, anchor_acc, members in comparisons.itertuples(index=False):
+        anchor = data.sigs[(anchor_acc, ksize)]
+        for acc in members.split(";"):
+            if acc == anchor_acc:
+                continue
+            sig = data.sigs[(acc, ksize)]
+            rows.append((f"{anchor_acc}_x_{acc}", anchor_acc, acc, cluster, alphabet, ksize, scaled,
+                         anchor.jaccard(sig), anchor.max_containment(sig), anchor.contained_by(sig),
+                         len(anchor.minhash.hashes), len(sig.minhash.hashes),
+                         anchor.minhash.count_common(sig.minhash)))
+    return pd.DataFrame.from_records(rows, columns=COMPARE_COLUMNS)
+
+
+@pytest.fixture
+def cluster_data(tmp_path, rng):
+    return write_cluster_data(tmp_path, rng)
+
+
+@pytest.fixture
+def rng():
+    return random.Random(42)
+
+
+@pytest.fixture
+def small_sigs(tmp_path, rng):
+    "150 tiny, overlapping sketches (1-8 hashes at scaled=2), saved one per .sig file"
+    return write_sigs(str(tmp_path / "sigs"), random_minhashes(150, rng))
+
+
+@pytest.fixture
+def mixed_sigs(tmp_path, rng):
+    """
+    120 sketches at scaled=2, from tiny (bias-corrected) to a few hundred
+    hashes, drawn from one pool so that plenty of pairs pass a threshold.
+    """
+    minhashes = (random_minhashes(60, rng, min_size=1, max_size=60, pool_size=150) +
+                 random_minhashes(60, rng, min_size=100, max_size=300, pool_size=400))
+    rng.shuffle(minhashes)
+    return write_sigs(str(tmp_path / "sigs"), minhashes)
@@ -0,0 +1,81 @@
+"""
+assign-to-founders.py against searching every founder for each member
+with sourmash, as `sourmash search --max-containment --best-only` did.
+
+This code is under CC0.
+"""
+import csv
+
+import pytest
+import sourmash
+
+from conftest import run_script, write_sigdb, write_siglist
+
+
+def original_assignments(founders, members, threshold):
+    "for each member, the founder with the highest max containment (the first of ties), if it passes threshold"
+    rows = []
+    for member_from, member in members:
+        best_n, best_contain, best_common = None, 0.0, 0
+        for founder_n, (_, founder) in enumerate(founders):
+            common = member.minhash.count_common(founder.minhash)
+            if not common:
+                continue
+            contain = member.max_containment(founder)
+            if best_n is None or contain > best_contain:
+                best_n, best_contain, best_common = founder_n, contain, common
+        if best_n is not None and best_contain >= threshold:
+            founder_from, founder = founders[best_n]
+            rows.append((str(best_n), str(founder), founder_from, str(member), member_from, best_contain, best_common))
+        else:
+            rows.append(("", "", "", str(member), member_from, best_contain, best_common))
+    return rows
+
+
+def read_assignments(filename):
+    with open(filename, newline='') as fp:
+        rows = list(csv.reader(fp))[1:]
+    return [(*row[:5], float(row[5]), int(row[6])) for row in rows]
+
+
+def load_siglist_csv(filename):
+    rows = [line.rstrip().rsplit(",", 1) for line in open(filename)]
+    return [(sigfile, *sourmash.load_file_as_signatures(sigfile, ksize=31, select_moltype='DNA'))
+            for _, sigfile in rows]
+
+
+# 0.67 only comes out right with bias-corrected max containment for tiny sketches
+@pytest.mark.parametrize("sigs_fixture, threshold", [("small_sigs", 0.34), ("small_sigs", 0.67),
+                                                      ("mixed_sigs", 0.2), ("mixed_sigs", 0.6)])
+def test_assignments_match_sourmash_search(tmp_path, request, sigs_fixture, threshold):
+    sigs = request.getfixturevalue(sigs_fixture)
+    siglist = write_siglist(tmp_path / "siglist.txt", sigs)
+    run_script("find-founders.py", "--siglist", siglist, "--threshold", 0.3, "--batch-size", 30,
+               "--prefix", tmp_path / "ff")
+    run_script("assign-to-founders.py", "--founders-csv", tmp_path / "ff.founders.siglist.csv",
+               "--members-csv", tmp_path / "ff.members.siglist.csv", "--threshold", threshold,
+               "--output-csv", tmp_path / "assigned.csv")
+
+    founders = load_siglist_csv(tmp_path / "ff.founders.siglist.csv")
+    members = load_siglist_csv(tmp_path / "ff.members.siglist.csv")
+    expected = original_assignments(founders, members, threshold)
+    assert read_assignments(tmp_path / "assigned.csv") == expected
+    # (some members are left unassigned above find-founders' threshold)
+    assert any(row[0] == "" for row in expected) == (threshold > 0.3)
+
+
+def test_database_sketches(tmp_path, mixed_sigs):
+    # founders and members listed as single sketches in a signature database
+    for name, sigs in (("files", write_siglist(tmp_path / "siglist.txt", mixed_sigs)),
+                       ("sigdb", write_sigdb(tmp_path / "sigs.zip", mixed_sigs))):
+        run_script("find-founders.py", "--siglist", sigs, "--threshold", 0.3, "--batch-size", 30,
+                   "--prefix", tmp_path / name)
+        run_script("assign-to-founders.py", "--founders-csv", tmp_path / f"{name}.founders.siglist.csv",
+                   "--members-csv", tmp_path / f"{name}.members.siglist.csv", "--threshold", 0.5,
+                   "--output-csv", tmp_path / f"{name}.assigned.csv")
+    from_files = read_assignments(tmp_path / "files.assigned.csv")
+    from_sigdb = read_assignments(tmp_path / "sigdb.assigned.csv")
+    # the same assignments, apart from where the sigs were read from
+    drop_sources = lambda rows: [row[:2] + row[3:4] + row[5:] for row in rows]
+    assert drop_sources(from_sigdb) == drop_sources(from_files)
+    assert all(row[4].startswith(str(tmp_path / "sigs.zip#")) for row in from_sigdb)
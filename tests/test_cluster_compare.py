@@ -0,0 +1,126 @@
+"""
+cluster-compare.py and cluster-compare-singleton.py against the original
+pair-by-pair comparisons with sourmash, on synthetic sketches.
+
+This code is under CC0.
+"""
+import pandas as pd
+import pytest
+
+from conftest import original_comparisons, run_script, write_cluster_data
+from clustercompare import (AlphaKsize, alpha_ksizes, cluster_jobs, compare_clusters, read_comparison_csv,
+                            results_frame)
+from hashstore import HashStore
+
+
+def cluster_compare(tmp_path, data, name, *args, siglist=None):
+    output = tmp_path / f"{name}.csv"
+    run_script("cluster-compare.py", "--siglist", siglist or data.siglist, "--sig-prefix", "p-",
+               "--comparison-csv", data.comparison_csv, "--output-csv", output, *args)
+    return output
+
+
+def read_comparisons(output):
+    return pd.read_csv(output, float_precision="round_trip")
+
+
+@pytest.mark.parametrize("ksize", [21, 31])
+def test_matches_original(tmp_path, cluster_data, ksize):
+    output = cluster_compare(tmp_path, cluster_data, "compare", "--alphabet", "DNA", "--ksize", ksize)
+    pd.testing.assert_frame_equal(read_comparisons(output), original_comparisons(cluster_data, "DNA", ksize, 100),
+                                  check_exact=True)
+
+
+def test_small_cache_and_prefetch_threads(tmp_path, cluster_data):
+    default = cluster_compare(tmp_path, cluster_data, "default", "--alphabet", "DNA", "--ksize", 21)
+    # one full sig kept at a time, loaded across threads; the hashes all still go in the store
+    small = cluster_compare(tmp_path, cluster_data, "small", "--alphabet", "DNA", "--ksize", 21,
+                            "--cache-size", 1, "--prefetch-threads", 3)
+    assert small.read_bytes() == default.read_bytes()
+    pd.testing.assert_frame_equal(read_comparisons(small), original_comparisons(cluster_data, "DNA", 21, 100),
+                                  check_exact=True)
+
+
+@pytest.fixture
+def singleton_data(tmp_path, rng):
+    # cluster-compare-singleton looks sigs up by name, so they're named just by accession
+    return write_cluster_data(tmp_path, rng, description="")
+
+
+def cluster_compare_singleton(tmp_path, name, data, *args):
+    output = tmp_path / f"{name}.csv"
+    run_script("cluster-compare-singleton.py", "--comparison-csv", data.comparison_csv, "--sigdir", data.sigdir,
+               "--output-csv", output, *args)
+    return output
+
+
+@pytest.mark.parametrize("source", ["sigfiles", "siglist"])
+def test_singleton_stream_matches_original(tmp_path, singleton_data, source):
+    if source == "sigfiles":
+        sources = ["--sigfiles", singleton_data.sigfile]
+    else:
+        sources = ["--siglist", singleton_data.siglist]
+    loaded = cluster_compare_singleton(tmp_path, "loaded", singleton_data, *sources, "--alphabet", "DNA",
+                                       "--ksize", 31)
+    streamed = cluster_compare_singleton(tmp_path, "streamed", singleton_data, *sources, "--alphabet", "DNA",
+                                         "--ksize", 31, "--stream")
+    assert streamed.read_bytes() == loaded.read_bytes()
+    pd.testing.assert_frame_equal(read_comparisons(streamed), original_comparisons(singleton_data, "DNA", 31, 100),
+                                  check_exact=True)
+
+
+def cluster_store(data, ksize):
+    "every genome's hashes at ksize in one HashStore, and the rows they're in"
+    store, rows = HashStore(), {}
+    for (acc, sig_ksize), sig in data.sigs.items():
+        if sig_ksize == ksize:
+            rows[acc] = store.add_signature(acc, sig)
+    return store, rows
+
+
+@pytest.mark.parametrize("batch_size", [1, 5, 1000])
+def test_compare_clusters_processes(cluster_data, batch_size):
+    store, rows = cluster_store(cluster_data, 31)
+    jobs = cluster_jobs(read_comparison_csv(cluster_data.comparison_csv), rows)
+    serial = list(compare_clusters(store, jobs, "DNA", 31, 100))
+    pooled = list(compare_clusters(store, jobs, "DNA", 31, 100, processes=2, batch_size=batch_size))
+    # every cluster, back in job order, with the same results
+    assert [job for job, _ in pooled] == jobs
+    pd.testing.assert_frame_equal(results_frame(results for _, results in pooled),
+                                  results_frame(results for _, results in serial), check_exact=True)
+
+
+def test_processes_match_serial(tmp_path, cluster_data):
+    serial = cluster_compare(tmp_path, cluster_data, "serial", "--alphabet", "DNA", "--ksize", 31)
+    pooled = cluster_compare(tmp_path, cluster_data, "pooled", "--alphabet", "DNA", "--ksize", 31,
+                             "--processes", 2, "--batch-size", 4)
+    assert pooled.read_bytes() == serial.read_bytes()
+
+
+def test_alpha_ksizes():
+    assert alpha_ksizes(None, "nucleotide", 31) == [AlphaKsize("nucleotide", "DNA", 31)]
+    assert alpha_ksizes(["protein-k10", "dayhoff-16", "nucleotide-k21", "protein-k10"], "DNA", 31) == [
+        AlphaKsize("protein", "protein", 10), AlphaKsize("dayhoff", "dayhoff", 16), AlphaKsize("nucleotide", "DNA", 21)]
+    for bad in ("protein10", "-k10", "protein-kx", "protein-"):
+        with pytest.raises(ValueError):
+            alpha_ksizes([bad], "DNA", 31)
+
+
+@pytest.mark.parametrize("script", ["cluster-compare.py", "cluster-compare-singleton.py"])
+def test_alpha_ksize_matches_separate_runs(tmp_path, singleton_data, script):
+    if script == "cluster-compare.py":
+        def compare(name, *args):
+            return cluster_compare(tmp_path, singleton_data, name, *args)
+    else:
+        def compare(name, *args):
+            return cluster_compare_singleton(tmp_path, name, singleton_data, "--sigfiles", singleton_data.sigfile, *args)
+    both = read_comparisons(compare("both", "--alpha-ksize", "DNA-k21", "DNA-k31"))
+    separate = []
+    for ksize in (21, 31):
+        comparisons = read_comparisons(compare(f"k{ksize}", "--alphabet", "DNA", "--ksize", ksize))
+        pd.testing.assert_frame_equal(comparisons, original_comparisons(singleton_data, "DNA", ksize, 100),
+                                      check_exact=True)
+        comparisons["alpha-ksize"] = f"DNA-{ksize}"
+        separate.append(comparisons)
+    # one table, one alphabet/ksize after the other, as the aggregate rules built it
+    pd.testing.assert_frame_equal(both, pd.concat(separate, ignore_index=True), check_exact=True)
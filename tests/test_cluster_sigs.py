@@ -0,0 +1,70 @@
+"""
+cluster-sigs.py against the original pair-by-pair clustering with
+sourmash, on synthetic sketches.
+
+This code is under CC0.
+"""
+import random
+
+import pandas as pd
+import pytest
+
+from conftest import run_script, write_sigdb, write_siglist
+from hashstore import ThresholdStats
+
+
+def original_cluster_founders(sigs, threshold, batch_size, seed=1):
+    """
+    cluster-sigs' founders as it found them: shuffle, then uniqify the
+    first batch of the remaining sigs (pop the last as a founder, drop the
+    rest of the batch that cluster to it, repeat), and drop every remaining
+    sig -- the batch's founders themselves included -- that clusters to
+    any founder so far, by sourmash max containment.
+    """
+    def unclustered(founder, siglist):
+        return [(sig_from, sig) for sig_from, sig in siglist
+                if not max(sig.contained_by(founder), founder.contained_by(sig)) >= threshold]
+
+    siglist = list(sigs)
+    random.Random(seed).shuffle(siglist)
+    founders, num_batches = [], 0
+    while siglist:
+        batch = siglist[:batch_size]
+        while batch:
+            founder_from, founder = batch.pop()
+            founders.append((founder_from, founder))
+            batch = unclustered(founder, batch)
+        for _, founder in founders:
+            siglist = unclustered(founder, siglist)
+        num_batches += 1
+    return [founder_from for founder_from, _ in founders], num_batches
+
+
+def cluster_sigs(tmp_path, siglist, threshold, batch_size, prefix="cs"):
+    run_script("cluster-sigs.py", "--siglist", siglist, "--threshold", threshold, "--batch-size", batch_size,
+               "--prefix", tmp_path / prefix)
+    founders = open(tmp_path / f"{prefix}.founders.siglist").read().split()
+    return founders, pd.read_csv(tmp_path / f"{prefix}.comparisons.csv")
+
+
+@pytest.mark.parametrize("sigs_fixture, threshold, batch_size", [("small_sigs", 0.34, 40), ("small_sigs", 0.67, 25),
+                                                                 ("mixed_sigs", 0.2, 30), ("mixed_sigs", 0.5, 200)])
+def test_founders_match_original(tmp_path, request, sigs_fixture, threshold, batch_size):
+    sigs = request.getfixturevalue(sigs_fixture)
+    founders, comparisons = cluster_sigs(tmp_path, write_siglist(tmp_path / "siglist.txt", sigs), threshold, batch_size)
+    expected, num_batches = original_cluster_founders(sigs, threshold, batch_size)
+    assert founders == expected
+    # a uniqify row and a cluster row per batch, with find-founders' columns
+    assert list(comparisons.columns) == ["batch_n", "pass_n", "stage"] + list(ThresholdStats.fields)
+    assert list(comparisons["stage"]) == ["uniqify", "cluster"] * num_batches
+    assert list(comparisons["batch_n"]) == [n for batch_n in range(num_batches) for n in (batch_n, batch_n + 1)]
+    assert (comparisons["pairs"] > 0).any()
+
+
+def test_database_siglist(tmp_path, mixed_sigs):
+    founders, _ = cluster_sigs(tmp_path, write_siglist(tmp_path / "siglist.txt", mixed_sigs), 0.3, 30, prefix="files")
+    sigdb = write_sigdb(tmp_path / "sigs.zip", mixed_sigs)
+    db_founders, _ = cluster_sigs(tmp_path, sigdb, 0.3, 30, prefix="sigdb")
+    # the same founders, each listed by its own location in the database
+    locations = {sig_from: f"{sigdb}#{sig.md5sum()}" for sig_from, sig in mixed_sigs}
+    assert db_founders == [locations[founder] for founder in founders]
@@ -0,0 +1,58 @@
+"""
+count-hashes.py's one-pass counts against downsampling each sketch with
+sourmash.
+
+This code is under CC0.
+"""
+import pandas as pd
+
+from conftest import run_script, write_siglist
+
+SCALED_VALS = [1, 4, 10, 50]
+
+
+def count_hashes(tmp_path, siglist, prefix, *args):
+    lengths = tmp_path / "lengths.csv"
+    output = tmp_path / f"{prefix}.csv"
+    run_script("count-hashes.py", "--siglist", siglist, "--length-csv", lengths, "--output-csv", output,
+               *[arg for scaled in SCALED_VALS for arg in ("-s", scaled)], *args)
+    return output
+
+
+def expected_counts(sigs):
+    "a row per sig at its own scaled, then per larger scaled value, from downsampled MinHashes"
+    rows = []
+    for _, sig in sigs:
+        mh = sig.minhash
+        rows.append((str(sig), mh.ksize, mh.scaled, len(mh), 1000))
+        for scaled in SCALED_VALS:
+            # can't downsample to a smaller scaled
+            if scaled >= mh.scaled:
+                rows.append((str(sig), mh.ksize, scaled, len(mh.downsample(scaled=scaled)), 1000))
+    return rows
+
+
+def write_lengths(tmp_path, sigs):
+    with open(tmp_path / "lengths.csv", 'wt') as fp:
+        for _, sig in sigs:
+            fp.write(f"{sig},1000\n")
+
+
+def test_counts_match_downsample(tmp_path, mixed_sigs):
+    write_lengths(tmp_path, mixed_sigs)
+    siglist = write_siglist(tmp_path / "siglist.txt", mixed_sigs)
+    output = count_hashes(tmp_path, siglist, "counts")
+    counts = pd.read_csv(output)
+    assert list(counts.columns) == ["name", "ksize", "scaled", "num_hashes", "genome_length"]
+    assert list(counts.itertuples(index=False, name=None)) == expected_counts(mixed_sigs)
+
+
+def test_processes_match_serial(tmp_path, mixed_sigs):
+    write_lengths(tmp_path, mixed_sigs)
+    siglist = write_siglist(tmp_path / "siglist.txt", mixed_sigs)
+    serial = count_hashes(tmp_path, siglist, "serial")
+    # sigfiles come back in siglist order, however they're spread over the pool
+    # and however the output is chunked
+    pooled = count_hashes(tmp_path, siglist, "pooled", "--processes", 3, "--sigfile-chunksize", 4,
+                          "--chunk-rows", 7)
+    assert pooled.read_bytes() == serial.read_bytes()
@@ -0,0 +1,168 @@
+"""
+fastautils.py's raw-byte FASTA scanning against screed, which the length
+scripts used before, and its sparse length histograms against numpy and
+pandas on the full list of lengths.
+
+This code is under CC0.
+"""
+import bz2
+import gzip
+import random
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import pytest
+import screed
+
+from conftest import run_script
+from fastautils import (bin_length_histogram, histogram_quantiles, iter_fasta_lengths, length_histogram,
+                        merge_length_histograms, summarize_lengths, total_lengths)
+
+# whitespace inside a sequence line counts toward the length, as in screed;
+# whitespace around it doesn't
+FASTA_CASES = {
+    'plain': ">a x\nACGT\nAC\n>b\nGGGG\n",
+    'internal_whitespace': ">a\nAC GT\nA\tC\n  AC  \n>b\n\tG G\t\n",
+    'crlf': ">a desc\r\nACGT\r\nACG\r\n>b\r\nAA\r\n",
+    'stray_cr': ">a\nAC\rGT\nAA\r\r\n>b\nA\x0cC\x0b\n",
+    'no_final_newline': ">a\nACGT\n>b\nAC GT \r",
+    'blank_lines': ">a\n\nACGT\n\n>b\n\n>c\nA\n",
+    'empty_records': ">a\n>b\n>c\nACGT\n",
+    'non_ascii': ">a\nAC GT \nAAé \n>b\n\x1cAC\x1f\n",
+}
+
+
+def random_fasta(rng):
+    "records of random residues and whitespace, with ragged line lengths and endings"
+    records = []
+    for n in range(rng.randint(1, 6)):
+        residues = "".join(rng.choice("ACGT \t\r") if rng.random() < 0.9 else "\n"
+                           for _ in range(rng.randint(0, 300)))
+        records.append(f">r{n} description\n{residues}{rng.choice(['', chr(13)])}\n")
+    return "".join(records)
+
+
+def screed_lengths(filename):
+    with screed.open(str(filename)) as records:
+        return [(record.name, len(record.sequence)) for record in records]
+
+
+def fasta_cases():
+    rng = random.Random(3)
+    cases = dict(FASTA_CASES)
+    for n in range(20):
+        cases[f'random{n}'] = random_fasta(rng)
+    return cases
+
+
+@pytest.mark.parametrize("name, text", fasta_cases().items())
+def test_lengths_match_screed(tmp_path, name, text):
+    filename = tmp_path / f"{name}.fa"
+    filename.write_bytes(text.encode())
+    expected = screed_lengths(filename)
+    # blocks that split lines, line endings and headers anywhere
+    for block_size in (1, 3, 7, 64, 1 << 20):
+        assert list(iter_fasta_lengths(str(filename), block_size=block_size)) == expected
+
+
+@pytest.mark.parametrize("compress, suffix", [(gzip.compress, ".gz"), (bz2.compress, ".bz2")])
+def test_compressed_lengths(tmp_path, compress, suffix):
+    text = fasta_cases()['random0']
+    plain, packed = tmp_path / "seqs.fa", tmp_path / f"seqs.fa{suffix}"
+    plain.write_bytes(text.encode())
+    packed.write_bytes(compress(text.encode()))
+    assert list(iter_fasta_lengths(str(packed), block_size=5)) == screed_lengths(plain)
+
+
+def test_fastq_goes_to_screed(tmp_path):
+    filename = tmp_path / "reads.fq"
+    filename.write_text("@r1\nACGT\n+\nIIII\n@r2\nAC\n+\nII\n")
+    assert list(iter_fasta_lengths(str(filename))) == [("r1", 4), ("r2", 2)]
+
+
+def test_sequence_before_any_header(tmp_path):
+    filename = tmp_path / "bad.fa"
+    filename.write_text("ACGT\n>a\nAC\n")
+    with pytest.raises(IOError):
+        list(iter_fasta_lengths(str(filename)))
+
+
+def test_total_lengths(tmp_path):
+    filenames = []
+    for name, text in fasta_cases().items():
+        filename = tmp_path / f"{name}.fa"
+        filename.write_bytes(text.encode())
+        filenames.append(str(filename))
+    expected = [sum(length for _, length in screed_lengths(filename)) for filename in filenames]
+    assert list(total_lengths(filenames)) == expected
+    # files come back in order from the pool
+    assert list(total_lengths(filenames, processes=3, chunksize=2)) == expected
+
+
+def test_get_length_dict_matches_screed(tmp_path):
+    text = "".join(fasta_cases().values())
+    fastafile = tmp_path / "all.fa"
+    fastafile.write_bytes(text.encode())
+    lengths_csv = tmp_path / "lengths.csv"
+    run_script("get-length-dict.py", "--fastafile", fastafile, "--lengths-csv", lengths_csv)
+    # the csv the screed version of the script wrote
+    expected = "".join(f"{name},{length}\n" for name, length in screed_lengths(fastafile))
+    assert lengths_csv.read_text() == expected
+
+
+@pytest.fixture
+def length_parts():
+    "a few lists of lengths, as from separate files, with repeats across them"
+    rng = random.Random(5)
+    return [[rng.choice([0, 1, 7, 100, 101]) if rng.random() < 0.3 else int(rng.lognormvariate(7, 1.5))
+             for _ in range(rng.randint(1, 400))] for _ in range(6)]
+
+
+def test_merged_histograms(length_parts):
+    all_lengths = [length for part in length_parts for length in part]
+    lengths, counts = merge_length_histograms(length_histogram(part) for part in length_parts)
+    expected = sorted(Counter(all_lengths).items())
+    assert list(zip(lengths.tolist(), counts.tolist())) == expected
+    # merging is order-independent, as for a pool's imap_unordered
+    shuffled = merge_length_histograms(length_histogram(part) for part in length_parts[::-1])
+    assert np.array_equal(shuffled[0], lengths) and np.array_equal(shuffled[1], counts)
+
+
+def test_histogram_quantiles_and_summary(length_parts):
+    all_lengths = np.array([length for part in length_parts for length in part])
+    lengths, counts = length_histogram(all_lengths)
+    quantiles = [0, 0.01, 0.1, 0.25, 0.5, 0.75, 0.99, 1]
+    assert np.allclose(histogram_quantiles(lengths, counts, quantiles), np.quantile(all_lengths, quantiles))
+
+    summary = summarize_lengths(lengths, counts)
+    described = pd.Series(all_lengths).describe(percentiles=[0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99])
+    for statistic in summary.index:
+        assert summary[statistic] == pytest.approx(described[statistic])
+
+
+@pytest.mark.parametrize("log_bins", [False, True])
+def test_binned_histogram(length_parts, log_bins):
+    all_lengths = np.array([length for part in length_parts for length in part])
+    lengths, counts = length_histogram(all_lengths)
+    edges, binned = bin_length_histogram(lengths, counts, 20, log_bins=log_bins)
+    assert len(edges) == 21 and edges[0] == all_lengths.min() and edges[-1] == all_lengths.max()
+    # the same bins as numpy gives the full list of lengths
+    assert np.array_equal(binned, np.histogram(all_lengths, bins=edges)[0])
+    assert binned.sum() == len(all_lengths)
+
+
+def test_get_length_distribution_matches_screed(tmp_path):
+    fastafiles = []
+    for name, text in fasta_cases().items():
+        filename = tmp_path / f"{name}.fa"
+        filename.write_bytes(text.encode())
+        fastafiles.append(str(filename))
+    fastalist = tmp_path / "fastalist.txt"
+    fastalist.write_text("\n".join(fastafiles) + "\n")
+    output_csv = tmp_path / "lengths.csv"
+    run_script("get-length-distribution.py", output_csv, "--fastalist", fastalist, "--processes", 2)
+    # the screed version counted each distinct record length
+    expected = Counter(length for filename in fastafiles for _, length in screed_lengths(filename))
+    histogram = pd.read_csv(output_csv)
+    assert list(zip(histogram["length"], histogram["count"])) == sorted(expected.items())
@@ -0,0 +1,173 @@
+"""
+find-founders.py against the original pair-by-pair clustering with
+sourmash, on synthetic sketches.
+
+This code is under CC0.
+"""
+import os
+import random
+import argparse
+
+import pytest
+import pandas as pd
+
+from conftest import load_script, run_script, write_siglist
+
+
+def original_founders(sigs, threshold, batch_size, seed=1):
+    """
+    The founders, members and rarefaction counts of find-founders as it
+    was: shuffle, then uniqify each batch (pop the last sig as a founder,
+    cluster the rest to it, repeat) and cluster the remaining sigs to the
+    batch's founders one founder at a time, by sourmash max containment.
+    A sig identical to a founder (same file, same sketch) is dropped.
+    """
+    def cluster(founder_from, founder, siglist, members):
+        leftover = []
+        for sig_from, sig in siglist:
+            if sig_from == founder_from and sig == founder:
+                continue
+            if max(sig.contained_by(founder), founder.contained_by(sig)) >= threshold:
+                members.append(sig_from)
+            else:
+                leftover.append((sig_from, sig))
+        return leftover
+
+    siglist = list(sigs)
+    random.Random(seed).shuffle(siglist)
+    founders, members, rarefaction = [], [], []
+    while siglist:
+        batch, siglist = siglist[:batch_size], siglist[batch_size:]
+        new_founders = []
+        while batch:
+            founder_from, founder = batch.pop()
+            new_founders.append((founder_from, founder))
+            batch = cluster(founder_from, founder, batch, members)
+        for founder_from, founder in new_founders:
+            siglist = cluster(founder_from, founder, siglist, members)
+        founders += [founder_from for founder_from, _ in new_founders]
+        rarefaction.append((len(founders), len(members)))
+    return founders, members, rarefaction
+
+
+def find_founders(tmp_path, sigs, threshold, batch_size, *args, prefix="ff"):
+    siglist = write_siglist(tmp_path / f"{prefix}.siglist.txt", sigs)
+    run_script("find-founders.py", "--siglist", siglist, "-k", 31, "--moltype", "DNA",
+               "--threshold", threshold, "--batch-size", batch_size, "--prefix", tmp_path / prefix, *args)
+    return tmp_path / prefix
+
+
+def read_outputs(prefix):
+    founders = open(f"{prefix}.founders.siglist.txt").read().split()
+    members = open(f"{prefix}.members.siglist.txt").read().split()
+    rarefaction = [tuple(map(int, line.split(","))) for line in open(f"{prefix}.rarefaction.txt").readlines()[1:]]
+    return founders, members, rarefaction
+
+
+# 0.52 and 0.67 only come out right with sourmash's bias correction for tiny sketches
+@pytest.mark.parametrize("threshold, batch_size", [(0.34, 40), (0.52, 40), (0.67, 25), (0.9, 200)])
+def test_founders_match_original(tmp_path, small_sigs, threshold, batch_size):
+    # a few sigs listed twice: the second copy is recognized as its founder
+    sigs = small_sigs + small_sigs[::30]
+    prefix = find_founders(tmp_path, sigs, threshold, batch_size)
+    assert read_outputs(prefix) == original_founders(sigs, threshold, batch_size)
+
+
+@pytest.mark.parametrize("threshold", [0.2, 0.5])
+def test_founders_match_original_larger_sketches(tmp_path, mixed_sigs, threshold):
+    prefix = find_founders(tmp_path, mixed_sigs, threshold, 30)
+    assert read_outputs(prefix) == original_founders(mixed_sigs, threshold, 30)
+
+
+@pytest.mark.parametrize("processes", [2, 3])
+def test_processes_match_serial(tmp_path, mixed_sigs, processes):
+    serial = find_founders(tmp_path, mixed_sigs, 0.3, 20, prefix="serial")
+    pooled = find_founders(tmp_path, mixed_sigs, 0.3, 20, "--processes", processes, prefix="pooled")
+    # shard results are merged back in siglist order, so every output, and
+    # the summed threshold test counts, are the same as a serial run's
+    for suffix in ("founders.siglist.txt", "members.siglist.csv", "rarefaction.txt", "comparisons.csv"):
+        assert open(f"{pooled}.{suffix}").read() == open(f"{serial}.{suffix}").read()
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_exact_prefilter_keeps_the_clustering(tmp_path, mixed_sigs, processes):
+    # (at thresholds this high, the exact bound rules out plenty of pairs)
+    plain = find_founders(tmp_path, mixed_sigs, 0.7, 20, prefix="plain")
+    prefiltered = find_founders(tmp_path, mixed_sigs, 0.7, 20, "--prefilter-scaled", 8,
+                                "--processes", processes, prefix="prefiltered")
+    for suffix in ("founders.siglist.txt", "members.siglist.csv", "rarefaction.txt"):
+        assert open(f"{prefiltered}.{suffix}").read() == open(f"{plain}.{suffix}").read()
+    comparisons = pd.read_csv(f"{prefiltered}.comparisons.csv")
+    assert comparisons["prefiltered"].sum() > 0
+
+
+def test_estimate_prefilter_audits(tmp_path, mixed_sigs):
+    prefix = find_founders(tmp_path, mixed_sigs, 0.3, 20, "--prefilter-scaled", 8, "--prefilter-mode", "estimate",
+                           "--prefilter-audit", 1.0)
+    comparisons = pd.read_csv(f"{prefix}.comparisons.csv")
+    # every rejection (including the coarse index's drops) is re-checked at full resolution
+    assert comparisons["prefiltered"].sum() > 0
+    assert (comparisons["audited"] == comparisons["prefiltered"]).all()
+    assert (comparisons["audit_false_negatives"] <= comparisons["audited"]).all()
+
+
+class Interrupted(Exception):
+    pass
+
+
+def founders_args(siglist, prefix, **options):
+    "find-founders' command line defaults, with siglist, prefix and options"
+    args = dict(signature_sources=None, siglist=[str(siglist)], sigdir=None, ksize=31, moltype='DNA', seed=1,
+                threshold=0.3, existing_founders=None, batch_size=20, processes=1, prefix=str(prefix),
+                prefilter_scaled=0, prefilter_mode='exact', prefilter_audit=0.01, profile=False,
+                checkpoint=False, resume=False)
+    args.update(options)
+    return argparse.Namespace(**args)
+
+
+def run_interrupted(monkeypatch, args, after_batches):
+    """
+    Run find-founders in this process, stopping it (as a crash would) once
+    after_batches batches are done and checkpointed.
+    """
+    ff = load_script("find-founders.py")
+    ff.args = args
+    cluster_to_founders = ff.cluster_to_founders
+    calls = []
+    def interrupting_cluster_to_founders(*a, **kw):
+        if len(calls) == after_batches:
+            raise Interrupted()
+        calls.append(1)
+        return cluster_to_founders(*a, **kw)
+    monkeypatch.setattr(ff, "cluster_to_founders", interrupting_cluster_to_founders)
+    with pytest.raises(Interrupted):
+        ff.main(args)
+    return open(f"{args.prefix}.checkpoint.json").read()
+
+
+def test_resume_matches_uninterrupted_run(tmp_path, mixed_sigs, monkeypatch):
+    siglist = write_siglist(tmp_path / "siglist.txt", mixed_sigs)
+    uninterrupted = find_founders(tmp_path, mixed_sigs, 0.5, 10, prefix="full")
+    options = dict(threshold=0.5, batch_size=10)
+
+    first = run_interrupted(monkeypatch, founders_args(siglist, tmp_path / "first", checkpoint=True, **options), 2)
+    second = run_interrupted(monkeypatch, founders_args(siglist, tmp_path / "second", checkpoint=True, **options), 2)
+    # checkpoints (random state and all) don't depend on the run that wrote them
+    assert first == second
+
+    ff = load_script("find-founders.py")
+    ff.args = args = founders_args(siglist, tmp_path / "first", resume=True, **options)
+    ff.main(args)
+    for suffix in ("founders.siglist.txt", "members.siglist.csv", "rarefaction.txt", "comparisons.csv"):
+        assert open(f"{tmp_path / 'first'}.{suffix}").read() == open(f"{uninterrupted}.{suffix}").read()
+    # a finished run cleans up its checkpoint
+    assert not os.path.exists(f"{tmp_path / 'first'}.checkpoint.json")
+
+
+def test_resume_refuses_other_options(tmp_path, mixed_sigs, monkeypatch):
+    siglist = write_siglist(tmp_path / "siglist.txt", mixed_sigs)
+    run_interrupted(monkeypatch, founders_args(siglist, tmp_path / "run", checkpoint=True), 1)
+    ff = load_script("find-founders.py")
+    ff.args = args = founders_args(siglist, tmp_path / "run", resume=True, threshold=0.5)
+    with pytest.raises(SystemExit):
+        ff.main(args)
@@ -0,0 +1,79 @@
+"""
+GenomeStore round trips, and a store split from contigs against one
+FASTA file per genome.
+
+This code is under CC0.
+"""
+import random
+
+import pytest
+import screed
+
+from conftest import run_script, write_contigs
+from fastautils import iter_fasta_lengths
+from genomestore import GenomeStore, GenomeStoreWriter
+
+
+def test_round_trip(tmp_path):
+    fasta = str(tmp_path / "genomes.fa")
+    # GCA_2 comes back after another genome, so it has two spans
+    records = [("GCA_1", "GCA_1|c1", "ACGT"), ("GCA_2", "GCA_2|c1 desc", "GG"),
+               ("GCA_3", "GCA_3|c1", ""), ("GCA_2", "GCA_2|c2", "TTTAAA")]
+    with GenomeStoreWriter(fasta) as writer:
+        for accession, name, sequence in records:
+            writer.add(accession, name, sequence)
+
+    with GenomeStore(fasta) as store:
+        assert store.accessions() == ["GCA_1", "GCA_2", "GCA_3"]
+        assert "GCA_2" in store and "GCA_4" not in store
+        assert dict(store.lengths()) == {"GCA_1": 4, "GCA_2": 8, "GCA_3": 0}
+        assert [store.num_records(acc) for acc in store.accessions()] == [1, 2, 1]
+        assert list(store.iter_records("GCA_2")) == [("GCA_2|c1 desc", "GG"), ("GCA_2|c2", "TTTAAA")]
+        assert store.get_bytes("GCA_2") == b">GCA_2|c1 desc\nGG\n>GCA_2|c2\nTTTAAA\n"
+    # the store is an ordinary FASTA file, too
+    with screed.open(fasta) as fasta_records:
+        assert [(r.name, r.sequence) for r in fasta_records] == [(name, seq) for _, name, seq in records]
+
+
+def test_incomplete_store_has_no_index(tmp_path):
+    fasta = str(tmp_path / "genomes.fa")
+    with GenomeStoreWriter(fasta) as writer:
+        writer.add("GCA_1", "GCA_1|c1", "ACGT")
+    with pytest.raises(RuntimeError):
+        with GenomeStoreWriter(fasta) as writer:
+            writer.add("GCA_1", "GCA_1|c1", "ACGT")
+            raise RuntimeError("stopped partway")
+    # (and the earlier store's index doesn't survive to describe the new file)
+    with pytest.raises(FileNotFoundError):
+        GenomeStore(fasta)
+
+
+def test_empty_store(tmp_path):
+    fasta = str(tmp_path / "empty.fa")
+    GenomeStoreWriter(fasta).close()
+    with GenomeStore(fasta) as store:
+        assert len(store) == 0 and store.accessions() == []
+
+
+def test_store_matches_split_files(tmp_path):
+    genomes = write_contigs(tmp_path / "contigs.fa", random.Random(11))
+    store_fasta = tmp_path / "store" / "genomes.fa"
+    run_script("split-fasta-by-genome-dict.py", tmp_path / "contigs.fa", "--genome-store", store_fasta,
+               "--output-csv", tmp_path / "store.csv", "--output-lengths", tmp_path / "store-lengths.csv")
+    run_script("split-fasta-by-genome-dict.py", tmp_path / "contigs.fa", "--output-dir", tmp_path / "split",
+               "--output-csv", tmp_path / "split.csv", "--output-lengths", tmp_path / "split-lengths.csv")
+
+    with GenomeStore(str(store_fasta)) as store:
+        assert store.accessions() == list(genomes)
+        for accession in genomes:
+            split_file = tmp_path / "split" / f"{accession}.fa"
+            # extract-genome.py gives back exactly the per-genome file
+            extracted = tmp_path / f"{accession}.extracted.fa"
+            run_script("extract-genome.py", store_fasta, accession, "-o", extracted)
+            assert extracted.read_bytes() == split_file.read_bytes()
+            assert store.length(accession) == sum(length for _, length in iter_fasta_lengths(str(split_file)))
+    assert (tmp_path / "store-lengths.csv").read_text() == (tmp_path / "split-lengths.csv").read_text()
+
+    # get-length-dict.py reads the lengths straight from the index
+    run_script("get-length-dict.py", "--genome-store", store_fasta, "--lengths-csv", tmp_path / "lengths.csv")
+    assert (tmp_path / "lengths.csv").read_text() == (tmp_path / "split-lengths.csv").read_text()
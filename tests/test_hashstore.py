@@ -0,0 +1,189 @@
+"""
+hashstore.py's vectorized kernels against the sourmash MinHash methods
+they replace, on synthetic sketches.
+
+This code is under CC0.
+"""
+import numpy as np
+import pytest
+import sourmash
+
+from conftest import random_minhashes
+from hashstore import (CoarsePrefilter, HashIndex, HashStore, ThresholdStats, compare_one_to_many,
+                       counts_at_max_hashes, max_hashes_for_scaled, passes_threshold, sorted_hashes)
+
+
+# boundary thresholds: 0.52, 0.67 and 0.751 split pairs differently with and
+# without the bias correction for tiny sketches
+THRESHOLDS = [0, 0.1, 0.34, 0.5, 0.52, 0.67, 0.751, 1.0]
+
+
+def store_of(minhashes):
+    store = HashStore()
+    for n, mh in enumerate(minhashes):
+        store.add_signature(f"sig{n}.sig", sourmash.SourmashSignature(mh, name=f"sig{n}"))
+    return store
+
+
+@pytest.fixture
+def minhashes(rng):
+    # tiny sketches get sourmash's bias correction; the larger ones don't
+    return (random_minhashes(40, rng, max_size=8) +
+            random_minhashes(40, rng, min_size=0, max_size=80, pool_size=120))
+
+
+def test_compare_matches_sourmash(minhashes):
+    store = store_of(minhashes)
+    rows = list(range(len(store)))
+    for query, query_mh in enumerate(minhashes):
+        result = store.compare(query, rows)
+        for target, target_mh in enumerate(minhashes):
+            assert result.common[target] == query_mh.count_common(target_mh)
+            assert result.query_containment[target] == query_mh.contained_by(target_mh)
+            assert result.target_containment[target] == target_mh.contained_by(query_mh)
+            assert result.max_containment[target] == query_mh.max_containment(target_mh)
+            assert result.jaccard[target] == query_mh.jaccard(target_mh)
+
+
+def test_compare_without_scaled_is_uncorrected(minhashes):
+    query = sorted_hashes(minhashes[0])
+    targets = [sorted_hashes(mh) for mh in minhashes]
+    offsets = np.cumsum([0] + [len(t) for t in targets])
+    result = compare_one_to_many(query, np.concatenate(targets), offsets)
+    for target, hashes in enumerate(targets):
+        common = len(np.intersect1d(query, hashes))
+        assert result.common[target] == common
+        assert result.query_containment[target] == (common / len(query) if len(query) else 0.0)
+        assert result.target_containment[target] == (common / len(hashes) if len(hashes) else 0.0)
+
+
+def test_store_rows(minhashes, rng):
+    store = store_of(minhashes)
+    assert len(store) == len(minhashes)
+    assert list(store.sizes) == [len(mh) for mh in minhashes]
+    for row, mh in enumerate(minhashes):
+        assert list(store.get_hashes(row)) == sorted(mh.hashes)
+    # rows are gathered in the order asked for, repeats and all
+    rows = [5, 0, 5, 79, 12]
+    hashes, offsets = store.gather(rows)
+    for n, row in enumerate(rows):
+        assert list(hashes[offsets[n]:offsets[n+1]]) == list(store.get_hashes(row))
+    # adding rows repacks the store, and its sizes
+    extra = random_minhashes(1, rng, max_size=5)[0]
+    store.add_signature("extra.sig", sourmash.SourmashSignature(extra, name="extra"))
+    assert list(store.sizes) == [len(mh) for mh in minhashes] + [len(extra)]
+
+
+def test_store_rejects_other_sketch_types(minhashes):
+    store = store_of(minhashes)
+    other = sourmash.MinHash(n=0, ksize=21, scaled=2)
+    with pytest.raises(ValueError):
+        store.add_signature("k21.sig", sourmash.SourmashSignature(other, name="k21"))
+
+
+def test_shared_store(minhashes):
+    store = store_of(minhashes)
+    rows = list(range(len(store)))
+    with store.share() as shared:
+        attached = HashStore.attach(shared.handle)
+        assert attached.names == store.names
+        assert np.array_equal(attached.hashes, store.hashes)
+        for query in (0, 17, 63):
+            expected, got = store.compare(query, rows), attached.compare(query, rows)
+            for field in expected._fields:
+                assert np.array_equal(getattr(expected, field), getattr(got, field))
+        for block in attached._shared_blocks:
+            block.close()
+
+
+def test_hash_index(minhashes):
+    index = HashIndex()
+    hashes = [sorted_hashes(mh) for mh in minhashes]
+    for n, h in enumerate(hashes):
+        index.add(n, h)
+    for query in hashes:
+        expected = {n: len(np.intersect1d(query, h)) for n, h in enumerate(hashes)}
+        expected = {n: common for n, common in expected.items() if common}
+        assert dict(index.count_common(query)) == expected
+        assert index.candidates(query) == set(expected)
+
+
+def test_counts_at_max_hashes_match_downsample(minhashes):
+    scaled_vals = [2, 3, 4, 10, 50]
+    max_hashes = max_hashes_for_scaled(scaled_vals)
+    for mh in minhashes:
+        counts = counts_at_max_hashes(sorted_hashes(mh), max_hashes)
+        assert list(counts) == [len(mh.downsample(scaled=scaled)) for scaled in scaled_vals]
+
+
+@pytest.mark.parametrize("threshold", THRESHOLDS)
+def test_passes_threshold_matches_sourmash(minhashes, threshold):
+    store = store_of(minhashes)
+    rows = list(range(len(store)))
+    for query, query_mh in enumerate(minhashes):
+        expected = [query_mh.max_containment(mh) >= threshold for mh in minhashes]
+
+        stats = ThresholdStats()
+        assert list(store.passes_threshold(query, rows, threshold, stats)) == expected
+        # each pair is pruned, or merged in the one pass over the survivors
+        assert stats.pairs == len(rows)
+        if threshold > 0:
+            assert stats.pruned_size + stats.pruned_range + stats.merged == stats.pairs
+
+        stats = ThresholdStats()
+        query_hashes = store.get_hashes(query)
+        # small chunks, so merges stop early
+        got = [passes_threshold(query_hashes, store.get_hashes(row), threshold, stats, chunk_size=3,
+                                scaled=store.scaled) for row in rows]
+        assert got == expected
+        assert stats.pairs == (stats.pruned_size + stats.pruned_range + stats.accepted_early +
+                               stats.rejected_early + stats.merged)
+
+
+@pytest.fixture
+def prefilter_minhashes(rng):
+    # enough hashes that a good share of them survive downsampling to scaled=8
+    return (random_minhashes(30, rng, min_size=1, max_size=40, pool_size=100) +
+            random_minhashes(30, rng, min_size=20, max_size=300, pool_size=400))
+
+
+@pytest.mark.parametrize("threshold", THRESHOLDS[1:])
+def test_exact_prefilter_never_rejects_a_passing_pair(prefilter_minhashes, threshold):
+    prefilter = CoarsePrefilter(8, threshold, mode='exact', scaled=2)
+    stats = ThresholdStats()
+    rejected = 0
+    for a in prefilter_minhashes:
+        for b in prefilter_minhashes:
+            passes = a.max_containment(b) >= threshold
+            if not prefilter.may_pass(sorted_hashes(a), sorted_hashes(b), stats):
+                assert not passes
+                rejected += 1
+    assert stats.prefiltered == rejected
+    # past very low thresholds it does reject pairs, too
+    assert rejected or threshold < 0.3
+
+
+@pytest.mark.parametrize("threshold", [0.1, 0.34, 0.5, 0.67])
+def test_estimate_prefilter_is_coarse_max_containment(prefilter_minhashes, threshold):
+    prefilter = CoarsePrefilter(8, threshold, mode='estimate', audit_fraction=1.0, scaled=2)
+    stats = ThresholdStats()
+    false_negatives = 0
+    for a in prefilter_minhashes:
+        for b in prefilter_minhashes:
+            coarse_a, coarse_b = a.downsample(scaled=8), b.downsample(scaled=8)
+            may_pass = prefilter.may_pass(sorted_hashes(a), sorted_hashes(b), stats)
+            if not (len(coarse_a) and len(coarse_b)):
+                # can't be judged at the coarse resolution
+                assert may_pass
+                continue
+            assert may_pass == (coarse_a.max_containment(coarse_b) >= threshold)
+            if not may_pass and a.max_containment(b) >= threshold:
+                false_negatives += 1
+    # with audit_fraction=1, every rejection is re-checked at full resolution
+    assert stats.audited == stats.prefiltered
+    assert stats.audit_false_negatives == false_negatives
+
+
+def test_prefilter_modes():
+    with pytest.raises(ValueError):
+        CoarsePrefilter(8, 0.5, mode='fast')
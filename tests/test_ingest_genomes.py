@@ -0,0 +1,63 @@
+"""
+ingest-genomes.py's single pass against the separate scripts it replaces,
+and its sketches against `sourmash sketch dna` on each genome's fasta.
+
+This code is under CC0.
+"""
+import sys
+import random
+import subprocess
+
+import sourmash
+
+from conftest import run_script, write_contigs
+
+
+def write_messy_contigs(filename, rng):
+    "contigs with lowercase and N runs, as assemblies have"
+    genomes = write_contigs(filename, rng, num_genomes=5, num_contigs=40)
+    text = filename.read_text().splitlines()
+    for n, line in enumerate(text):
+        if not line.startswith(">") and rng.random() < 0.5:
+            cut = rng.randrange(len(line) + 1)
+            text[n] = line[:cut].lower() + "N" * rng.randint(1, 40) + line[cut:]
+    filename.write_text("\n".join(text) + "\n")
+    return list(genomes)
+
+
+def sketch_info(sigs):
+    return sorted((str(sig), sig.minhash.ksize, sig.md5sum()) for sig in sigs)
+
+
+def test_outputs_match_separate_scripts(tmp_path):
+    fasta = tmp_path / "contigs.fa"
+    genomes = write_messy_contigs(fasta, random.Random(13))
+    run_script("ingest-genomes.py", fasta, "--output-dir", tmp_path / "ingested", "--output-csv", tmp_path / "ingested.csv",
+               "--output-names", tmp_path / "ingested.names.txt", "--output-lengths", tmp_path / "ingested.lengths.csv",
+               "--record-lengths", tmp_path / "ingested.records.csv",
+               "--length-distribution", tmp_path / "ingested.distribution.csv",
+               "--quantiles-csv", tmp_path / "ingested.quantiles.csv",
+               "--sig-output", tmp_path / "ingested.zip", "-k", 21, "-k", 31, "--scaled", 10, "--max-open-files", 2)
+
+    run_script("split-fasta-by-genome-dict.py", fasta, "--output-dir", tmp_path / "split", "--output-csv",
+               tmp_path / "split.csv", "--output-names", tmp_path / "split.names.txt",
+               "--output-lengths", tmp_path / "split.lengths.csv")
+    run_script("get-length-dict.py", "--fastafile", fasta, "--lengths-csv", tmp_path / "split.records.csv")
+    run_script("get-length-distribution.py", fasta, tmp_path / "split.distribution.csv",
+               "--quantiles-csv", tmp_path / "split.quantiles.csv")
+    # the genome files' paths differ with the output dir; everything else is the same
+    assert ((tmp_path / "ingested.csv").read_text().replace("ingested", "split") ==
+            (tmp_path / "split.csv").read_text())
+    for output in ("names.txt", "lengths.csv", "records.csv", "distribution.csv", "quantiles.csv"):
+        assert (tmp_path / f"ingested.{output}").read_bytes() == (tmp_path / f"split.{output}").read_bytes()
+    for genome in genomes:
+        assert (tmp_path / "ingested" / f"{genome}.fa").read_bytes() == (tmp_path / "split" / f"{genome}.fa").read_bytes()
+
+    expected = []
+    for genome in genomes:
+        output = tmp_path / f"{genome}.sig"
+        subprocess.run([sys.executable, "-m", "sourmash", "sketch", "dna", "-p", "k=21,k=31,scaled=10",
+                        "--name", genome, "-o", str(output), str(tmp_path / "split" / f"{genome}.fa")],
+                       check=True, capture_output=True)
+        expected += sourmash.load_file_as_signatures(str(output))
+    assert sketch_info(sourmash.load_file_as_signatures(str(tmp_path / "ingested.zip"))) == sketch_info(expected)
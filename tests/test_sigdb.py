@@ -0,0 +1,179 @@
+"""
+Signature databases and streamed JSON sig files against loading the same
+sketches with sourmash, the scripts run on a database against the same
+scripts run on sig files, and the bounded signature cache.
+
+This code is under CC0.
+"""
+import json
+
+import pandas as pd
+import pytest
+import sourmash
+from sourmash.sourmash_args import SaveSignaturesToLocation
+
+from conftest import original_comparisons, random_minhashes, run_script, write_sigdb, write_siglist
+from sigdb import (SigDB, SignatureCache, is_json_sigfile, is_sigdb, iter_json_objects, load_selected_signatures,
+                   load_signatures, signature_sources, sketch_location, split_location)
+
+
+def md5s(sigs):
+    return [sig.md5sum() for sig in sigs]
+
+
+@pytest.mark.parametrize("ksize", [21, 31])
+def test_select_like_sourmash(cluster_data, ksize):
+    db = SigDB(cluster_data.sigdb)
+    assert len(db) == len(cluster_data.sigs)
+    expected = md5s(sourmash.load_file_as_signatures(cluster_data.sigdb, ksize=ksize, select_moltype='DNA'))
+    assert md5s(db.signatures(ksize=ksize, moltype='dna')) == expected
+    # slices of the selection, as count-hashes hands them to workers
+    assert md5s(db.signatures(ksize=ksize, moltype='DNA', start=5, stop=12)) == expected[5:12]
+    assert md5s(load_signatures(cluster_data.sigdb, ksize=ksize, moltype='DNA')) == expected
+    assert db.select_rows(ksize=ksize, moltype='protein') == []
+
+
+def test_single_sketch_locations(cluster_data):
+    db = SigDB(cluster_data.sigdb)
+    assert sorted(db.accessions()) == sorted({acc for acc, _ in cluster_data.sigs})
+    for (acc, ksize), sig in cluster_data.sigs.items():
+        assert db.get(acc, ksize, 'DNA') == sig
+        location = db.location(acc, ksize, 'DNA')
+        assert location == sketch_location(cluster_data.sigdb, sig)
+        assert split_location(location) == (cluster_data.sigdb, sig.md5sum())
+        assert is_sigdb(location)
+        assert list(load_signatures(location)) == [sig]
+    with pytest.raises(KeyError):
+        db.get("g0", 51, 'DNA')
+    # sig files are their own location
+    assert sketch_location(cluster_data.siglist, sig) == cluster_data.siglist
+
+
+def test_signature_sources(cluster_data):
+    assert signature_sources(cluster_data.sigdb) == [cluster_data.sigdb]
+    assert signature_sources(cluster_data.siglist) == open(cluster_data.siglist).read().split()
+
+
+def test_find_founders_on_a_database(tmp_path, mixed_sigs):
+    siglist = write_siglist(tmp_path / "siglist.txt", mixed_sigs)
+    sigdb = write_sigdb(tmp_path / "sigs.zip", mixed_sigs)
+    for name, sigs in (("files", siglist), ("sigdb", sigdb)):
+        run_script("find-founders.py", "--siglist", sigs, "--threshold", 0.3, "--batch-size", 20,
+                   "--prefix", tmp_path / name)
+    # the same clustering, with database sketches listed by their own locations
+    md5_sources = {sig.md5sum(): f"{sigdb}#{sig.md5sum()}" for _, sig in mixed_sigs}
+    file_sources = {sig_from: md5_sources[sig.md5sum()] for sig_from, sig in mixed_sigs}
+    for output in ("founders", "members"):
+        from_files = open(tmp_path / f"files.{output}.siglist.txt").read().split()
+        from_sigdb = open(tmp_path / f"sigdb.{output}.siglist.txt").read().split()
+        assert from_sigdb == [file_sources[source] for source in from_files]
+
+
+def test_count_hashes_on_a_database(tmp_path, mixed_sigs):
+    siglist = write_siglist(tmp_path / "siglist.txt", mixed_sigs)
+    sigdb = write_sigdb(tmp_path / "sigs.zip", mixed_sigs)
+    with open(tmp_path / "lengths.csv", 'wt') as fp:
+        for _, sig in mixed_sigs:
+            fp.write(f"{sig},1000\n")
+    outputs = []
+    for name, sigs, args in (("files", siglist, []), ("sigdb", sigdb, ["--sigdb-chunk-size", 7, "--processes", 2])):
+        outputs.append(tmp_path / f"{name}.csv")
+        run_script("count-hashes.py", "--siglist", sigs, "--length-csv", tmp_path / "lengths.csv",
+                   "--output-csv", outputs[-1], "-s", 10, *args)
+    assert outputs[0].read_bytes() == outputs[1].read_bytes()
+
+
+def test_cluster_compare_on_a_database(tmp_path, cluster_data):
+    output = tmp_path / "compare.csv"
+    run_script("cluster-compare.py", "--siglist", cluster_data.sigdb, "--comparison-csv", cluster_data.comparison_csv,
+               "--alphabet", "nucleotide", "--ksize", 31, "--output-csv", output)
+    expected = original_comparisons(cluster_data, "nucleotide", 31, 100)
+    pd.testing.assert_frame_equal(pd.read_csv(output, float_precision="round_trip"), expected, check_exact=True)
+
+
+def sig_keys(cluster_data, location):
+    "a cache key per genome and ksize, with the location it's read from"
+    return {(location(acc, ksize), ksize, 'DNA'): sig for (acc, ksize), sig in cluster_data.sigs.items()}
+
+
+def test_cache_is_lru(cluster_data):
+    keys = list(sig_keys(cluster_data, lambda acc, ksize: f"{cluster_data.sigdir}/p-{acc}.sig"))
+    cache = SignatureCache(2)
+    cache.get(*keys[0])
+    cache.get(*keys[1])
+    cache.get(*keys[0])
+    cache.get(*keys[2])
+    # keys[1] was the least recently used
+    assert keys[0] in cache and keys[2] in cache and keys[1] not in cache
+    assert (cache.hits, cache.misses, cache.evictions) == (1, 3, 1)
+    with pytest.raises(ValueError):
+        cache.get(keys[0][0], 51, 'DNA')
+
+
+@pytest.mark.parametrize("threads", [1, 3])
+def test_prefetch_stays_within_the_cache(cluster_data, threads):
+    expected = sig_keys(cluster_data, lambda acc, ksize: f"{cluster_data.sigdir}/p-{acc}.sig")
+    cache = SignatureCache(5)
+    assert cache.prefetch(expected, threads=threads) == 5
+    assert len(cache) == 5 and cache.evictions == 0
+    for key in list(cache.sigs):
+        assert cache.get(*key) == expected[key]
+
+
+@pytest.mark.parametrize("threads", [1, 3])
+@pytest.mark.parametrize("source", ["sigfiles", "sigdb"])
+def test_prefetch_on_load(cluster_data, threads, source):
+    if source == "sigdb":
+        db = SigDB(cluster_data.sigdb)
+        expected = sig_keys(cluster_data, lambda acc, ksize: db.location(acc, ksize, 'DNA'))
+    else:
+        expected = sig_keys(cluster_data, lambda acc, ksize: f"{cluster_data.sigdir}/p-{acc}.sig")
+    cache = SignatureCache(3)
+    cache.get(*next(iter(expected)))
+    loaded = []
+    cache.prefetch(expected, threads=threads, on_load=lambda key, sig: loaded.append((key, sig)))
+    # every key, once, with its own sig, though only a few stay cached
+    assert sorted(loaded) == sorted(expected.items())
+    assert len(cache) == 3
+    assert (cache.hits, cache.misses) == (1, len(expected))
+
+
+def test_load_location_reads_every_param(cluster_data):
+    location = f"{cluster_data.sigdir}/p-g3.sig"
+    cache = SignatureCache()
+    keys = [(location, 31, 'DNA'), (location, 21, 'DNA')]
+    assert cache._load_location(keys) == [cluster_data.sigs[("g3", 31)], cluster_data.sigs[("g3", 21)]]
+    with pytest.raises(ValueError):
+        cache._load_location(keys + [(location, 10, 'protein')])
+
+
+def test_load_selected_like_sourmash(cluster_data):
+    names = {"g1 synthetic genome", "g5 synthetic genome", "g30 synthetic genome", "g99 synthetic genome"}
+    expected = [sig for sig in sourmash.load_file_as_signatures(cluster_data.sigfile, ksize=21, select_moltype='DNA')
+                if str(sig) in names]
+    assert len(expected) == 3
+    assert list(load_selected_signatures(cluster_data.sigfile, names, params=[(21, 'dna')])) == expected
+    # every param, in file order
+    expected = [sig for sig in sourmash.load_file_as_signatures(cluster_data.sigfile) if str(sig) in names]
+    assert list(load_selected_signatures(cluster_data.sigfile, names)) == expected
+    assert is_json_sigfile(cluster_data.sigfile) and not is_json_sigfile(cluster_data.sigdb)
+
+
+# names with the bytes the scanner has to skip over inside strings
+TRICKY_NAMES = ['plain', 'a "quoted" name', 'braces } { in }} a name', 'back\\slash\\', 'ends in \\"',
+                'unicode é ✓ name', '[brackets], "and" {"json": [1]}']
+
+
+def test_iter_json_objects_tricky_names(tmp_path, rng):
+    sigfile = str(tmp_path / "tricky.sig")
+    minhashes = random_minhashes(len(TRICKY_NAMES), rng)
+    sigs = [sourmash.SourmashSignature(mh, name=name) for mh, name in zip(minhashes, TRICKY_NAMES)]
+    with SaveSignaturesToLocation(sigfile) as save_sigs:
+        for sig in sigs:
+            save_sigs.add(sig)
+    expected = json.load(open(sigfile))
+    for block_size in (1, 2, 3, 7, 64, 1 << 20):
+        with open(sigfile, 'rb') as fp:
+            assert [json.loads(obj) for obj in iter_json_objects(fp, block_size=block_size)] == expected
+    selected = set(TRICKY_NAMES[1::2])
+    assert list(load_selected_signatures(sigfile, selected)) == [sig for sig in sigs if str(sig) in selected]
@@ -0,0 +1,88 @@
+"""
+sketch-proteomes.py against `sourmash sketch protein`, run once per
+proteome as the pipeline did before.
+
+This code is under CC0.
+"""
+import sys
+import subprocess
+
+import pytest
+import sourmash
+
+from conftest import load_script, run_script
+
+PARAM_STRS = ["protein,k=7,k=10,scaled=1,abund", "dayhoff,k=16,scaled=2", "hp,k=33,num=50,seed=7"]
+
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+
+
+def write_proteomes(tmp_path, rng, num_genomes=6):
+    "(genome, fasta) pairs of random proteomes; genome 3 has no proteins"
+    proteomes = []
+    for n in range(num_genomes):
+        filename = tmp_path / f"GCA_{n}.proteins.fasta"
+        num_proteins = 0 if n == 3 else rng.randint(1, 8)
+        with open(filename, 'wt') as fp:
+            for p in range(num_proteins):
+                protein = "".join(rng.choice(AMINO_ACIDS) for _ in range(rng.randint(20, 300)))
+                fp.write(f">GCA_{n}_protein{p}\n{protein}\n")
+        proteomes.append((f"GCA_{n}", str(filename)))
+    with open(tmp_path / "proteins.csv", 'wt') as fp:
+        fp.write("genome,proteins\n")
+        fp.writelines(f"{genome},{filename}\n" for genome, filename in proteomes)
+    return proteomes
+
+
+def sourmash_sketches(tmp_path, genome, filename):
+    "sketch one proteome with the sourmash command line"
+    output = tmp_path / f"{genome}.sig"
+    cmd = [sys.executable, "-m", "sourmash", "sketch", "protein", "--name", genome, "-o", str(output), filename]
+    for param_str in PARAM_STRS:
+        cmd += ["-p", param_str]
+    subprocess.run(cmd, check=True, capture_output=True)
+    return list(sourmash.load_file_as_signatures(str(output)))
+
+
+def sketch_info(sigs):
+    return [(str(sig), sig.md5sum(), sig.minhash.moltype, sig.minhash.ksize, sig.minhash.hashes) for sig in sigs]
+
+
+@pytest.mark.parametrize("processes", [1, 3])
+def test_sketches_match_sourmash_sketch(tmp_path, rng, processes):
+    proteomes = write_proteomes(tmp_path, rng)
+    args = ["--proteins-csv", tmp_path / "proteins.csv", "--processes", processes, "--chunksize", 1]
+    for param_str in PARAM_STRS:
+        args += ["-p", param_str]
+    run_script("sketch-proteomes.py", *args, "-o", tmp_path / "sketches.zip")
+
+    expected = []
+    for genome, filename in proteomes:
+        if genome != "GCA_3":
+            expected += sourmash_sketches(tmp_path, genome, filename)
+    # in proteome order, with nothing for the empty proteome
+    assert sketch_info(sourmash.load_file_as_signatures(str(tmp_path / "sketches.zip"))) == sketch_info(expected)
+
+
+def test_shards_cover_every_proteome(tmp_path, rng):
+    write_proteomes(tmp_path, rng)
+    everything = []
+    for shard in range(3):
+        output = tmp_path / f"shard{shard}.zip"
+        run_script("sketch-proteomes.py", "--proteins-csv", tmp_path / "proteins.csv", "-p", PARAM_STRS[0],
+                   "--shard", shard, "--num-shards", 3, "-o", output)
+        everything += sourmash.load_file_as_signatures(str(output))
+    run_script("sketch-proteomes.py", "--proteins-csv", tmp_path / "proteins.csv", "-p", PARAM_STRS[0],
+               "-o", tmp_path / "all.zip")
+    assert sorted(sketch_info(everything)) == sorted(sketch_info(sourmash.load_file_as_signatures(str(tmp_path / "all.zip"))))
+
+
+def test_param_strings():
+    sp = load_script("sketch-proteomes.py")
+    # sourmash sketch's defaults for whatever the string leaves out
+    assert sp.parse_param_string("dayhoff") == [sp.SketchParams("dayhoff", 16, 200, 0, 42, False)]
+    assert sp.parse_param_string("k=8,k=9,num=100,abund") == [sp.SketchParams("protein", 8, 0, 100, 42, True),
+                                                              sp.SketchParams("protein", 9, 0, 100, 42, True)]
+    for bad in ("protein,k=x", "protein,scaled=10,num=10", "dna,k=21"):
+        with pytest.raises(ValueError):
+            sp.parse_param_string(bad)
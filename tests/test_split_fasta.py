@@ -0,0 +1,32 @@
+"""
+split-fasta-by-genome-dict.py, with a bounded number of open output files,
+against grouping the records by genome with screed.
+
+This code is under CC0.
+"""
+import random
+
+import pandas as pd
+import screed
+
+from conftest import run_script, write_contigs
+
+
+def test_split_by_genome(tmp_path):
+    genomes = write_contigs(tmp_path / "contigs.fa", random.Random(9))
+    outdir = tmp_path / "split"
+    # fewer open files than genomes, so files are closed and reopened to append
+    run_script("split-fasta-by-genome-dict.py", tmp_path / "contigs.fa", "--output-dir", outdir,
+               "--output-csv", tmp_path / "files.csv", "--output-lengths", tmp_path / "lengths.csv",
+               "--output-names", tmp_path / "names.txt", "--max-open-files", 2)
+
+    files = pd.read_csv(tmp_path / "files.csv")
+    assert list(files["accession"]) == list(genomes)
+    for accession, filename in zip(files["accession"], files["filename"]):
+        assert filename == str(outdir / f"{accession}.fa")
+        with screed.open(filename) as records:
+            assert [(record.name, record.sequence) for record in records] == genomes[accession]
+    assert (tmp_path / "names.txt").read_text() == "".join(f"{accession}\n" for accession in genomes)
+    expected_lengths = "".join(f"{accession},{sum(len(seq) for _, seq in records)}\n"
+                               for accession, records in genomes.items())
+    assert (tmp_path / "lengths.csv").read_text() == expected_lengths
@@ -0,0 +1,128 @@
+"""
+TableWriter's chunked csv and Parquet tables against writing the whole
+table at once with pandas, and read_table against filtering it in pandas.
+
+This code is under CC0.
+"""
+import random
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet
+import pytest
+
+from conftest import run_script
+from tableio import TableWriter, open_output, read_table, table_format
+
+COLUMNS = ["name", "alpha-ksize", "count", "fraction"]
+
+TABLE_FILENAMES = ["table.csv", "table.csv.gz", "table.csv.bz2", "table.csv.xz", "table.csv.zip", "table.parquet"]
+
+
+@pytest.fixture
+def table():
+    rng = random.Random(7)
+    rows = [(f"g{n}", alpha_ksize, rng.randint(0, 1000), rng.random())
+            for alpha_ksize in ("protein-10", "dayhoff-16", "DNA-21") for n in range(rng.randint(5, 30))]
+    return pd.DataFrame.from_records(rows, columns=COLUMNS)
+
+
+def write_table(filename, table, chunk_rows, **kw):
+    "write table as rows and dataframes, mixed, flushing at each alpha-ksize"
+    with TableWriter(str(filename), COLUMNS, chunk_rows=chunk_rows, **kw) as writer:
+        for _, part in table.groupby("alpha-ksize", sort=False):
+            rows = list(part.itertuples(index=False, name=None))
+            writer.extend(rows[:4])
+            # columns in another order are put back in the table's
+            writer.write_frame(part.iloc[4:][COLUMNS[::-1]])
+            writer.flush()
+    return writer
+
+
+def expected_table(tmp_path, table, filename):
+    "table as pandas reads it back: a csv's floats as pd.read_csv parses them"
+    if filename.endswith(".parquet"):
+        return table
+    table.to_csv(tmp_path / "whole.csv", index=False)
+    return pd.read_csv(tmp_path / "whole.csv")
+
+
+@pytest.mark.parametrize("filename", TABLE_FILENAMES)
+@pytest.mark.parametrize("chunk_rows", [1, 7, 100000])
+def test_round_trip(tmp_path, table, filename, chunk_rows):
+    writer = write_table(tmp_path / filename, table, chunk_rows)
+    assert writer.num_rows == len(table)
+    pd.testing.assert_frame_equal(read_table(str(tmp_path / filename)), expected_table(tmp_path, table, filename),
+                                  check_exact=True)
+
+
+def test_chunked_csv_is_pandas_csv(tmp_path, table):
+    write_table(tmp_path / "chunked.csv", table, 7)
+    table.to_csv(tmp_path / "whole.csv", index=False)
+    assert (tmp_path / "chunked.csv").read_bytes() == (tmp_path / "whole.csv").read_bytes()
+
+
+def test_parquet_row_groups(tmp_path, table):
+    writer = write_table(tmp_path / "table.parquet", table, 7)
+    # full chunks, and a shorter one at the end of each alpha-ksize
+    expected = [len(chunk) for _, part in table.groupby("alpha-ksize", sort=False)
+                for chunk in np.array_split(part, range(7, len(part), 7))]
+    metadata = pyarrow.parquet.ParquetFile(str(tmp_path / "table.parquet")).metadata
+    assert [metadata.row_group(n).num_rows for n in range(metadata.num_row_groups)] == expected
+    assert writer.chunks_written == len(expected)
+
+
+@pytest.mark.parametrize("filename", ["table.csv", "table.csv.gz", "table.parquet"])
+def test_read_columns_and_filters(tmp_path, table, filename):
+    write_table(tmp_path / filename, table, 7)
+    table = expected_table(tmp_path, table, filename)
+    filename = str(tmp_path / filename)
+    selected = table[table["alpha-ksize"].isin(["DNA-21", "protein-10"])]
+    pd.testing.assert_frame_equal(read_table(filename, filters={"alpha-ksize": ["DNA-21", "protein-10"]}),
+                                  selected.reset_index(drop=True), check_exact=True)
+    # a filter column needn't be one of the columns read back
+    selected = table[table["alpha-ksize"] == "dayhoff-16"][["count", "name"]]
+    pd.testing.assert_frame_equal(read_table(filename, columns=["count", "name"], filters={"alpha-ksize": ["dayhoff-16"]},
+                                             chunksize=5),
+                                  selected.reset_index(drop=True), check_exact=True)
+    assert len(read_table(filename, filters={"alpha-ksize": ["none-1"]})) == 0
+
+
+@pytest.mark.parametrize("filename", ["table.csv", "table.parquet"])
+def test_empty_table(tmp_path, filename):
+    TableWriter(str(tmp_path / filename), COLUMNS).close()
+    assert list(read_table(str(tmp_path / filename)).columns) == COLUMNS
+    if filename.endswith(".csv"):
+        assert (tmp_path / filename).read_text() == ",".join(COLUMNS) + "\n"
+
+
+def test_parquet_dtypes(tmp_path):
+    # the first chunk's counts are all missing, so only dtypes can say they're ints
+    with TableWriter(str(tmp_path / "table.parquet"), ["name", "count"], chunk_rows=2,
+                     dtypes={"count": "Int64"}) as writer:
+        writer.extend([("a", None), ("b", None), ("c", 3), ("d", 4)])
+    assert read_table(str(tmp_path / "table.parquet"))["count"].tolist() == [pd.NA, pd.NA, 3, 4]
+
+
+def test_formats():
+    assert table_format("x.csv.gz") == "csv" and table_format("x.pq") == "parquet"
+    assert table_format("x.parquet", "csv") == "csv"
+    with pytest.raises(ValueError):
+        table_format("x.csv", "tsv")
+    with pytest.raises(ValueError):
+        open_output("x.csv.zst")
+
+
+def test_cluster_compare_parquet(tmp_path, cluster_data):
+    outputs = {}
+    for filename in ("compare.csv", "compare.parquet"):
+        outputs[filename] = tmp_path / filename
+        run_script("cluster-compare.py", "--siglist", cluster_data.siglist, "--sig-prefix", "p-",
+                   "--comparison-csv", cluster_data.comparison_csv, "--alpha-ksize", "DNA-k21", "DNA-k31",
+                   "--chunk-rows", 5, "--output-csv", outputs[filename])
+    from_csv = pd.read_csv(outputs["compare.csv"], float_precision="round_trip")
+    pd.testing.assert_frame_equal(read_table(str(outputs["compare.parquet"])), from_csv, check_exact=True)
+    # just one alpha-ksize's row groups, and two of its columns
+    selected = from_csv[from_csv["alpha-ksize"] == "DNA-31"][["comparison_name", "jaccard"]].reset_index(drop=True)
+    pd.testing.assert_frame_equal(read_table(str(outputs["compare.parquet"]), columns=["comparison_name", "jaccard"],
+                                             filters={"alpha-ksize": ["DNA-31"]}), selected, check_exact=True)
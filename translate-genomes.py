@@ -0,0 +1,196 @@
+#! /usr/bin/env python
+"""
+Translate a shard of genomes with prodigal, in a local worker pool.
+
+Submitting one cluster job per genome spends more time on scheduling and
+job startup than on prodigal itself for small viral genomes. This runs a
+whole shard of genomes inside one job instead, still writing the usual
+per-genome `{prefix}-{genome}.genes.gff3` and `.proteins.fasta` outputs,
+and reports how long each genome took.
+
+Genomes come from the split fasta files (--fastasplit-csv) or from a
+genome store (--genome-store), and are assigned to shards round-robin in
+names-file order. Like the per-genome rule, genomes under 100kb are run
+in meta mode and longer ones in single mode.
+
+This code is under CC0.
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+import multiprocessing
+from collections import namedtuple
+
+import pandas as pd
+
+from fastautils import make_outdir, total_length
+from genomestore import GenomeStore
+
+TranslateInfo = namedtuple('TranslateInfo', 'genome, genome_length, mode, seconds, returncode, gff, proteins')
+
+
+def check_length(genome_len):
+    # prodigal single mode fails if the sequence is less than 20kb. use meta instead
+    if genome_len < 100000:
+        return "meta"
+    return "single"
+
+
+def shard_genomes(names, shard, num_shards):
+    "round-robin assignment of genomes to shards, by position in the names list"
+    return [name for n, name in enumerate(names) if n % num_shards == shard]
+
+
+# per-process settings; set once by the pool initializer
+_worker_args = None
+_store = None
+
+def _init_translate_worker(genome_store, genome_files, settings):
+    global _worker_args, _store
+    _worker_args = (genome_files, settings)
+    if genome_store:
+        _store = GenomeStore(genome_store)
+
+
+def translate_genome(genome, genome_len):
+    genome_files, settings = _worker_args
+    prefix = settings["prefix"]
+    gff = os.path.join(settings["output_dir"], f"{prefix}{genome}.genes.gff3")
+    proteins = os.path.join(settings["output_dir"], f"{prefix}{genome}.proteins.fasta")
+    if genome_len is None:
+        genome_len = _store.length(genome) if _store is not None else total_length(genome_files[genome])
+    mode = check_length(genome_len)
+    if settings["skip_existing"] and os.path.exists(gff) and os.path.exists(proteins):
+        return TranslateInfo(genome, genome_len, mode, 0.0, 0, gff, proteins)
+
+    # write to temporary names, so a failed or interrupted run leaves no partial outputs
+    gff_tmp, proteins_tmp = gff + ".tmp", proteins + ".tmp"
+    cmd = [settings["prodigal"], "-o", gff_tmp, "-a", proteins_tmp, "-f", "gff", "-p", mode]
+    genome_bytes = None
+    if _store is not None:
+        # prodigal reads the genome from stdin when there's no -i
+        genome_bytes = _store.get_bytes(genome)
+    else:
+        cmd += ["-i", genome_files[genome]]
+
+    start = time.perf_counter()
+    if settings["log_dir"]:
+        log = open(os.path.join(settings["log_dir"], f"{prefix}{genome}.prodigal.log"), "wb")
+    else:
+        log = subprocess.DEVNULL
+    try:
+        returncode = subprocess.run(cmd, input=genome_bytes, stdout=log, stderr=subprocess.STDOUT).returncode
+    finally:
+        if settings["log_dir"]:
+            log.close()
+    seconds = time.perf_counter() - start
+
+    if returncode == 0:
+        os.replace(gff_tmp, gff)
+        os.replace(proteins_tmp, proteins)
+    else:
+        for tmpfile in (gff_tmp, proteins_tmp):
+            if os.path.exists(tmpfile):
+                os.remove(tmpfile)
+    return TranslateInfo(genome, genome_len, mode, seconds, returncode, gff, proteins)
+
+
+def _translate_genome_worker(job):
+    return translate_genome(*job)
+
+
+def main(args):
+    with open(args.names, 'rt') as fp:
+        names = [x.rstrip() for x in fp if x.strip()]
+    genomes = shard_genomes(names, args.shard, args.num_shards)
+    print(f"Translating {len(genomes)} of {len(names)} genomes (shard {args.shard} of {args.num_shards}) "
+          f"with {args.processes} processes")
+
+    genome_files = {}
+    if args.fastasplit_csv:
+        splitDF = pd.read_csv(args.fastasplit_csv, header=0)
+        genome_files = dict(zip(splitDF.accession.astype(str), splitDF.filename))
+    elif not args.genome_store:
+        print("** Error: please provide genomes via --fastasplit-csv or --genome-store")
+        sys.exit(-1)
+
+    # lengths decide single vs meta mode; read them from the lengths file if we have it,
+    # otherwise each worker gets them from the store index or the genome's fasta
+    genome_lengths = {}
+    if args.lengths:
+        lenDF = pd.read_csv(args.lengths, names=["name", "length"], dtype={"name": str})
+        genome_lengths = dict(zip(lenDF.name, lenDF.length))
+
+    make_outdir(args.output_dir)
+    if args.log_dir:
+        make_outdir(args.log_dir)
+    settings = {"prefix": f"{args.prefix}-" if args.prefix else "", "output_dir": args.output_dir,
+                "log_dir": args.log_dir, "prodigal": args.prodigal, "skip_existing": args.skip_existing}
+    initargs = (args.genome_store, genome_files, settings)
+    jobs = [(genome, genome_lengths.get(genome)) for genome in genomes]
+
+    # the longest genomes go first, so a slow one doesn't end up last and run on its own
+    if genome_lengths:
+        jobs.sort(key=lambda job: -job[1])
+
+    start = time.perf_counter()
+    results = []
+    if args.processes > 1:
+        with multiprocessing.Pool(args.processes, initializer=_init_translate_worker, initargs=initargs) as pool:
+            for info in pool.imap_unordered(_translate_genome_worker, jobs):
+                results.append(info)
+                if len(results) % 1000 == 0:
+                    print(f"...translated {len(results)}/{len(jobs)} genomes")
+    else:
+        _init_translate_worker(*initargs)
+        for job in jobs:
+            results.append(translate_genome(*job))
+            if len(results) % 1000 == 0:
+                print(f"...translated {len(results)}/{len(jobs)} genomes")
+    elapsed = time.perf_counter() - start
+
+    # timing rows in names-file order
+    order = {genome: n for n, genome in enumerate(genomes)}
+    results.sort(key=lambda info: order[info.genome])
+    timingDF = pd.DataFrame.from_records(results, columns=TranslateInfo._fields)
+    timingDF.to_csv(args.timing_csv, index=False)
+
+    failed = timingDF[timingDF["returncode"] != 0]
+    prodigal_seconds = timingDF["seconds"].sum()
+    print(f"translated {len(timingDF) - len(failed)} genomes in {elapsed:.1f}s "
+          f"({prodigal_seconds:.1f}s of prodigal time; {args.processes} processes)")
+    if len(timingDF):
+        for mode, modeDF in timingDF.groupby("mode"):
+            print(f"  {mode}: {len(modeDF)} genomes, {modeDF['seconds'].mean():.2f}s mean, "
+                  f"{modeDF['seconds'].max():.2f}s max")
+        slowest = timingDF.nlargest(5, "seconds")
+        print("slowest genomes:\n" + slowest[["genome", "genome_length", "mode", "seconds"]].to_string(index=False))
+    if len(failed):
+        print(f"** Error: prodigal failed for {len(failed)} genomes: {', '.join(failed['genome'].head(10))}")
+        sys.exit(1)
+
+
+def cmdline(sys_args):
+    "Command line entry point w/argparse action."
+    p = argparse.ArgumentParser()
+    p.add_argument("--names", required=True, help="genome names, one per line (split-fasta-by-genome-dict.py --output-names)")
+    p.add_argument("--fastasplit-csv", help="accession,filename csv of per-genome fasta files")
+    p.add_argument("--genome-store", help="alternatively, read genomes from this genome store")
+    p.add_argument("--lengths", help="genome lengths csv ('name,length'), to pick single vs meta mode")
+    p.add_argument("--output-dir", required=True, help="directory for the gff3 and proteins fasta outputs")
+    p.add_argument("--prefix", help="output files are named {prefix}-{genome}.*")
+    p.add_argument("--timing-csv", required=True, help="per-genome timing and status for this shard")
+    p.add_argument("--log-dir", help="write each genome's prodigal log here")
+    p.add_argument("--shard", type=int, default=0, help="which shard of the genomes to translate")
+    p.add_argument("--num-shards", type=int, default=1, help="number of shards the genomes are split into")
+    p.add_argument("--processes", type=int, default=1, help="number of prodigal processes to run at once")
+    p.add_argument("--prodigal", default="prodigal", help="prodigal executable")
+    p.add_argument("--skip-existing", action="store_true", help="don't rerun genomes whose outputs already exist")
+    args = p.parse_args()
+    return main(args)
+
+if __name__ == '__main__':
+    returncode = cmdline(sys.argv[1:])
+    sys.exit(returncode)